@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Период сверки с fetch_balance (сек) и расхождение, о котором стоит предупредить (доля)
+RECONCILE_INTERVAL = 60
+DRIFT_WARNING = 0.01
+
+
+class BalanceLedger:
+    """
+    Локальная книга свободных балансов.
+
+    Засевается одним fetch_balance, дальше обновляется по исполненным ордерам
+    (apply_order) и событиям приватного потока wallet (apply_wallet_event),
+    а в фоне периодически сверяется с биржей. Проверка баланса перед ногой -
+    чтение словаря без запроса к бирже.
+
+    Снимки wallet и fetch_balance абсолютные, а исполнения - приращения, поэтому
+    приращения хранятся с временем исполнения: после снимка заново применяются
+    только те, что произошли позже него (иначе исполнение посчиталось бы дважды).
+    Результат ордера может прийти и после снимка, который уже его учёл, поэтому
+    время последнего снимка хранится по монетам, и такие приращения не применяются.
+
+    Parameters
+    ----------
+    fetcher : callable
+        Асинхронная функция вида fetch_with_rate_limit(client, method, *args, **kwargs).
+    """
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self.free = {}
+        self.pending = []  # (время исполнения, мс; [(coin, delta), ...])
+        self.snapshot_time = 0.0  # время последнего полного снимка fetch_balance, мс
+        self.coin_snapshots = {}  # coin -> время последнего снимка wallet этой монеты, мс
+        self.seeded = False
+        self.updated = 0.0
+        self.stats = {"reconciles": 0, "fills": 0, "events": 0, "drifts": 0}
+
+    def get(self, coin):
+        return self.free.get(coin, 0)
+
+    def balances(self):
+        """
+        Балансы в формате fetch_balance ({coin: {'free': ...}}).
+        """
+        return {coin: {'free': free} for coin, free in self.free.items()}
+
+    def covered(self, coin, executed):
+        """
+        True, если последний снимок монеты coin сделан не раньше исполнения executed (мс).
+        """
+        return max(self.snapshot_time, self.coin_snapshots.get(coin, 0)) >= executed
+
+    def adjust(self, coin, delta):
+        self.free[coin] = self.free.get(coin, 0) + delta
+        self.updated = time.time()
+
+    async def reconcile(self, client):
+        """
+        Сверяет книгу с fetch_balance и заменяет её содержимое снимком биржи.
+
+        Returns
+        -------
+        bool
+            True, если снимок получен.
+        """
+        requested = time.time() * 1000
+        balances = await self.fetcher(client, 'fetch_balance')
+        if balances is None:
+            return False
+
+        free = {coin: amount for coin, amount in (balances.get('free') or {}).items() if amount is not None}
+        if self.seeded:
+            for coin, amount in free.items():
+                local = self.free.get(coin, 0)
+                if abs(local - amount) > max(abs(amount), abs(local)) * DRIFT_WARNING:
+                    self.stats["drifts"] += 1
+                    logger.warning(f"Расхождение баланса {coin}: в книге {local}, на бирже {amount}")
+
+        self.free = free
+        self.snapshot_time = requested
+        self.replay_pending(requested)
+        self.seeded = True
+        self.updated = time.time()
+        self.stats["reconciles"] += 1
+        return True
+
+    def apply_order(self, order):
+        """
+        Учитывает исполнение ордера ccxt: base/quote по side, filled и cost, комиссия - в её монете.
+
+        Returns
+        -------
+        bool
+            True, если в ордере были объёмы исполнения.
+        """
+        if not order or not order.get('symbol') or not order.get('filled'):
+            return False
+        base, quote = order['symbol'].split('/')
+        quote = quote.split(':')[0]
+        filled = order['filled']
+        cost = order.get('cost') or filled * (order.get('average') or order.get('price') or 0)
+
+        sign = 1 if order.get('side') == 'buy' else -1
+        deltas = [(base, sign * filled), (quote, -sign * cost)]
+        for fee in order.get('fees') or ([order['fee']] if order.get('fee') else []):
+            if fee and fee.get('cost') and fee.get('currency'):
+                deltas.append((fee['currency'], -fee['cost']))
+
+        executed = order.get('lastUpdateTimestamp') or order.get('lastTradeTimestamp') or order.get('timestamp')
+        executed = executed or time.time() * 1000
+        # Монеты, чей снимок уже новее исполнения, его учли - применяются только остальные
+        deltas = [(coin, delta) for coin, delta in deltas if not self.covered(coin, executed)]
+        for coin, delta in deltas:
+            self.adjust(coin, delta)
+        if deltas:
+            self.pending.append((executed, deltas))
+        self.stats["fills"] += 1
+        return True
+
+    def replay_pending(self, snapshot_time, coins=None):
+        """
+        После абсолютного снимка (время snapshot_time, мс) заново применяет исполнения,
+        которые произошли позже и поэтому в снимок не вошли; более ранние забываются.
+        Если снимок покрывает только монеты coins, забываются только их изменения:
+        изменения остальных монет ждут снимка, в который они войдут.
+        """
+        pending = []
+        for executed, deltas in self.pending:
+            if executed > snapshot_time:
+                pending.append((executed, deltas))
+                for coin, delta in deltas:
+                    if coins is None or coin in coins:
+                        self.adjust(coin, delta)
+            elif coins is not None:
+                rest = [(coin, delta) for coin, delta in deltas if coin not in coins]
+                if rest:
+                    pending.append((executed, rest))
+        self.pending = pending
+
+    def apply_wallet_event(self, message):
+        """
+        Применяет сообщение приватного потока Bybit wallet (балансы монет - абсолютные значения).
+        """
+        coins = set()
+        for account in message.get('data') or []:
+            for coin in account.get('coin') or []:
+                free = coin.get('free')
+                if free in (None, ''):
+                    free = float(coin.get('walletBalance') or 0) - float(coin.get('locked') or 0)
+                self.free[coin['coin']] = float(free)
+                coins.add(coin['coin'])
+        snapshot_time = message.get('creationTime') or time.time() * 1000
+        for coin in coins:
+            self.coin_snapshots[coin] = max(self.coin_snapshots.get(coin, 0), snapshot_time)
+        self.replay_pending(snapshot_time, coins)
+        self.updated = time.time()
+        self.stats["events"] += 1
+
+    async def run(self, client, interval=RECONCILE_INTERVAL):
+        """
+        Фоновая сверка с биржей раз в interval секунд.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self.reconcile(client)
+
+    def summary(self):
+        age = time.time() - self.updated if self.updated else float('nan')
+        return (f"сверок {self.stats['reconciles']}, исполнений {self.stats['fills']}, "
+                f"событий {self.stats['events']}, расхождений {self.stats['drifts']}, обновлено {age:.0f} сек назад")
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+
+class OrderBookCache:
+    """
+    Общий кеш стаканов с TTL и объединением одновременных запросов.
+
+    Если несколько треугольников одновременно запрашивают один и тот же символ
+    (например, BTC/USDT), в биржу уходит один fetch_order_book, а остальные
+    вызовы ждут его результат.
+
+    Parameters
+    ----------
+    fetcher : callable
+        Асинхронная функция вида fetch_with_rate_limit(client, method, *args, **kwargs).
+    ttl : float
+        Сколько секунд стакан считается свежим.
+    """
+
+    def __init__(self, fetcher, ttl=0.5):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.books = {}  # symbol -> (monotonic time, limit, order_book)
+        self.in_flight = {}  # symbol -> (limit, asyncio.Future)
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    async def get(self, client, symbol, limit=20):
+        """
+        Возвращает стакан symbol (не меньше limit уровней) из кеша или из биржи.
+
+        Returns
+        -------
+        dict or None
+            Стакан в формате fetch_order_book; None, если запрос не удался.
+        """
+        cached = self.books.get(symbol)
+        if cached is not None:
+            fetched_at, cached_limit, order_book = cached
+            if cached_limit >= limit and time.monotonic() - fetched_at < self.ttl:
+                self.stats["hits"] += 1
+                return order_book
+
+        pending = self.in_flight.get(symbol)
+        if pending is not None and pending[0] >= limit:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(pending[1])
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[symbol] = (limit, future)
+        order_book = None
+        try:
+            order_book = await self.fetcher(client, 'fetch_order_book', symbol, limit=limit)
+        except Exception:
+            order_book = None
+        finally:
+            if self.in_flight.get(symbol, (None, None))[1] is future:
+                del self.in_flight[symbol]
+            # Ожидающие получают результат даже если этот вызов отменили
+            if not future.done():
+                future.set_result(order_book)
+
+        if order_book is None:
+            self.stats["errors"] += 1
+        else:
+            self.books[symbol] = (time.monotonic(), limit, order_book)
+        return order_book
+
+    def summary(self):
+        """
+        Строка со счётчиками и долей запросов, обслуженных без похода в биржу.
+        """
+        stats = self.stats
+        total = stats["hits"] + stats["misses"] + stats["coalesced"]
+        saved = (stats["hits"] + stats["coalesced"]) / total * 100 if total else 0
+        return (f"hits={stats['hits']} misses={stats['misses']} coalesced={stats['coalesced']} "
+                f"errors={stats['errors']} saved={saved:.1f}%")
@@ -0,0 +1,112 @@
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд незавершённая резервация освобождается принудительно
+RESERVATION_TIMEOUT = 30
+
+
+class CapitalAllocator:
+    """
+    Резервирование капитала по валютам для одновременных сделок.
+
+    Сделка резервирует суммы монет, которые она расходует из баланса (amounts),
+    и монеты, баланс которых меняется по ходу сделки (exclusive, например
+    промежуточные монеты последовательного исполнения). Сделки, не пересекающиеся
+    по этим монетам, исполняются одновременно; резервация освобождается по
+    завершении сделки или по таймауту.
+
+    Parameters
+    ----------
+    available : callable
+        available(coin) - свободный баланс монеты (например, BalanceLedger.get).
+    timeout : float
+        Время жизни резервации (сек).
+    """
+
+    def __init__(self, available, timeout=RESERVATION_TIMEOUT):
+        self.available = available
+        self.timeout = timeout
+        self.reservations = {}  # id -> {"key", "amounts", "exclusive", "expires"}
+        self.ids = itertools.count(1)
+        self.stats = {"granted": 0, "rejected": 0, "expired": 0}
+
+    def expire(self):
+        """
+        Освобождает резервации, срок которых истёк.
+        """
+        now = time.monotonic()
+        for reservation_id, reservation in list(self.reservations.items()):
+            if reservation["expires"] <= now:
+                logger.warning(f"Резервация {reservation['key']} освобождена по таймауту")
+                del self.reservations[reservation_id]
+                self.stats["expired"] += 1
+
+    def reserved(self, coin):
+        return sum(x["amounts"].get(coin, 0) for x in self.reservations.values())
+
+    def conflicts(self, key, amounts, exclusive):
+        """
+        Причина, по которой резервацию нельзя выдать (None - можно).
+        """
+        for reservation in self.reservations.values():
+            if reservation["key"] == key:
+                return f"{key} уже исполняется"
+            busy = set(reservation["amounts"]) | reservation["exclusive"]
+            if reservation["exclusive"] & set(amounts) or busy & exclusive:
+                return f"монеты заняты сделкой {reservation['key']}"
+        for coin, amount in amounts.items():
+            free = self.available(coin) - self.reserved(coin)
+            if free < amount:
+                return f"недостаточно свободного {coin}: {free} < {amount}"
+        return None
+
+    def reserve(self, key, amounts, exclusive=()):
+        """
+        Резервирует капитал под сделку.
+
+        Parameters
+        ----------
+        key : str
+            Имя сделки (например, t_pair['combined']).
+        amounts : dict
+            coin -> сумма, расходуемая из баланса.
+        exclusive : iterable
+            Монеты, которые сделка использует исключительно.
+
+        Returns
+        -------
+        int or None
+            id резервации или None, если капитал занят.
+        """
+        self.expire()
+        exclusive = set(exclusive)
+        reason = self.conflicts(key, amounts, exclusive)
+        if reason is not None:
+            self.stats["rejected"] += 1
+            logger.info(f"Сделка {key} отложена: {reason}")
+            return None
+
+        reservation_id = next(self.ids)
+        self.reservations[reservation_id] = {
+            "key": key,
+            "amounts": dict(amounts),
+            "exclusive": exclusive,
+            "expires": time.monotonic() + self.timeout
+        }
+        self.stats["granted"] += 1
+        return reservation_id
+
+    def release(self, reservation_id):
+        self.reservations.pop(reservation_id, None)
+
+    @property
+    def busy(self):
+        self.expire()
+        return bool(self.reservations)
+
+    def summary(self):
+        return (f"активных {len(self.reservations)}, выдано {self.stats['granted']}, "
+                f"отклонено {self.stats['rejected']}, по таймауту {self.stats['expired']}")
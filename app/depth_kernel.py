@@ -0,0 +1,142 @@
+import numpy as np
+
+
+def build_curves(books):
+    """
+    Готовит стаканы к пакетному проходу по глубине.
+
+    Каждый стакан задаётся колонками (adj_price, adj_quantity), как после
+    reformated_orderbook: adj_quantity - сколько входной монеты принимает уровень,
+    adj_price - сколько выходной монеты даёт единица входной. Стаканы дополняются
+    нулевыми уровнями до общей длины и переводятся в префиксные суммы.
+
+    Parameters
+    ----------
+    books : list
+        Список пар (adj_prices, adj_quantities) или списков уровней [[price, qty], ...].
+
+    Returns
+    -------
+    dict
+        prices (R, L), cum_qty (R, L + 1), cum_out (R, L + 1), total (R,) и
+        position (R, L + 1) - cum_qty, нормированные на total и сдвинутые на номер строки.
+    """
+    rows = []
+    for book in books:
+        if isinstance(book, tuple):
+            prices, qty = np.asarray(book[0], dtype=float), np.asarray(book[1], dtype=float)
+        else:
+            levels = np.asarray(book, dtype=float).reshape(-1, 2)
+            prices, qty = levels[:, 0], levels[:, 1]
+        rows.append((prices, qty))
+
+    n_rows = len(rows)
+    width = max([len(prices) for prices, _ in rows] + [1])
+    prices = np.zeros((n_rows, width))
+    qty = np.zeros((n_rows, width))
+    for r, (row_prices, row_qty) in enumerate(rows):
+        prices[r, :len(row_prices)] = row_prices
+        qty[r, :len(row_qty)] = np.clip(row_qty, 0, None)
+
+    cum_qty = np.zeros((n_rows, width + 1))
+    cum_out = np.zeros((n_rows, width + 1))
+    np.cumsum(qty, axis=1, out=cum_qty[:, 1:])
+    np.cumsum(qty * prices, axis=1, out=cum_out[:, 1:])
+    total = cum_qty[:, -1]
+
+    # Нормируем строки на [0, 1] и сдвигаем на номер строки: весь массив
+    # становится монотонным, и один searchsorted обслуживает все стаканы сразу
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = np.where(total[:, None] > 0, cum_qty / total[:, None], 0)
+    position = normalized + np.arange(n_rows)[:, None]
+
+    return {
+        "prices": prices,
+        "cum_qty": cum_qty,
+        "cum_out": cum_out,
+        "total": total,
+        "position": position
+    }
+
+
+def walk_books(curves, rows, amounts, taker_fees=0.0):
+    """
+    Пакетный проход по глубине: сколько выходной монеты дают amounts во входной.
+
+    Parameters
+    ----------
+    curves : dict
+        Результат build_curves.
+    rows : array-like
+        Номер стакана для каждого элемента amounts (той же формы или транслируемый).
+    amounts : array-like
+        Входные объёмы; форма произвольная, например (кандидаты, размеры).
+    taker_fees : float or array-like
+        Комиссия тейкера (транслируется на форму amounts).
+
+    Returns
+    -------
+    tuple
+        (acquired, filled): полученная монета с учётом комиссии (частичное исполнение,
+        если стакана не хватило) и реально исполненный входной объём.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    rows = np.broadcast_to(np.asarray(rows, dtype=np.intp), amounts.shape)
+    total = curves["total"][rows]
+    width = curves["prices"].shape[1]
+
+    filled = np.clip(amounts, 0, total)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        target = rows + np.where(total > 0, filled / total, 0)
+
+    # Индекс уровня, на котором заканчивается исполнение, для всех элементов сразу
+    flat_position = curves["position"].ravel()
+    idx = np.searchsorted(flat_position, target.ravel(), side='left').reshape(amounts.shape)
+    level = np.clip(idx - rows * (width + 1), 1, width)
+
+    cum_qty = curves["cum_qty"][rows, level - 1]
+    cum_out = curves["cum_out"][rows, level - 1]
+    price = curves["prices"][rows, level - 1]
+    acquired = cum_out + np.clip(filled - cum_qty, 0, None) * price
+    acquired = np.where(filled > 0, acquired, 0) * (1 - np.asarray(taker_fees, dtype=float))
+    return acquired, filled
+
+
+def walk_triangles(curves, leg_rows, starting_amounts, taker_fees=0.0):
+    """
+    Проход по трём стаканам треугольника для многих кандидатов и размеров входа.
+
+    Parameters
+    ----------
+    curves : dict
+        Результат build_curves.
+    leg_rows : array-like
+        (N, 3) - номера стаканов ног каждого кандидата.
+    starting_amounts : array-like
+        (N,) или (N, K) - стартовые объёмы (K размеров на кандидата).
+    taker_fees : float or array-like
+        Комиссия: число, (3,) или (N, 3) - по ногам.
+
+    Returns
+    -------
+    tuple
+        (acquired_coin_t1, acquired_coin_t2, acquired_coin_t3, fully_filled) формы starting_amounts.
+    """
+    leg_rows = np.asarray(leg_rows, dtype=np.intp).reshape(-1, 3)
+    amounts = np.asarray(starting_amounts, dtype=float)
+    extra_dims = (1,) * (amounts.ndim - 1)
+
+    # Число - на все ноги, (3,) - по ногам для всех кандидатов, (N, 3) - для каждого
+    fees = np.broadcast_to(np.asarray(taker_fees, dtype=float), (leg_rows.shape[0], 3))
+
+    fully_filled = np.ones(amounts.shape, dtype=bool)
+    acquired = []
+    amount_in = amounts
+    for leg in range(3):
+        rows = leg_rows[:, leg].reshape(-1, *extra_dims)
+        fee = fees[:, leg].reshape(-1, *extra_dims)
+        amount_out, filled = walk_books(curves, rows, amount_in, fee)
+        fully_filled &= filled >= amount_in * (1 - 1e-12)
+        acquired.append(amount_out)
+        amount_in = amount_out
+    return acquired[0], acquired[1], acquired[2], fully_filled
@@ -0,0 +1,346 @@
+import asyncio
+import itertools
+import logging
+import math
+import random
+import time
+
+from ccxt.base.errors import BadSymbol, InsufficientFunds, InvalidOrder, OrderNotFound, RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# Котируемые монеты синтетического рынка и их цена в USDT
+SYNTHETIC_QUOTES = {"USDT": 1.0, "BTC": 60000.0, "ETH": 3000.0}
+TAKER_FEE = 0.001
+# Задержка ответа по умолчанию: медиана (сек) и sigma логнормального распределения
+DEFAULT_LATENCY = (0.02, 0.5)
+# Окно лимита запросов (сек), как у Bybit
+RATE_LIMIT_WINDOW = 1.0
+
+
+class SimulatedExchange:
+    """
+    Локальная замена клиента ccxt Bybit для нагрузочных тестов без ключей и сети.
+
+    Повторяет используемую ботом часть интерфейса ccxt: fetch_markets, load_markets,
+    market, fetch_ticker(s), fetch_order_book, fetch_balance, create_order(s),
+    fetch_order, close и last_response_headers (с X-Bapi-Limit*). Каждый запрос
+    ждёт случайную задержку (логнормальную, своя для каждого метода), считается
+    в окне лимита и при превышении завершается RateLimitExceeded, как у Bybit.
+
+    Цены синтетические: справедливая цена каждой монеты в USDT - случайное блуждание,
+    а у каждого рынка своё отклонение от кросс-курса (процесс Орнштейна - Уленбека),
+    поэтому в треугольниках время от времени появляются возможности. Стаканы
+    строятся вокруг текущей середины; рыночные ордера исполняются по ним с комиссией
+    тейкера и меняют балансы. Рыночная покупка без params['cost'] тратит amount
+    в quote (как Bybit при createMarketBuyOrderRequiresPrice = False).
+
+    Parameters
+    ----------
+    markets : list
+        Рынки: словари с symbol, base, quote (остальные поля fetch_markets заполняются сами).
+    prices : dict
+        Начальная справедливая цена монет в USDT.
+    balances : dict, optional
+        Начальные свободные балансы.
+    latency : tuple or dict, optional
+        (медиана, sigma) для всех методов или {method: (медиана, sigma), 'default': ...}.
+    rate_limit : int
+        Запросов в окне RATE_LIMIT_WINDOW; больше - RateLimitExceeded.
+    throttle_probability : float
+        Вероятность случайного отказа по лимиту (помимо превышения окна).
+    volatility : float
+        Волатильность справедливых цен (доля за секунду).
+    dislocation : float
+        Стандартное отклонение отклонения рынка от кросс-курса (доля).
+    reversion : float
+        Время возврата отклонения к нулю (сек).
+    spread : float
+        Спред стакана (доля от середины).
+    depth : int
+        Уровней на сторону стакана.
+    level_notional : float
+        Объём первого уровня в USDT (дальние уровни крупнее).
+    seed : int, optional
+        Зерно генератора: тот же набор рынков, начальные цены и последовательность
+        случайных величин от прогона к прогону.
+    """
+
+    def __init__(self, markets, prices, balances=None, latency=DEFAULT_LATENCY, rate_limit=100,
+                 throttle_probability=0.0, volatility=0.0005, dislocation=0.002, reversion=5.0,
+                 spread=0.0002, depth=20, level_notional=500.0, seed=None):
+        self.id = 'bybit'
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.latency = latency if isinstance(latency, dict) else {'default': latency}
+        self.rate_limit = rate_limit
+        self.throttle_probability = throttle_probability
+        self.volatility = volatility
+        self.dislocation = dislocation
+        self.reversion = reversion
+        self.spread = spread
+        self.depth = depth
+        self.level_notional = level_notional
+        self.options = {'createMarketBuyOrderRequiresPrice': False}
+
+        self.market_list = [self.describe_market(x) for x in markets]
+        self.markets = {}
+        self.fair = {coin: [price, time.monotonic()] for coin, price in prices.items()}
+        self.offsets = {x['symbol']: [0.0, time.monotonic()] for x in self.market_list}
+        self.nonces = dict.fromkeys(self.offsets, 0)
+        self.balances = dict(balances or {})
+        self.orders = {}
+        self.order_ids = itertools.count(1)
+        self.window = (0.0, 0)  # (начало окна, запросов в окне)
+        self.last_response_headers = {}
+        self.stats = {"requests": 0, "throttled": 0, "orders": 0, "latency": 0.0}
+
+    @classmethod
+    def synthetic(cls, coins=300, quotes=SYNTHETIC_QUOTES, seed=None, inventory=None, **kwargs):
+        """
+        Синтетический рынок: coins монет, каждая торгуется ко всем quotes, плюс рынки между quotes.
+
+        С тремя котируемыми монетами у каждой монеты три треугольника, то есть
+        3 * coins треугольников на весь рынок. inventory - стоимость в USDT запаса,
+        который добавляется к balances в каждой монете рынка (для одновременного
+        исполнения ног, которому нужен запас во всех монетах треугольника).
+        """
+        rng = random.Random(seed)
+        names = list(quotes)
+        prices = dict(quotes)
+        markets = [{"symbol": f"{base}/{quote}", "base": base, "quote": quote}
+                   for i, base in enumerate(names) for quote in names[:i]]
+        for n in range(coins):
+            coin = f"C{n:04d}"
+            prices[coin] = math.exp(rng.uniform(math.log(0.01), math.log(100)))
+            markets.extend({"symbol": f"{coin}/{quote}", "base": coin, "quote": quote} for quote in names)
+        if inventory:
+            balances = dict(kwargs.pop('balances', None) or {})
+            for coin, price in prices.items():
+                balances[coin] = balances.get(coin, 0) + inventory / price
+            kwargs['balances'] = balances
+        return cls(markets, prices, seed=seed, **kwargs)
+
+    def describe_market(self, market):
+        """
+        Рынок в формате fetch_markets.
+        """
+        base, quote = market['base'], market['quote']
+        return {
+            "id": f"{base}{quote}",
+            "symbol": market['symbol'],
+            "base": base,
+            "quote": quote,
+            "type": "spot",
+            "spot": True,
+            "active": True,
+            "taker": market.get('taker', TAKER_FEE),
+            "maker": market.get('maker', TAKER_FEE),
+            "precision": market.get('precision') or {"amount": 1e-8, "price": 1e-8},
+            "limits": market.get('limits') or {"amount": {"min": 0}, "cost": {"min": 0}},
+            "info": {}
+        }
+
+    async def request(self, method):
+        """
+        Задержка ответа и учёт лимита запросов; при превышении - RateLimitExceeded.
+        """
+        median, sigma = self.latency.get(method, self.latency.get('default', DEFAULT_LATENCY))
+        delay = median * math.exp(sigma * self.rng.gauss(0, 1)) if median > 0 else 0.0
+        await asyncio.sleep(delay)
+        self.stats["requests"] += 1
+        self.stats["latency"] += delay
+
+        now = time.time()
+        start, count = self.window
+        if now - start >= RATE_LIMIT_WINDOW:
+            start, count = now, 0
+        count += 1
+        self.window = (start, count)
+        self.last_response_headers = {
+            "X-Bapi-Limit": str(self.rate_limit),
+            "X-Bapi-Limit-Status": str(max(self.rate_limit - count, 0)),
+            "X-Bapi-Limit-Reset-Timestamp": str(int((start + RATE_LIMIT_WINDOW) * 1000))
+        }
+        if count > self.rate_limit or self.rng.random() < self.throttle_probability:
+            self.stats["throttled"] += 1
+            raise RateLimitExceeded('bybit {"retCode":10006,"retMsg":"Too many visits!"}')
+
+    def fair_price(self, coin, now):
+        price, updated = self.fair[coin]
+        dt = now - updated
+        if dt > 0 and self.volatility > 0 and coin != "USDT":
+            price *= math.exp(self.volatility * math.sqrt(dt) * self.rng.gauss(0, 1))
+        self.fair[coin] = [price, now]
+        return price
+
+    def mid(self, symbol):
+        """
+        Текущая середина рынка: кросс-курс справедливых цен и собственное отклонение рынка.
+        """
+        market = self.market(symbol)
+        now = time.monotonic()
+        offset, updated = self.offsets[symbol]
+        dt = now - updated
+        if dt > 0:
+            decay = math.exp(-dt / self.reversion)
+            offset = offset * decay + self.dislocation * math.sqrt(1 - decay * decay) * self.rng.gauss(0, 1)
+            self.offsets[symbol] = [offset, now]
+            self.nonces[symbol] += 1
+        return self.fair_price(market['base'], now) / self.fair_price(market['quote'], now) * (1 + offset)
+
+    def build_book(self, symbol, limit=None):
+        mid = self.mid(symbol)
+        base = self.market(symbol)['base']
+        # Объёмы уровней детерминированы номером версии стакана
+        rng = random.Random(f"{symbol}:{self.nonces[symbol]}:{self.seed}")
+        base_qty = self.level_notional / self.fair[base][0]
+        half = mid * self.spread / 2
+        step = mid * 0.0001
+        levels = min(limit or self.depth, self.depth)
+        bids = [[mid - half - i * step, base_qty * (1 + i) * rng.uniform(0.5, 1.5)] for i in range(levels)]
+        asks = [[mid + half + i * step, base_qty * (1 + i) * rng.uniform(0.5, 1.5)] for i in range(levels)]
+        return bids, asks
+
+    async def fetch_markets(self, params=None):
+        await self.request('fetch_markets')
+        return [dict(x) for x in self.market_list]
+
+    async def load_markets(self, reload=False, params=None):
+        if reload or not self.markets:
+            self.markets = {x['symbol']: x for x in await self.fetch_markets()}
+        return self.markets
+
+    def market(self, symbol):
+        if not self.markets:
+            self.markets = {x['symbol']: x for x in self.market_list}
+        if symbol not in self.markets:
+            raise BadSymbol(f"bybit does not have market symbol {symbol}")
+        return self.markets[symbol]
+
+    def ticker(self, symbol):
+        mid = self.mid(symbol)
+        half = mid * self.spread / 2
+        return {"symbol": symbol, "bid": mid - half, "ask": mid + half, "last": mid,
+                "timestamp": int(time.time() * 1000)}
+
+    async def fetch_ticker(self, symbol, params=None):
+        await self.request('fetch_ticker')
+        return self.ticker(symbol)
+
+    async def fetch_tickers(self, symbols=None, params=None):
+        await self.request('fetch_tickers')
+        symbols = symbols or [x['symbol'] for x in self.market_list]
+        return {symbol: self.ticker(symbol) for symbol in symbols if symbol in self.offsets}
+
+    async def fetch_order_book(self, symbol, limit=None, params=None):
+        await self.request('fetch_order_book')
+        bids, asks = self.build_book(symbol, limit)
+        return {"symbol": symbol, "bids": bids, "asks": asks,
+                "timestamp": int(time.time() * 1000), "nonce": self.nonces[symbol]}
+
+    async def fetch_balance(self, params=None):
+        await self.request('fetch_balance')
+        free = {coin: amount for coin, amount in self.balances.items()}
+        balance = {coin: {"free": amount, "used": 0.0, "total": amount} for coin, amount in free.items()}
+        balance.update({"free": free, "used": dict.fromkeys(free, 0.0), "total": dict(free), "info": {}})
+        return balance
+
+    def execute(self, symbol, order_type, side, amount, price=None, params=None):
+        """
+        Исполняет рыночный ордер по текущему стакану и меняет балансы.
+        """
+        params = params or {}
+        market = self.market(symbol)
+        if order_type != 'market':
+            raise InvalidOrder(f"bybit simulator supports only market orders, got {order_type}")
+        base, quote = market['base'], market['quote']
+        bids, asks = self.build_book(symbol)
+
+        filled = cost = 0.0
+        if side == 'buy':
+            budget = params.get('cost') or (amount * price if price else amount)
+            if self.balances.get(quote, 0) < budget:
+                raise InsufficientFunds(f"bybit Insufficient balance: {quote} {self.balances.get(quote, 0)} < {budget}")
+            for level_price, qty in asks:
+                take = min(qty, (budget - cost) / level_price)
+                filled += take
+                cost += take * level_price
+                if cost >= budget * (1 - 1e-12):
+                    break
+            fee = {"cost": filled * market['taker'], "currency": base}
+            self.balances[quote] = self.balances.get(quote, 0) - cost
+            self.balances[base] = self.balances.get(base, 0) + filled - fee['cost']
+        else:
+            if self.balances.get(base, 0) < amount:
+                raise InsufficientFunds(f"bybit Insufficient balance: {base} {self.balances.get(base, 0)} < {amount}")
+            for level_price, qty in bids:
+                take = min(qty, amount - filled)
+                filled += take
+                cost += take * level_price
+                if filled >= amount * (1 - 1e-12):
+                    break
+            fee = {"cost": cost * market['taker'], "currency": quote}
+            self.balances[base] = self.balances.get(base, 0) - filled
+            self.balances[quote] = self.balances.get(quote, 0) + cost - fee['cost']
+
+        now = int(time.time() * 1000)
+        order_id = str(next(self.order_ids))
+        order = {
+            "id": order_id,
+            "clientOrderId": params.get('clientOrderId'),
+            "symbol": symbol,
+            "type": order_type,
+            "side": side,
+            "amount": amount,
+            "filled": filled,
+            "remaining": max(amount - filled, 0) if side == 'sell' else 0.0,
+            "cost": cost,
+            "average": cost / filled if filled else None,
+            "price": cost / filled if filled else None,
+            # Стакана не хватило - остаток рыночного ордера отменяется, как на бирже
+            "status": "closed" if (side == 'buy' or filled >= amount * (1 - 1e-12)) else "canceled",
+            "fee": fee,
+            "fees": [fee],
+            "timestamp": now,
+            "lastTradeTimestamp": now,
+            "lastUpdateTimestamp": now,
+            "info": {"orderId": order_id}
+        }
+        self.orders[order_id] = order
+        self.stats["orders"] += 1
+        return dict(order)
+
+    async def create_order(self, symbol, type, side, amount, price=None, params=None):
+        await self.request('create_order')
+        return self.execute(symbol, type, side, amount, price, params)
+
+    async def create_orders(self, orders, params=None):
+        """
+        Пакетная заявка: отказ по одной ноге не отменяет остальные (ответ с info.code/msg, без id).
+        """
+        await self.request('create_orders')
+        results = []
+        for order in orders:
+            try:
+                results.append(self.execute(order['symbol'], order['type'], order['side'], order['amount'],
+                                            order.get('price'), order.get('params')))
+            except (BadSymbol, InsufficientFunds, InvalidOrder) as e:
+                results.append({"id": None, "symbol": order['symbol'], "info": {"code": 170131, "msg": str(e)}})
+        return results
+
+    async def fetch_order(self, id, symbol=None, params=None):
+        await self.request('fetch_order')
+        order = self.orders.get(id)
+        if order is None:
+            raise OrderNotFound(f"bybit order {id} not found")
+        return dict(order)
+
+    async def close(self):
+        pass
+
+    def summary(self):
+        requests = self.stats["requests"]
+        latency = self.stats["latency"] / requests * 1000 if requests else 0
+        return (f"запросов {requests}, отказов по лимиту {self.stats['throttled']}, "
+                f"ордеров {self.stats['orders']}, средняя задержка {latency:.1f} мс")
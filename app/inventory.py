@@ -0,0 +1,264 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Интервал проверки инвентаря (сек) и допустимое отклонение от цели (доля)
+REBALANCE_INTERVAL = 30
+REBALANCE_TOLERANCE = 0.25
+# Запас в каждой монете - столько сделок наибольшего объёма среди её треугольников
+INVENTORY_HEADROOM = 2
+
+
+def trade_legs(surface_arb):
+    """
+    Ноги связки в порядке реального движения монет.
+
+    Ярлыки swap_1..3 в surface_dict не совпадают с монетами, которые ноги тратят
+    на бирже: base_to_quote исполняется покупкой и тратит quote контракта,
+    quote_to_base - продажей и тратит base, а swap_i_rate - сколько выходной монеты
+    нога даёт за единицу входной. Поэтому цепочка строится по самим контрактам:
+    первой идёт нога 1, каждой следующей - нога, которая тратит монету, полученную
+    предыдущей.
+
+    Returns
+    -------
+    list
+        Словари leg (номер ноги в surface_dict), contract, direction, side,
+        coin_in, coin_out, rate - в порядке исполнения.
+    """
+    legs = []
+    for i in range(1, 4):
+        contract, direction = surface_arb[f"contract_{i}"], surface_arb[f"direction_trade_{i}"]
+        base, quote = contract.split(':')[0].split('/')
+        buy = direction == "base_to_quote"
+        legs.append({
+            "leg": i,
+            "contract": contract,
+            "direction": direction,
+            "side": 'buy' if buy else 'sell',
+            "coin_in": quote if buy else base,
+            "coin_out": base if buy else quote,
+            "rate": surface_arb[f"swap_{i}_rate"]
+        })
+
+    ordered, rest = legs[:1], legs[1:]
+    while rest:
+        following = next((leg for leg in rest if leg["coin_in"] == ordered[-1]["coin_out"]), None)
+        if following is None:
+            break
+        ordered.append(following)
+        rest.remove(following)
+    if rest or ordered[-1]["coin_out"] != ordered[0]["coin_in"]:
+        raise ValueError(f"Ноги {[leg['contract'] for leg in legs]} не образуют цикл")
+    return ordered
+
+
+def triangle_coins(t_pair):
+    """
+    Монеты треугольника каталога.
+    """
+    return {t_pair[f"{pair}_{side}"] for pair in "abc" for side in ("base", "quote")}
+
+
+def leg_order(direction, amount_in, rate):
+    """
+    Параметры рыночного ордера ноги по объёму входной монеты.
+
+    base_to_quote (курс 1 / ask) тратит quote и покупает base: объём задаётся
+    суммой в quote через params['cost'], amount - ожидаемое количество base.
+    quote_to_base (курс bid) продаёт amount_in base.
+
+    Returns
+    -------
+    tuple
+        (side, amount, params) для create_order.
+    """
+    if direction == "base_to_quote":
+        return 'buy', amount_in * rate, {'cost': amount_in}
+    return 'sell', amount_in, {}
+
+
+def order_output(order, side):
+    """
+    Сколько выходной монеты дал исполненный ордер (None, если биржа не вернула объёмы).
+
+    Комиссия, списанная в выходной монете (на споте Bybit - в получаемой), вычитается.
+    """
+    if not order:
+        return None
+    output = order.get('filled') if side == 'buy' else order.get('cost')
+    if not output or not order.get('symbol'):
+        return output
+    base, quote = order['symbol'].split(':')[0].split('/')
+    coin = base if side == 'buy' else quote
+    for fee in order.get('fees') or ([order['fee']] if order.get('fee') else []):
+        if fee and fee.get('cost') and fee.get('currency') == coin:
+            output -= fee['cost']
+    return output
+
+
+class InventoryRebalancer:
+    """
+    Фоновое выравнивание инвентаря для одновременного исполнения трёх ног.
+
+    Одновременный режим держит запас во всех монетах треугольников; после сделок
+    запас смещается. Вне торгового пути, раз в interval секунд, балансы сравниваются
+    с целями, и монеты, отклонившиеся больше чем на tolerance, докупаются или
+    продаются через рынок coin/hub.
+
+    Цели считаются по входам ног: одновременная сделка тратит в каждой монете
+    треугольника стоимость своего стартового объёма, поэтому цель монеты - headroom
+    таких сделок по самому дорогому её треугольнику в пересчёте по курсу coin/hub.
+
+    Parameters
+    ----------
+    trade_amounts : dict
+        Стартовый объём сделки по монетам (coin -> количество, как STARTING_AMOUNT).
+    catalog : TriangleCatalog
+        Каталог треугольников; цели получают все его монеты с рынком coin/hub.
+    fetcher : callable
+        Асинхронная функция вида fetch_with_rate_limit(client, method, *args, **kwargs).
+    metadata : MarketMetadata
+        Метаданные рынков (наличие рынка coin/hub и минимальные объёмы).
+    hub : str
+        Монета, через которую выравниваются остальные; сама не выравнивается.
+    is_busy : callable, optional
+        Возвращает True, пока идёт сделка - тогда выравнивание откладывается.
+    ledger : BalanceLedger, optional
+        Локальная книга балансов: читается вместо fetch_balance и обновляется по исполнениям.
+    headroom : float
+        Сколько сделок наибольшего объёма покрывает запас каждой монеты.
+    default_amount : float
+        Стартовый объём монеты, которой нет в trade_amounts.
+    """
+
+    def __init__(self, trade_amounts, catalog, fetcher, metadata, hub='USDT', tolerance=REBALANCE_TOLERANCE,
+                 interval=REBALANCE_INTERVAL, is_busy=None, ledger=None, headroom=INVENTORY_HEADROOM,
+                 default_amount=100):
+        self.trade_amounts = dict(trade_amounts)
+        self.catalog = catalog
+        self.headroom = headroom
+        self.default_amount = default_amount
+        self.fetcher = fetcher
+        self.metadata = metadata
+        self.hub = hub
+        self.tolerance = tolerance
+        self.interval = interval
+        self.is_busy = is_busy or (lambda: False)
+        self.ledger = ledger
+
+    def hub_price(self, coin, price_table):
+        """
+        Цена монеты в hub по середине спреда coin/hub (None - нет котировки).
+        """
+        if coin == self.hub:
+            return 1.0
+        ticker = price_table.get(f"{coin}/{self.hub}") or {}
+        bid, ask = ticker.get('bid'), ticker.get('ask')
+        if bid and ask:
+            return (bid + ask) / 2
+        return bid or ask or None
+
+    def targets(self, price_table):
+        """
+        Целевой запас по монетам треугольников каталога.
+
+        Стоимость сделки треугольника оценивается сверху наибольшим стартовым
+        объёмом среди его монет (в hub); треугольники без котировки coin/hub
+        для какой-либо монеты пропускаются - их запас не выравнивается.
+
+        Returns
+        -------
+        dict
+            coin -> целевое количество.
+        """
+        prices, targets = {}, {}
+        for t_pair in self.catalog.pairs:
+            coins = triangle_coins(t_pair)
+            for coin in coins - prices.keys():
+                prices[coin] = self.hub_price(coin, price_table)
+            if any(prices[coin] is None for coin in coins):
+                continue
+            trade_value = max(self.trade_amounts.get(coin, self.default_amount) * prices[coin] for coin in coins)
+            for coin in coins:
+                targets[coin] = max(targets.get(coin, 0), self.headroom * trade_value / prices[coin])
+        return targets
+
+    def plan(self, balances, price_table):
+        """
+        Ордера, возвращающие запас к целям.
+
+        Parameters
+        ----------
+        balances : dict
+            Результат fetch_balance.
+        price_table : dict
+            Котировки symbol -> ticker (для перевода дефицита в сумму hub).
+
+        Returns
+        -------
+        list
+            Список (symbol, side, amount, params).
+        """
+        orders = []
+        # Докупки не тратят больше свободного hub (продажи в этом же проходе его ещё не пополнили)
+        hub_free = balances.get(self.hub, {}).get('free') or 0
+        for coin, target in self.targets(price_table).items():
+            if coin == self.hub or not target:
+                continue
+            symbol = f"{coin}/{self.hub}"
+            if not self.metadata.market(symbol):
+                logger.debug(f"Нет рынка {symbol} для выравнивания {coin}")
+                continue
+
+            free = balances.get(coin, {}).get('free') or 0
+            deviation = free - target
+            if abs(deviation) <= target * self.tolerance:
+                continue
+            if abs(deviation) < self.metadata.min_amount(symbol):
+                continue
+
+            if deviation > 0:
+                orders.append((symbol, 'sell', deviation, {}))
+            else:
+                ask = price_table.get(symbol, {}).get('ask')
+                if not ask:
+                    continue
+                cost = -deviation * ask
+                if cost < self.metadata.min_cost(symbol) or cost > hub_free:
+                    continue
+                hub_free -= cost
+                orders.append((symbol, 'buy', -deviation, {'cost': cost}))
+        return orders
+
+    async def rebalance(self, client, price_table):
+        """
+        Одна проверка инвентаря с выравниванием.
+
+        Returns
+        -------
+        int
+            Количество отправленных ордеров.
+        """
+        if self.ledger is not None and self.ledger.seeded:
+            balances = self.ledger.balances()
+        else:
+            balances = await self.fetcher(client, 'fetch_balance')
+        if balances is None:
+            return 0
+
+        orders = self.plan(balances, price_table)
+        for symbol, side, amount, params in orders:
+            logger.info(f"Выравнивание инвентаря: {side} {amount} {symbol}")
+            order = await self.fetcher(client, 'create_order', symbol, 'market', side, amount, None, params)
+            if self.ledger is not None:
+                self.ledger.apply_order(order)
+        return len(orders)
+
+    async def run(self, client, price_table):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.is_busy():
+                continue
+            await self.rebalance(client, price_table)
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Пороги сброса буфера на диск: число записей и время (сек); предел очереди
+FLUSH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+MAX_QUEUE = 10000
+
+
+class JournalWriter:
+    """
+    Фоновый журнал возможностей и сделок в формате NDJSON (одна JSON-запись на строку).
+
+    write кладёт запись в очередь и сразу возвращает управление; фоновая задача
+    собирает записи в пачки и дописывает их в файл в отдельном потоке, когда
+    набралось flush_size записей или прошло flush_interval секунд. Запись на диск
+    никогда не выполняется в event loop.
+
+    Parameters
+    ----------
+    path : str
+        Файл журнала.
+    flush_size : int
+        Сбросить буфер, когда в нём столько записей.
+    flush_interval : float
+        Сбросить непустой буфер не реже чем раз в столько секунд.
+    """
+
+    def __init__(self, path, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, max_queue=MAX_QUEUE):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.buffer = []
+        self.task = None
+        self.stats = {"written": 0, "dropped": 0, "flushes": 0}
+
+    def write(self, kind, key, data):
+        """
+        Ставит запись в очередь без ожидания.
+
+        Parameters
+        ----------
+        kind : str
+            Тип записи, например 'opportunity' или 'result'.
+        key : str
+            Связка (t_pair['combined']).
+        data : dict
+            Данные записи.
+        """
+        now = time.time()
+        record = {
+            "ts": now,
+            "time": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            "type": kind,
+            "key": key,
+            "data": data
+        }
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+                if record is None:
+                    return
+                self.buffer.append(record)
+                while len(self.buffer) < self.flush_size and not self.queue.empty():
+                    record = self.queue.get_nowait()
+                    if record is None:
+                        return
+                    self.buffer.append(record)
+            except asyncio.TimeoutError:
+                pass
+
+            if len(self.buffer) >= self.flush_size or \
+                    (self.buffer and time.monotonic() - last_flush >= self.flush_interval):
+                await self.flush()
+                last_flush = time.monotonic()
+
+    async def flush(self):
+        records, self.buffer = self.buffer, []
+        if records:
+            await asyncio.to_thread(self.append, records)
+
+    def append(self, records):
+        """
+        Дописывает записи в файл (выполняется в отдельном потоке).
+        """
+        lines = "".join(json.dumps(record, default=str, ensure_ascii=False) + "\n" for record in records)
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        except OSError as e:
+            logger.error(f"Ошибка записи журнала {self.path}: {str(e)}")
+            return
+        self.stats["written"] += len(records)
+        self.stats["flushes"] += 1
+
+    async def close(self):
+        """
+        Останавливает фоновую задачу и дописывает всё, что осталось в буфере и очереди.
+        """
+        if self.task is not None:
+            # Останавливаем задачу маркером None, а не cancel: отмена wait_for в момент,
+            # когда запись уже получена, может потеряться, и задача не завершится
+            try:
+                self.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        while not self.queue.empty():
+            record = self.queue.get_nowait()
+            if record is not None:
+                self.buffer.append(record)
+        await self.flush()
+
+    def summary(self):
+        return f"записано {self.stats['written']}, сбросов {self.stats['flushes']}, потеряно {self.stats['dropped']}"
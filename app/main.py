@@ -5,8 +5,27 @@ import json
 import asyncio
 import aiohttp
 import logging
-from aiolimiter import AsyncLimiter
 import colorlog
+from balance_ledger import BalanceLedger
+from book_cache import OrderBookCache
+from capital_allocator import CapitalAllocator
+from depth_kernel import build_curves, walk_books, walk_triangles
+from exchange_simulator import SimulatedExchange
+from inventory import InventoryRebalancer, leg_order, order_output, trade_legs
+from journal import JournalWriter
+from market_metadata import MarketMetadata
+from market_recorder import MarketRecorder
+from opportunity_store import OpportunityStore
+from order_tracker import OrderTracker, is_final
+from market_stream import (BYBIT_PRIVATE_WS_URL, BYBIT_SPOT_WS_URL, BybitOrderBookStream, BybitPrivateStream,
+                           BybitQuoteStream, WebSocketTransport)
+from rate_limiter import PriorityRateLimiter
+from size_solver import solve_trade_size
+from surface_engine import SurfaceRateEngine
+from surface_rate import best_surface_rate, calc_surface_rate
+from triangle_index import TriangleIndex
+from triangle_scheduler import TriangleScheduler, VolatilityTracker
+from triangles import TriangleCatalog, filter_spot_markets, find_triangular_pairs, is_tradable_triangle
 
 # Настройка логирования с цветом
 handler = colorlog.StreamHandler()
@@ -21,6 +40,21 @@ load_dotenv()
 API_KEY = os.getenv('API_kEY_BYBIT')
 API_SECRET = os.getenv('API_SECRET_BYBIT')
 
+# Локальный симулятор Bybit вместо биржи (нагрузочные тесты без ключей и сети, только REST-режим):
+# SIM_COINS монет дают 3 * SIM_COINS треугольников, SIM_LATENCY - медиана задержки ответа (сек),
+# SIM_RATE_LIMIT - запросов в секунду до RateLimitExceeded
+EXCHANGE_SIMULATOR = os.getenv('EXCHANGE_SIMULATOR', '0') == '1'
+SIM_COINS = int(os.getenv('SIM_COINS', 300))
+SIM_LATENCY = float(os.getenv('SIM_LATENCY', 0.02))
+SIM_RATE_LIMIT = int(os.getenv('SIM_RATE_LIMIT', 100))
+SIM_THROTTLE_PROBABILITY = float(os.getenv('SIM_THROTTLE_PROBABILITY', 0))
+SIM_SEED = int(os.getenv('SIM_SEED', 1))
+# Запас симулятора в каждой монете (в USDT) для одновременного исполнения ног
+SIM_INVENTORY = float(os.getenv('SIM_INVENTORY', 10000))
+
+# Файл каталога треугольников; у симулятора свой, чтобы не перезаписать каталог Bybit
+MARKETS_PATH = os.getenv('MARKETS_PATH', 'markets_sim.json' if EXCHANGE_SIMULATOR else 'markets.json')
+
 
 STARTING_AMOUNT = {
     "USDT": 100, 
@@ -31,148 +65,372 @@ STARTING_AMOUNT = {
     "BETH": 0.045
 }
 
-# Лимит на количество запросов (1200 запросов в минуту = 20 запросов в секунду)
-rate_limiter = AsyncLimiter(20, 1)
+# Бюджет запросов в единицах веса Bybit (50 в секунду) с приоритетом полос
+# orders > depth > balances > tickers; RATE_LIMIT_RESERVE единиц доступны только ордерам.
+# Бюджет подстраивается по заголовкам X-Bapi-Limit* в пределах [BUDGET / 4, RATE_LIMIT_MAX]
+RATE_LIMIT_BUDGET = float(os.getenv('RATE_LIMIT_BUDGET', 50))
+RATE_LIMIT_MAX = float(os.getenv('RATE_LIMIT_MAX', 100))
+RATE_LIMIT_RESERVE = float(os.getenv('RATE_LIMIT_RESERVE', 10))
+rate_limiter = PriorityRateLimiter(RATE_LIMIT_BUDGET, reserve=RATE_LIMIT_RESERVE, max_rate=RATE_LIMIT_MAX)
+
+# Ошибки лимита биржи (HTTP 429, retCode 10006 / 10018) и число повторов после паузы
+THROTTLE_ERRORS = (ccxt.RateLimitExceeded, ccxt.DDoSProtection)
+RATE_LIMIT_RETRIES = 3
+
+# Общая таблица котировок (symbol -> ticker), обновляется одним fetch_tickers за цикл
+PRICE_TABLE = {}
+
+# Локальные копии стаканов (symbol -> LocalOrderBook), которые ведёт поток orderbook.50
+ORDER_BOOKS = {}
+
+# Режим исполнения: 'sequential' - ноги по очереди из стартовой монеты,
+# 'concurrent' - три ноги одновременно из заранее размещённого инвентаря во всех монетах
+# (цели инвентаря - входы ног сделок объёма STARTING_AMOUNT, выравнивание идёт в фоне через INVENTORY_HUB),
+# 'batch' - как 'concurrent', но три ноги уходят одной пакетной заявкой Bybit
+EXECUTION_MODE = os.getenv('EXECUTION_MODE', 'sequential')
+INVENTORY_HUB = os.getenv('INVENTORY_HUB', 'USDT')
+
+# Подбирать оптимальный размер сделки по глубине решателем size_solver (по кандидату за раз);
+# по умолчанию глубина проверяется векторным проходом walk_triangles на фиксированном объёме
+OPTIMIZE_TRADE_SIZE = os.getenv('OPTIMIZE_TRADE_SIZE', '0') == '1'
+
+# Свежесть стакана в общем кеше (сек) и период вывода статистики кеша
+ORDER_BOOK_TTL = float(os.getenv('ORDER_BOOK_TTL', 0.5))
+STATS_LOG_INTERVAL = 60
+
+# Интервал сверки каталога треугольников с fetch_markets (сек)
+CATALOG_REFRESH_INTERVAL = 600
+
+# Пул воркеров, обслуживающих треугольники в REST-режиме: число воркеров,
+# целевой интервал повторного визита треугольника (сек) и период опроса fetch_tickers
+TRIANGLE_WORKERS = int(os.getenv('TRIANGLE_WORKERS', 16))
+TRIANGLE_REVISIT_INTERVAL = float(os.getenv('TRIANGLE_REVISIT_INTERVAL', 1.0))
+# Наибольший пакет треугольников одного визита воркера: пакет оценивается одним векторным
+# проходом, а глубина его прибыльных - одним пакетным; меньший пакет раньше доходит до сделки
+TRIANGLE_BATCH_SIZE = int(os.getenv('TRIANGLE_BATCH_SIZE', 64))
+# Сколько лучших по поверхностному курсу прибыльных треугольников пакета проверяется по глубине;
+# остальные остаются прибыльными и проверяются при следующем визите (очередь depth не растёт)
+DEPTH_BATCH_LIMIT = int(os.getenv('DEPTH_BATCH_LIMIT', 4))
+# «Холодные» треугольники (далеко от безубыточности с учётом их волатильности)
+# обходятся фоновым кругом не реже раза в TRIANGLE_COLD_INTERVAL сек
+TRIANGLE_COLD_INTERVAL = float(os.getenv('TRIANGLE_COLD_INTERVAL', 15.0))
+TRIANGLE_HOT_ZSCORE = float(os.getenv('TRIANGLE_HOT_ZSCORE', 3.0))
+PRICE_POLL_INTERVAL = 0.3
+
+# Источник рыночных данных: 'rest' - опрос fetch_tickers, 'ws' - поток лучших bid/ask Bybit
+MARKET_DATA_MODE = os.getenv('MARKET_DATA_MODE', 'rest')
+MARKET_DATA_WS_URL = os.getenv('MARKET_DATA_WS_URL', BYBIT_SPOT_WS_URL)
 
 # Семафор для ограничения одновременной торговли только одной связкой
 # trade_semaphore = asyncio.Semaphore(1)
 
-is_trading = False  # Глобальный флаг, указывающий, идет ли сейчас торговля
-trading_lock = asyncio.Lock()  # Блокировка для управления доступом к флагу
 
+async def call_with_rate_limit(client, method, *args, **kwargs):
+    """
+    Вызывает метод ccxt через лимитер и подстраивает бюджет по заголовкам лимита ответа.
+
+    При ошибке лимита метод ставится на паузу до сброса окна и запрос
+    повторяется до RATE_LIMIT_RETRIES раз; остальные исключения пробрасываются.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        async with rate_limiter.limit(method):
+            try:
+                result = await getattr(client, method)(*args, **kwargs)
+            except THROTTLE_ERRORS:
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise
+                delay = rate_limiter.backoff(method, headers=client.last_response_headers)
+                logger.warning(f"Лимит запросов для {method}: пауза {delay:.2f} сек, повтор {attempt + 1}/{RATE_LIMIT_RETRIES}")
+                continue
+        rate_limiter.observe_headers(method, client.last_response_headers)
+        return result
 
 async def fetch_with_rate_limit(client, method, *args, **kwargs):
-    async with rate_limiter:
-        try:
-            return await getattr(client, method)(*args, **kwargs)
-        except Exception as e:
-            logger.error(f"Ошибка при выполнении {method}: {str(e)}")
-            return None
-
-async def get_trianbular_pairs(client):
-    markets = await fetch_with_rate_limit(client, 'fetch_markets')
-    markets = [x for x in markets if ':' not in x['symbol']]
-    triangular_pairs_list = []
-    remove_duplicates_list = []
-
-    for pair_a in markets:
-        a_base, a_quote = pair_a['base'], pair_a['quote']
-        a_pair_box = [a_base, a_quote]
-
-        for pair_b in markets:
-            b_base, b_quote = pair_b['base'], pair_b['quote']
-            if pair_b['symbol'] != pair_a['symbol']:
-                if b_base in a_pair_box or b_quote in a_pair_box:
-                    for pair_c in markets:
-                        c_base, c_quote = pair_c['base'], pair_c['quote']
-
-                        if pair_c['symbol'] != pair_a['symbol'] and pair_c['symbol'] != pair_b['symbol']:
-                            combine_all = [pair_a['symbol'], pair_b['symbol'], pair_c['symbol']]
-                            pair_box = [a_base, a_quote, b_base, b_quote, c_base, c_quote]
-
-                            counts_c_base = pair_box.count(c_base)
-                            counts_c_quote = pair_box.count(c_quote)
-
-                            if counts_c_base == 2 and counts_c_quote == 2 and c_base != c_quote:
-                                combined = ",".join(combine_all)
-                                unique_item = ''.join(sorted(combine_all))
-
-                                if unique_item not in remove_duplicates_list:
-                                    match_dict = {
-                                        "a_base": a_base,
-                                        "b_base": b_base,
-                                        "c_base": c_base,
-                                        "a_quote": a_quote,
-                                        "b_quote": b_quote,
-                                        "c_quote": c_quote,
-                                        "pair_a": pair_a['symbol'],
-                                        "pair_b": pair_b['symbol'],
-                                        "pair_c": pair_c['symbol'],
-                                        "combined": combined
-                                    }
-                                    triangular_pairs_list.append(match_dict)
-                                    logger.info(f"triangular pairs is : \n{match_dict}")
-                                    remove_duplicates_list.append(unique_item)
-
-    with open('markets.json', 'w') as f:
-        structured_pairs = [x for x in triangular_pairs_list if 'EUR' not in x['combined']]
-        json.dump(structured_pairs, f)
-
-async def get_price_for_t_pair(client, t_pair):
-    ticker_a = await fetch_with_rate_limit(client, 'fetch_ticker', t_pair['pair_a'])
-    await asyncio.sleep(0.2)
-    ticker_b = await fetch_with_rate_limit(client, 'fetch_ticker', t_pair['pair_b'])
-    await asyncio.sleep(0.2)
-    ticker_c = await fetch_with_rate_limit(client, 'fetch_ticker', t_pair['pair_c'])
-    
+    try:
+        return await call_with_rate_limit(client, method, *args, **kwargs)
+    except THROTTLE_ERRORS as e:
+        logger.error(f"Лимит запросов для {method} не сбросился после {RATE_LIMIT_RETRIES} повторов: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении {method}: {str(e)}")
+        return None
+
+# Комиссии, точность и лимиты по символу; обновляются вместе с каталогом
+MARKET_METADATA = MarketMetadata()
+
+# Общий кеш стаканов: треугольники с общими ногами не запрашивают один стакан повторно
+ORDER_BOOK_CACHE = OrderBookCache(fetch_with_rate_limit, ttl=ORDER_BOOK_TTL)
+
+# Локальная книга балансов: проверки перед ногами читают её вместо fetch_balance;
+# обновляется по исполнениям и приватному потоку wallet, сверяется с биржей в фоне
+BALANCE_LEDGER = BalanceLedger(fetch_with_rate_limit)
+BALANCE_RECONCILE_INTERVAL = float(os.getenv('BALANCE_RECONCILE_INTERVAL', 60))
+
+# Ожидание исполнения ордеров: события order приватного потока, fetch_order - запасной путь
+ORDER_TRACKER = OrderTracker(fetch_with_rate_limit, timeout=float(os.getenv('ORDER_FILL_TIMEOUT', 5)))
+
+# Журнал возможностей и результатов сделок (NDJSON), пишется в фоне
+JOURNAL = JournalWriter(os.getenv('JOURNAL_PATH', 'trading_journal.ndjson'))
+
+# Колоночное хранилище оценок (поверхностный курс и глубина) для opportunity_report.py;
+# неприбыльные оценки пишутся выборкой - каждая OPPORTUNITY_SAMPLE_EVERY-я
+OPPORTUNITY_STORE = OpportunityStore(os.getenv('OPPORTUNITY_STORE_PATH', 'opportunities'),
+                                     sample_every=int(os.getenv('OPPORTUNITY_SAMPLE_EVERY', 100)))
+
+# Запись котировок и стаканов для replay.py; включается, если задан MARKET_RECORD_PATH
+MARKET_RECORD_PATH = os.getenv('MARKET_RECORD_PATH')
+MARKET_RECORDER = MarketRecorder(MARKET_RECORD_PATH) if MARKET_RECORD_PATH else None
+
+# Резервирование капитала по валютам: связки с непересекающимися монетами торгуются одновременно
+CAPITAL_ALLOCATOR = CapitalAllocator(BALANCE_LEDGER.get, timeout=float(os.getenv('RESERVATION_TIMEOUT', 30)))
+
+async def get_trianbular_pairs(client, markets=None):
+    if markets is None:
+        markets = await fetch_with_rate_limit(client, 'fetch_markets')
+    markets = filter_spot_markets(markets)
+
+    # Поиск треугольников через индекс смежности валют (без перебора markets³)
+    triangular_pairs_list = find_triangular_pairs(markets)
+    logger.info(f"Найдено треугольников: {len(triangular_pairs_list)}")
+
+    # Вместе с каталогом сохраняются символы рынков, по которым он построен
+    catalog = TriangleCatalog([x for x in triangular_pairs_list if is_tradable_triangle(x)])
+    catalog.market_symbols = {x['symbol'] for x in markets}
+    catalog.save(MARKETS_PATH)
+
+async def log_stats_periodically(interval=STATS_LOG_INTERVAL, scheduler=None, heat=None, simulator=None):
+    """
+    Периодически выводит счётчики кеша стаканов (сколько запросов сэкономлено),
+    загрузку полос лимитера запросов и, если заданы, статистику воркеров треугольников,
+    число горячих треугольников и счётчики симулятора биржи.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if simulator is not None:
+            logger.info(f"Симулятор биржи: {simulator.summary()}")
+        logger.info(f"Кеш стаканов: {ORDER_BOOK_CACHE.summary()}")
+        logger.info(f"Лимитер запросов: {rate_limiter.summary()}")
+        if scheduler is not None:
+            logger.info(f"Воркеры треугольников: {scheduler.summary()}")
+        if heat is not None:
+            logger.info(f"Треугольники: {heat.summary()}")
+        if BALANCE_LEDGER.seeded:
+            logger.info(f"Книга балансов: {BALANCE_LEDGER.summary()}")
+            logger.info(f"Исполнение ордеров: {ORDER_TRACKER.summary()}")
+            logger.info(f"Резервации капитала: {CAPITAL_ALLOCATOR.summary()}")
+        logger.info(f"Журнал: {JOURNAL.summary()}")
+        logger.info(f"Хранилище возможностей: {OPPORTUNITY_STORE.summary()}")
+        if MARKET_RECORDER:
+            logger.info(f"Запись рыночных данных: {MARKET_RECORDER.summary()}")
+
+async def maintain_triangle_catalog(client, catalog, interval=CATALOG_REFRESH_INTERVAL):
+    """
+    Фоновая задача: периодически сверяет fetch_markets с каталогом треугольников.
+
+    Добавляет треугольники с новыми листингами и убирает треугольники с делистнутыми
+    символами без полной перестройки markets.json и без перезапуска основного цикла.
+    Тем же запросом обновляются метаданные рынков (комиссии, точность, лимиты).
+    """
+    while True:
+        await asyncio.sleep(interval)
+        markets = await fetch_with_rate_limit(client, 'fetch_markets')
+        if not markets:
+            continue
+
+        MARKET_METADATA.update(markets)
+        sync_triangle_catalog(catalog, markets)
+
+def sync_triangle_catalog(catalog, markets):
+    """
+    Применяет результат fetch_markets к каталогу и сохраняет его, если каталог
+    изменился или символы рынков ещё не были сохранены.
+    """
+    synced = catalog.market_symbols is not None
+    added, removed = catalog.apply_markets(markets)
+    if added or removed:
+        logger.info(f"Каталог обновлён: +{len(added)} / -{len(removed)} треугольников, всего {len(catalog.pairs)}")
+    if added or removed or not synced:
+        catalog.save(MARKETS_PATH)
+
+async def refresh_price_table(client, symbols, price_table=PRICE_TABLE):
+    """
+    Один снимок fetch_tickers на цикл вместо трёх fetch_ticker на каждый треугольник.
+
+    Parameters
+    ----------
+    client : ccxt.Exchange
+        The exchange client to use.
+    symbols : iterable
+        Символы, котировки которых нужны каталогу.
+    price_table : dict
+        Общая таблица цен symbol -> ticker, которую читают все треугольники.
+
+    Returns
+    -------
+    bool
+        True, если снимок получен.
+    """
+    tickers = await fetch_with_rate_limit(client, 'fetch_tickers', list(symbols))
+    if not tickers:
+        return False
+
+    # Заменяем содержимое целиком, чтобы все треугольники видели котировки одного момента
+    price_table.clear()
+    price_table.update(tickers)
+    if MARKET_RECORDER:
+        MARKET_RECORDER.record_tickers(tickers)
+    return True
+
+def get_price_for_t_pair(t_pair, price_table=PRICE_TABLE):
+    ticker_a = price_table.get(t_pair['pair_a'], {})
+    ticker_b = price_table.get(t_pair['pair_b'], {})
+    ticker_c = price_table.get(t_pair['pair_c'], {})
+
     # Создаем словарь ask_bid вручную
-    ask_bid = {f"pair_a_ask": ticker_a['ask'], f"pair_a_bid": ticker_a['bid'], 
-               f"pair_b_ask": ticker_b['ask'], f"pair_b_bid": ticker_b['bid'], 
-               f"pair_c_ask": ticker_c['ask'], f"pair_c_bid": ticker_c['bid']}
+    ask_bid = {f"pair_a_ask": ticker_a.get('ask'), f"pair_a_bid": ticker_a.get('bid'),
+               f"pair_b_ask": ticker_b.get('ask'), f"pair_b_bid": ticker_b.get('bid'),
+               f"pair_c_ask": ticker_c.get('ask'), f"pair_c_bid": ticker_c.get('bid')}
     return ask_bid
 
-async def get_depth_from_orderbook(client, surface_arb, taker_fee):
-    swap_1 = surface_arb["swap_1"]
-    starting_amount = STARTING_AMOUNT.get(swap_1, 100)
+async def load_depth_books(client, contracts, order_books=ORDER_BOOKS):
+    """
+    Собирает стаканы (adj_prices, adj_quantities) для списка (contract, direction).
 
-    tasks = []
-    contracts = [(surface_arb[f"contract_{i}"], surface_arb[f"direction_trade_{i}"]) for i in range(1, 4)]
-    for contract, direction in contracts:
-        # Здесь добавляем именно корутину в список tasks, а не словарь
-        tasks.append(fetch_with_rate_limit(client, 'fetch_order_book', contract, limit=20))
+    Синхронизированные локальные книги читаются напрямую, остальные берутся из кеша
+    стаканов / REST. Повторяющиеся (contract, direction) загружаются один раз.
 
-    depths = await asyncio.gather(*tasks)
+    Returns
+    -------
+    dict
+        (contract, direction) -> (adj_prices, adj_quantities) или None, если стакан не получен.
+    """
+    books = {}
+    tasks = {}
+    for contract, direction in dict.fromkeys(contracts):
+        book = order_books.get(contract)
+        if book is not None and book.synced:
+            books[(contract, direction)] = book.reformatted(direction, 20)
+            if MARKET_RECORDER:
+                MARKET_RECORDER.record_local_book(book)
+        else:
+            tasks[(contract, direction)] = ORDER_BOOK_CACHE.get(client, contract, limit=20)
 
-    reformatted_depths = [reformated_orderbook(depth, direction) for depth, (_, direction) in zip(depths, contracts)]
+    if tasks:
+        depths = await asyncio.gather(*tasks.values())
+        for key, depth in zip(tasks, depths):
+            books[key] = reformated_orderbook(depth, key[1]) if depth else None
+            if MARKET_RECORDER and depth:
+                MARKET_RECORDER.record_book(key[0], depth)
+    return books
 
-    acquired_coin_t1 = calculate_acquired_coin(starting_amount, reformatted_depths[0], taker_fee)
-    acquired_coin_t2 = calculate_acquired_coin(acquired_coin_t1, reformatted_depths[1], taker_fee)
-    acquired_coin_t3 = calculate_acquired_coin(acquired_coin_t2, reformatted_depths[2], taker_fee)
+async def get_depth_from_orderbook_batch(client, surface_arbs, taker_fees, order_books=ORDER_BOOKS):
+    """
+    Проверка глубины сразу для многих кандидатов одним векторным проходом.
 
-    profit_loss = acquired_coin_t3 - starting_amount
-    real_rate_perc = (profit_loss / starting_amount) * 100 if profit_loss != 0 else 0
+    Parameters
+    ----------
+    client : ccxt.Exchange
+        The exchange client to use.
+    surface_arbs : list
+        Список surface_dict кандидатов.
+    taker_fees : list
+        Комиссии для каждого кандидата: число или список из трёх (по ногам).
+    order_books : dict
+        Локальные стаканы symbol -> LocalOrderBook.
+
+    Returns
+    -------
+    list
+        Для каждого кандидата - словарь с profit_loss, real_rate_perc и trade_amount
+        (проверенный стартовый объём) или пустой словарь.
+    """
+    if not surface_arbs:
+        return []
+
+    # Стаканы проходятся в порядке реального движения монет (trade_legs), комиссии - так же
+    trades = [trade_legs(surface_arb) for surface_arb in surface_arbs]
+    legs = [[(leg["contract"], leg["direction"]) for leg in trade] for trade in trades]
+    books = await load_depth_books(client, [leg for candidate in legs for leg in candidate], order_books)
+
+    # Кандидаты без любого из трёх стаканов не оцениваются
+    keys = [key for key, book in books.items() if book is not None]
+    rows = {key: r for r, key in enumerate(keys)}
+    valid = [n for n, candidate in enumerate(legs) if all(leg in rows for leg in candidate)]
+    results = [{} for _ in surface_arbs]
+    if not valid:
+        return results
+
+    starting_amounts = [max_trade_amount(trades[n][0]["coin_in"]) for n in valid]
+    # Комиссия может быть общей или своей для каждой ноги
+    fees = [[taker_fees[n][leg["leg"] - 1] for leg in trades[n]] if isinstance(taker_fees[n], (list, tuple))
+            else [taker_fees[n]] * 3 for n in valid]
+
+    if OPTIMIZE_TRADE_SIZE:
+        # Оптимальный размер входа по кривым трёх стаканов; max_trade_amount - верхняя граница
+        for n, max_amount, fee in zip(valid, starting_amounts, fees):
+            solution = solve_trade_size([books[leg] for leg in legs[n]], fee, max_amount, leg_min_inputs(legs[n]))
+            if solution and solution["profit_loss"] > 0:
+                # Поля глубины идут после surface_dict: его profit_loss посчитан для одной монеты
+                results[n] = {
+                    **surface_arbs[n],
+                    "profit_loss": solution["profit_loss"],
+                    "real_rate_perc": solution["real_rate_perc"],
+                    "trade_amount": solution["amount"]
+                }
+        return results
+
+    curves = build_curves([books[key] for key in keys])
+    leg_rows = [[rows[leg] for leg in legs[n]] for n in valid]
+
+    _, _, acquired_coin_t3, fully_filled = walk_triangles(curves, leg_rows, starting_amounts, fees)
+
+    for n, starting_amount, acquired, filled in zip(valid, starting_amounts, acquired_coin_t3.tolist(), fully_filled.tolist()):
+        # Стакана не хватило на весь объём - возможности нет
+        if not filled:
+            continue
+        profit_loss = acquired - starting_amount
+        real_rate_perc = (profit_loss / starting_amount) * 100 if profit_loss != 0 else 0
+        if real_rate_perc > 0:
+            results[n] = {
+                **surface_arbs[n],
+                "profit_loss": profit_loss,
+                "real_rate_perc": real_rate_perc,
+                "trade_amount": starting_amount
+            }
+    return results
 
-    if real_rate_perc > 0:
-        return {
-            "profit_loss": profit_loss,
-            "real_rate_perc": real_rate_perc,
-            **surface_arb
-        }
+def max_trade_amount(coin):
+    """
+    Стартовый объём сделки в монете coin: STARTING_AMOUNT, но не больше свободного
+    баланса из локальной книги (если она уже загружена).
+    """
+    amount = STARTING_AMOUNT.get(coin, 100)
+    if BALANCE_LEDGER.seeded:
+        amount = min(amount, BALANCE_LEDGER.get(coin))
+    return amount
 
-    return {}
+def leg_min_inputs(legs):
+    """
+    Минимальный вход каждой ноги в её входной монете по лимитам рынка.
 
-def calculate_acquired_coin(amount_in, orderbook, taker_fee=0.001):
-    # Initialise Variables
-    trading_balance = amount_in
-    quantity_bought = 0
-    acquired_coin = 0
-    counts = 0
-    for level in orderbook:
-
-        # Extract the level price and quantity
-        level_price = level[0]
-        level_available_quantity = level[1]
-
-        if trading_balance <= level_available_quantity:
-            quantity_bought = trading_balance
-            trading_balance = 0
-            amount_bought = quantity_bought * level_price
-        else:
-            quantity_bought = level_available_quantity
-            trading_balance -= quantity_bought
-            amount_bought = quantity_bought * level_price
+    base_to_quote (по 1 / ask) расходует quote - ограничивает min cost,
+    quote_to_base (по bid) расходует base - ограничивает min amount.
+    """
+    return [MARKET_METADATA.min_cost(contract) if direction == "base_to_quote" else MARKET_METADATA.min_amount(contract)
+            for contract, direction in legs]
 
-        # Accumulate Acquired Coin
-        acquired_coin += amount_bought * (1 - taker_fee)
+async def get_depth_from_orderbook(client, surface_arb, taker_fee, order_books=ORDER_BOOKS):
+    results = await get_depth_from_orderbook_batch(client, [surface_arb], [taker_fee], order_books)
+    return results[0]
 
-        # Exit Trade
-        if trading_balance == 0:
-            return acquired_coin
+def calculate_acquired_coin(amount_in, orderbook, taker_fee=0.001):
+    """
+    Сколько монеты получим за amount_in по одному стакану [[adj_price, adj_quantity], ...].
 
-        # Exit if not enough order book levels
-        counts += 1
-        if counts == len(orderbook):
-            return 0
+    Если стакана не хватает, возвращается частичное исполнение (раньше возвращался 0).
+    """
+    acquired, _ = walk_books(build_curves([orderbook]), 0, amount_in, taker_fee)
+    return float(acquired)
 
 
 # Reformat Order Book for Depth Calculation
@@ -194,473 +452,544 @@ def reformated_orderbook(prices, c_direction):
 
 # Calculate Surface Rate Arbitrage Opportunity
 def calc_triangular_arb_surface_rate(t_pair, prices_dict):
+    """
+    Рассчитывает поверхностный курс треугольника по скомпилированному маршруту.
 
-    # Set Variables
-    starting_amount = 1
-    min_surface_rate = 0
-    surface_dict = {}
-    contract_2 = ""
-    contract_3 = ""
-    direction_trade_1 = ""
-    direction_trade_2 = ""
-    direction_trade_3 = ""
-    acquired_coin_t2 = 0
-    acquired_coin_t3 = 0
-    calculated = 0
-
-    # Extract Pair Variables
-    a_base = t_pair["a_base"]
-    a_quote = t_pair["a_quote"]
-    b_base = t_pair["b_base"]
-    b_quote = t_pair["b_quote"]
-    c_base = t_pair["c_base"]
-    c_quote = t_pair["c_quote"]
-    pair_a = t_pair["pair_a"]
-    pair_b = t_pair["pair_b"]
-    pair_c = t_pair["pair_c"]
-
-    # Extract Price Information
-    a_ask = prices_dict["pair_a_ask"]
-    a_bid = prices_dict["pair_a_bid"]
-    b_ask = prices_dict["pair_b_ask"]
-    b_bid = prices_dict["pair_b_bid"]
-    c_ask = prices_dict["pair_c_ask"]
-    c_bid = prices_dict["pair_c_bid"]
-
-    # Set directions and loop through
-    direction_list = ["forward", "reverse"]
-    for direction in direction_list:
-    
-        # Set additional variables for swap information
-        swap_1 = 0
-        swap_2 = 0
-        swap_3 = 0
-        swap_1_rate = 0
-        swap_2_rate = 0
-        swap_3_rate = 0
-    
-        """
-            Poloniex Rules !!
-            If we are swapping the coin on the left (Base) to the right (Quote) then * (1 / Ask)
-            If we are swapping the coin on the right (Quote) to the left (Base) then * Bid
-        """
-    
-        # Assume starting with a_base and swapping for a_quote
-        if direction == "forward":
-            swap_1 = a_base
-            swap_2 = a_quote
-            swap_1_rate = 1 / a_ask
-            direction_trade_1 = "base_to_quote"
-    
-        # Assume starting with a_base and swapping for a_quote
-        if direction == "reverse":
-            swap_1 = a_quote
-            swap_2 = a_base
-            swap_1_rate = a_bid
-            direction_trade_1 = "quote_to_base"
-    
-        # Place first trade
-        contract_1 = pair_a
-        acquired_coin_t1 = starting_amount * swap_1_rate
-      
-
-        """  FORWARD """
-        # SCENARIO 1 Check if a_quote (acquired_coin) matches b_quote
-        if direction == "forward":
-            if a_quote == b_quote and calculated == 0:
-                swap_2_rate = b_bid
-                acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
-                direction_trade_2 = "quote_to_base"
-                contract_2 = pair_b
-
-                # If b_base (acquired coin) matches c_base
-                if b_base == c_base:
-                    swap_3 = c_base
-                    swap_3_rate = 1 / c_ask
-                    direction_trade_3 = "base_to_quote"
-                    contract_3 = pair_c
-
-                # If b_base (acquired coin) matches c_quote
-                if b_base == c_quote:
-                    swap_3 = c_quote
-                    swap_3_rate = c_bid
-                    direction_trade_3 = "quote_to_base"
-                    contract_3 = pair_c
-
-                acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
-                calculated = 1
-
-        # SCENARIO 2 Check if a_quote (acquired_coin) matches b_base
-        if direction == "forward":
-            if a_quote == b_base and calculated == 0:
-                swap_2_rate = 1 / b_ask
-                acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
-                direction_trade_2 = "base_to_quote"
-                contract_2 = pair_b
-
-                # If b_quote (acquired coin) matches c_base
-                if b_quote == c_base:
-                    swap_3 = c_base
-                    swap_3_rate = 1 / c_ask
-                    direction_trade_3 = "base_to_quote"
-                    contract_3 = pair_c
-
-                # If b_quote (acquired coin) matches c_quote
-                if b_quote == c_quote:
-                    swap_3 = c_quote
-                    swap_3_rate = c_bid
-                    direction_trade_3 = "quote_to_base"
-                    contract_3 = pair_c
-
-                acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
-                calculated = 1
-
-        # SCENARIO 3 Check if a_quote (acquired_coin) matches c_quote
-        if direction == "forward":
-            if a_quote == c_quote and calculated == 0:
-                swap_2_rate = c_bid
-                acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
-                direction_trade_2 = "quote_to_base"
-                contract_2 = pair_c
-
-                # If c_base (acquired coin) matches b_base
-                if c_base == b_base:
-                    swap_3 = b_base
-                    swap_3_rate = 1 / b_ask
-                    direction_trade_3 = "base_to_quote"
-                    contract_3 = pair_b
-
-                # If c_base (acquired coin) matches b_quote
-                if c_base == b_quote:
-                    swap_3 = b_quote
-                    swap_3_rate = b_bid
-                    direction_trade_3 = "quote_to_base"
-                    contract_3 = pair_b
-
-                acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
-                calculated = 1
-
-        # SCENARIO 4 Check if a_quote (acquired_coin) matches c_base
-        if direction == "forward":
-            if a_quote == c_base and calculated == 0:
-                swap_2_rate = 1 / c_ask
-                acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
-                direction_trade_2 = "base_to_quote"
-                contract_2 = pair_c
-
-                # If c_quote (acquired coin) matches b_base
-                if c_quote == b_base:
-                    swap_3 = b_base
-                    swap_3_rate = 1 / b_ask
-                    direction_trade_3 = "base_to_quote"
-                    contract_3 = pair_b
-
-                # If c_quote (acquired coin) matches b_quote
-                if c_quote == b_quote:
-                    swap_3 = b_quote
-                    swap_3_rate = b_bid
-                    direction_trade_3 = "quote_to_base"
-                    contract_3 = pair_b
-
-                acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
-                calculated = 1
-
-        """  REVERSE """
-        # SCENARIO 1 Check if a_base (acquired_coin) matches b_quote
-        if direction == "reverse":
-            if a_base == b_quote and calculated == 0:
-                swap_2_rate = b_bid
-                acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
-                direction_trade_2 = "quote_to_base"
-                contract_2 = pair_b
-
-                # If b_base (acquired coin) matches c_base
-                if b_base == c_base:
-                    swap_3 = c_base
-                    swap_3_rate = 1 / c_ask
-                    direction_trade_3 = "base_to_quote"
-                    contract_3 = pair_c
-
-                # If b_base (acquired coin) matches c_quote
-                if b_base == c_quote:
-                    swap_3 = c_quote
-                    swap_3_rate = c_bid
-                    direction_trade_3 = "quote_to_base"
-                    contract_3 = pair_c
-
-                acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
-                calculated = 1
-
-        # SCENARIO 2 Check if a_base (acquired_coin) matches b_base
-        if direction == "reverse":
-            if a_base == b_base and calculated == 0:
-                swap_2_rate = 1 / b_ask
-                acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
-                direction_trade_2 = "base_to_quote"
-                contract_2 = pair_b
-
-                # If b_quote (acquired coin) matches c_base
-                if b_quote == c_base:
-                    swap_3 = c_base
-                    swap_3_rate = 1 / c_ask
-                    direction_trade_3 = "base_to_quote"
-                    contract_3 = pair_c
-
-                # If b_quote (acquired coin) matches c_quote
-                if b_quote == c_quote:
-                    swap_3 = c_quote
-                    swap_3_rate = c_bid
-                    direction_trade_3 = "quote_to_base"
-                    contract_3 = pair_c
-
-                acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
-                calculated = 1
-
-        # SCENARIO 3 Check if a_base (acquired_coin) matches c_quote
-        if direction == "reverse":
-            if a_base == c_quote and calculated == 0:
-                swap_2_rate = c_bid
-                acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
-                direction_trade_2 = "quote_to_base"
-                contract_2 = pair_c
-
-                # If c_base (acquired coin) matches b_base
-                if c_base == b_base:
-                    swap_3 = b_base
-                    swap_3_rate = 1 / b_ask
-                    direction_trade_3 = "base_to_quote"
-                    contract_3 = pair_b
-
-                # If c_base (acquired coin) matches b_quote
-                if c_base == b_quote:
-                    swap_3 = b_quote
-                    swap_3_rate = b_bid
-                    direction_trade_3 = "quote_to_base"
-                    contract_3 = pair_b
-
-                acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
-                calculated = 1
-
-        # SCENARIO 4 Check if a_base (acquired_coin) matches c_base
-        if direction == "reverse":
-            if a_base == c_base and calculated == 0:
-                swap_2_rate = 1 / c_ask
-                acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
-                direction_trade_2 = "base_to_quote"
-                contract_2 = pair_c
-
-                # If c_quote (acquired coin) matches b_base
-                if c_quote == b_base:
-                    swap_3 = b_base
-                    swap_3_rate = 1 / b_ask
-                    direction_trade_3 = "base_to_quote"
-                    contract_3 = pair_b
-
-                # If c_quote (acquired coin) matches b_quote
-                if c_quote == b_quote:
-                    swap_3 = b_quote
-                    swap_3_rate = b_bid
-                    direction_trade_3 = "quote_to_base"
-                    contract_3 = pair_b
-
-                acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
-                calculated = 1
-                
-        """ PROFIT LOSS OUTPUT """
-
-        # Profit and Loss Calculations
-        profit_loss = acquired_coin_t3 - starting_amount
-        profit_loss_perc = (profit_loss / starting_amount) * 100 if profit_loss != 0 else 0
-
-        # Trade Descriptions
-        trade_description_1 = f"Start with {swap_1} of {starting_amount}. Swap at {swap_1_rate} for {swap_2} acquiring {acquired_coin_t1}."
-        trade_description_2 = f"Swap {acquired_coin_t1} of {swap_2} at {swap_2_rate} for {swap_3} acquiring {acquired_coin_t2}."
-        trade_description_3 = f"Swap {acquired_coin_t2} of {swap_3} at {swap_3_rate} for {swap_1} acquiring {acquired_coin_t3}."
-
-        # Output Results
-        if profit_loss_perc > min_surface_rate:
-            surface_dict = {
-                "swap_1": swap_1,
-                "swap_2": swap_2,
-                "swap_3": swap_3,
-                "contract_1": contract_1,
-                "contract_2": contract_2,
-                "contract_3": contract_3,
-                "direction_trade_1": direction_trade_1,
-                "direction_trade_2": direction_trade_2,
-                "direction_trade_3": direction_trade_3,
-                "starting_amount": starting_amount,
-                "acquired_coin_t1": acquired_coin_t1,
-                "acquired_coin_t2": acquired_coin_t2,
-                "acquired_coin_t3": acquired_coin_t3,
-                "swap_1_rate": swap_1_rate,
-                "swap_2_rate": swap_2_rate,
-                "swap_3_rate": swap_3_rate,
-                "profit_loss": profit_loss,
-                "profit_loss_perc": profit_loss_perc,
-                "direction": direction,
-                "trade_description_1": trade_description_1,
-                "trade_description_2": trade_description_2,
-                "trade_description_3": trade_description_3
-            }
-
-            return surface_dict
+    Ориентация ног берётся из t_pair["route_plan"] (см. surface_rate.compile_route_plan),
+    поэтому на каждом тике выполняется только перемножение курсов и сравнение,
+    а surface_dict с описаниями сделок собирается лишь для прибыльных направлений.
+    """
+    return calc_surface_rate(
+        t_pair,
+        prices_dict["pair_a_ask"], prices_dict["pair_a_bid"],
+        prices_dict["pair_b_ask"], prices_dict["pair_b_bid"],
+        prices_dict["pair_c_ask"], prices_dict["pair_c_bid"]
+    )
+
+def record_surface_miss(t_pair, price_table=PRICE_TABLE):
+    """
+    Учитывает неприбыльную оценку треугольника в OPPORTUNITY_STORE.
 
-    return surface_dict
+    Записывается только выборка (OpportunityStore.sample_miss), поэтому
+    доходность считается лишь для записываемых оценок. Треугольник без
+    котировок оценкой не считается.
+    """
+    prices_dict = get_price_for_t_pair(t_pair, price_table)
+    if not all(prices_dict.values()) or not OPPORTUNITY_STORE.sample_miss():
+        return
+    best = best_surface_rate(
+        t_pair,
+        prices_dict["pair_a_ask"], prices_dict["pair_a_bid"],
+        prices_dict["pair_b_ask"], prices_dict["pair_b_bid"],
+        prices_dict["pair_c_ask"], prices_dict["pair_c_bid"]
+    )
+    if best:
+        OPPORTUNITY_STORE.record_miss(t_pair['combined'], *best)
 
 async def check_balance(client, symbol):
     """
     Проверяет баланс по символу.
-    Возвращает количество доступной монеты.
+    Возвращает количество доступной монеты из локальной книги балансов;
+    fetch_balance выполняется, только если книга ещё не загружена.
     """
-    try:
-        balances = await fetch_with_rate_limit(client, 'fetch_balance')
-        if balances is None:
-            logger.error("Не удалось получить баланс. Убедитесь, что API ключи корректны.")
-            return 0
-        balance = balances.get(symbol, {}).get('free', 0)
-        return balance
-    except Exception as e:
-        logger.error(f"Ошибка при выполнении fetch_balance: {str(e)}")
+    if not BALANCE_LEDGER.seeded and not await BALANCE_LEDGER.reconcile(client):
+        logger.error("Не удалось получить баланс. Убедитесь, что API ключи корректны.")
         return 0
+    return BALANCE_LEDGER.get(symbol)
 
 async def open_market_orders(client, surface_arb):
     logger.info("start open_market_orders")
     """
     Открывает рыночные ордера на профитной связке и выводит P&L.
+    Ноги исполняются по очереди: вход каждой следующей - фактический выход предыдущей.
     Проверяет наличие достаточного объема перед каждым ордером.
     """
-    swap_1 = surface_arb["swap_1"]  # начальная монета
-    starting_amount = STARTING_AMOUNT.get(swap_1, 100) # объем стартовой монеты (можно заменить динамическим)
+    trade = trade_legs(surface_arb)
+    start_coin = trade[0]["coin_in"]
+    # объем стартовой монеты: размер из проверки глубины или фиксированный
+    starting_amount = surface_arb.get("trade_amount") or STARTING_AMOUNT.get(start_coin, 100)
+
+    logger.info(f"Начинаем свопы с {starting_amount} {start_coin}")
+
+    amount_in = starting_amount
+    for number, leg in enumerate(trade, start=1):
+        # Проверка баланса входной монеты ноги
+        balance = await check_balance(client, leg["coin_in"])
+        if balance < amount_in:
+            logger.error(f"Недостаточно {leg['coin_in']}. Доступно: {balance}, необходимо: {amount_in}")
+            return
+
+        side, amount, params = leg_order(leg["direction"], amount_in, leg["rate"])
+        logger.info(f"Открываем ордер {number}: {side} {leg['contract']} на {amount} ({amount_in} {leg['coin_in']})")
+        order = await call_with_rate_limit(client, 'create_order', leg["contract"], 'market', side, amount, None, params)
+
+        # Ждём фактического исполнения ордера (событие order или fetch_order)
+        order = await ORDER_TRACKER.wait_filled(client, order)
+        BALANCE_LEDGER.apply_order(order)
+        if not is_final(order) or not order.get('filled'):
+            logger.error(f"Ордер {number} {leg['contract']} не исполнен: {order.get('status') if order else None}")
+            return
+
+        amount_in = order_output(order, side)
+        if not amount_in:
+            logger.error(f"Ордер {number} {leg['contract']}: биржа не вернула объём исполнения")
+            return
 
-    logger.info(f"Начинаем свопы с {starting_amount} {swap_1}")
+    # Рассчитываем P&L
+    final_amount = amount_in
+    profit_loss = final_amount - starting_amount
+    profit_loss_perc = (profit_loss / starting_amount) * 100 if profit_loss != 0 else 0
+    
+    logger.info(f"P&L: {profit_loss:.2f} {start_coin}, Процент прибыли: {profit_loss_perc:.2f}%")
+    logger.info(f"Финальный баланс: {final_amount:.2f} {start_coin}")
 
-    # Проверка баланса перед первым ордером
-    balance_1 = await check_balance(client, swap_1)
-    logger.info(f"Начальный баланс {swap_1}: {balance_1}")
-    if balance_1 < starting_amount:
-        logger.error(f"Недостаточно {swap_1}. Доступно: {balance_1}, необходимо: {starting_amount}")
-        return
+    return {
+        "P&L": profit_loss,
+        "final_balance": final_amount,
+        "profit_loss_percentage": profit_loss_perc
+    }
 
-    # Открытие первого ордера
-    contract_1 = surface_arb["contract_1"]
-    direction_1 = surface_arb["direction_trade_1"]
-    amount_1 = starting_amount if direction_1 == "base_to_quote" else starting_amount / surface_arb["swap_1_rate"]
 
-    logger.info(f"Открываем первый ордер: {contract_1} на {amount_1}")
-    order_1 = await client.create_order(contract_1, 'market', 'buy' if direction_1 == "base_to_quote" else 'sell', amount_1)
+def leg_inputs(surface_arb):
+    """
+    Ноги связки в порядке исполнения и ожидаемый вход каждой в её входной монете.
 
-    # Ожидаем завершения первого ордера
-    await asyncio.sleep(0.3)
+    Стартовый объём задан в монете, которую тратит первая нога (trade_amount
+    проверки глубины или STARTING_AMOUNT), вход следующей ноги - выход предыдущей
+    по её курсу.
 
-    # Проверка баланса перед вторым ордером
-    swap_2 = surface_arb["swap_2"]
-    balance_2 = await check_balance(client, swap_2)
-    if balance_2 < order_1['filled']:
-        logger.error(f"Недостаточно {swap_2}. Доступно: {balance_2}, необходимо: {order_1['filled']}")
-        return
+    Returns
+    -------
+    tuple
+        (legs, amounts_in) - результат trade_legs и входы ног; amounts_in[0] - стартовый объём.
+    """
+    legs = trade_legs(surface_arb)
+    amount = surface_arb.get("trade_amount") or STARTING_AMOUNT.get(legs[0]["coin_in"], 100)
+    amounts_in = []
+    for leg in legs:
+        amounts_in.append(amount)
+        amount *= leg["rate"]
+    return legs, amounts_in
+
+def trade_requirements(surface_arb):
+    """
+    Капитал, который сделка должна зарезервировать в текущем EXECUTION_MODE.
 
-    # Открытие второго ордера
-    contract_2 = surface_arb["contract_2"]
-    direction_2 = surface_arb["direction_trade_2"]
-    amount_2 = order_1['filled'] if direction_2 == "base_to_quote" else order_1['filled'] / surface_arb["swap_2_rate"]
+    Одновременное исполнение расходует запас входных монет всех трёх ног.
+    Последовательное расходует только монету первой ноги, но промежуточные
+    монеты меняются по ходу сделки, поэтому занимаются исключительно.
 
-    logger.info(f"Открываем второй ордер: {contract_2} на {amount_2}")
-    order_2 = await client.create_order(contract_2, 'market', 'buy' if direction_2 == "base_to_quote" else 'sell', amount_2)
+    Returns
+    -------
+    tuple
+        (amounts, exclusive) для CapitalAllocator.reserve.
+    """
+    legs, amounts_in = leg_inputs(surface_arb)
+    if EXECUTION_MODE in ('concurrent', 'batch'):
+        return {leg["coin_in"]: amount for leg, amount in zip(legs, amounts_in)}, set()
+    return {legs[0]["coin_in"]: amounts_in[0]}, {leg["coin_in"] for leg in legs[1:]}
 
-    # Ожидаем завершения второго ордера
-    await asyncio.sleep(0.3)
+async def submit_batch_orders(client, legs):
+    """
+    Отправляет ноги одной пакетной заявкой (create_orders, v5/order/create-batch).
 
-    # Проверка баланса перед третьим ордером
-    swap_3 = surface_arb["swap_3"]
-    balance_3 = await check_balance(client, swap_3)
-    if balance_3 < order_2['filled']:
-        logger.error(f"Недостаточно {swap_3}. Доступно: {balance_3}, необходимо: {order_2['filled']}")
-        return
+    Parameters
+    ----------
+    legs : list
+        Список (contract, side, amount, params).
 
-    # Открытие третьего ордера
-    contract_3 = surface_arb["contract_3"]
-    direction_3 = surface_arb["direction_trade_3"]
-    amount_3 = order_2['filled'] if direction_3 == "base_to_quote" else order_2['filled'] / surface_arb["swap_3_rate"]
+    Returns
+    -------
+    list
+        Для каждой ноги - ордер ccxt или исключение с причиной отказа.
+    """
+    try:
+        orders = await call_with_rate_limit(client, 'create_orders', [
+            {"symbol": contract, "type": 'market', "side": side, "amount": amount, "params": params}
+            for contract, side, amount, params in legs
+        ])
+    except Exception as e:
+        return [e] * len(legs)
+
+    # ccxt может пересортировать ответ, поэтому ноги сопоставляются по символу (в связке они разные)
+    by_symbol = {order.get('symbol'): order for order in orders or []}
+    results = []
+    for contract, _, _, _ in legs:
+        order = by_symbol.get(contract)
+        if not order:
+            results.append(Exception("нет ответа в пакете"))
+        elif not order.get('id'):
+            # Отказ по ноге: Bybit кладёт код и причину в retExtInfo
+            info = order.get('info') or {}
+            results.append(Exception(f"{info.get('code')}: {info.get('msg')}"))
+        else:
+            results.append(order)
+    return results
 
-    logger.info(f"Открываем третий ордер: {contract_3} на {amount_3}")
-    order_3 = await client.create_order(contract_3, 'market', 'buy' if direction_3 == "base_to_quote" else 'sell', amount_3)
+async def open_concurrent_orders(client, surface_arb, batch=False):
+    """
+    Открывает три рыночных ордера связки одновременно из инвентаря во всех трёх монетах.
 
-    # Ожидаем завершения третьего ордера
-    await asyncio.sleep(0.3)
+    Ноги не ждут друг друга: вход второй и третьей ноги берётся из запаса по ожидаемым
+    курсам, поэтому исполнение занимает один круг запросов к бирже. Смещение запаса
+    возвращает к целям InventoryRebalancer вне торгового пути.
 
-    # Рассчитываем P&L
-    final_amount = order_3['filled']
+    Parameters
+    ----------
+    client : ccxt.Exchange
+        The exchange client to use.
+    surface_arb : dict
+        Результат проверки глубины (surface_dict с profit_loss и trade_amount).
+    batch : bool
+        Отправить ноги одной пакетной заявкой вместо трёх параллельных create_order.
+
+    Returns
+    -------
+    dict or None
+        P&L, final_balance, profit_loss_percentage, orders (id ордеров) и legs - результат
+        каждой ноги (contract, side, amount, id, status, filled, cost, error).
+    """
+    logger.info("start open_concurrent_orders")
+    trade, amounts_in = leg_inputs(surface_arb)
+    starting_amount, start_coin = amounts_in[0], trade[0]["coin_in"]
+
+    # Запас входных монет всех трёх ног - из локальной книги балансов
+    for leg, amount in zip(trade, amounts_in):
+        free = await check_balance(client, leg["coin_in"])
+        if free < amount:
+            logger.error(f"Недостаточно инвентаря {leg['coin_in']}. Доступно: {free}, необходимо: {amount}")
+            return
+
+    legs = []
+    for leg, amount_in in zip(trade, amounts_in):
+        side, amount, params = leg_order(leg["direction"], amount_in, leg["rate"])
+        legs.append((leg["contract"], side, amount, params))
+        logger.info(f"Ордер {leg['leg']}: {side} {leg['contract']} на {amount} ({amount_in} {leg['coin_in']})")
+
+    if batch:
+        orders = await submit_batch_orders(client, legs)
+    else:
+        orders = await asyncio.gather(*[
+            call_with_rate_limit(client, 'create_order', contract, 'market', side, amount, None, params)
+            for contract, side, amount, params in legs
+        ], return_exceptions=True)
+
+    errors = [str(order) if isinstance(order, Exception) else None for order in orders]
+    for (contract, _, _, _), error in zip(legs, errors):
+        if error:
+            logger.error(f"Ошибка ордера {contract}: {error}")
+    orders = [None if isinstance(order, Exception) else order for order in orders]
+
+    # Ждём исполнения всех трёх ног одновременно
+    orders = await asyncio.gather(*[ORDER_TRACKER.wait_filled(client, order) for order in orders])
+    for order in orders:
+        BALANCE_LEDGER.apply_order(order)
+
+    # Без объёмов в ответе биржи P&L оценивается по ожидаемому курсу третьей ноги
+    final_amount = order_output(orders[2], legs[2][1]) or amounts_in[2] * trade[2]["rate"]
     profit_loss = final_amount - starting_amount
     profit_loss_perc = (profit_loss / starting_amount) * 100 if profit_loss != 0 else 0
-    
-    logger.info(f"P&L: {profit_loss:.2f} {swap_1}, Процент прибыли: {profit_loss_perc:.2f}%")
-    logger.info(f"Финальный баланс: {final_amount:.2f} {swap_1}")
+
+    logger.info(f"P&L: {profit_loss:.2f} {start_coin}, Процент прибыли: {profit_loss_perc:.2f}%")
 
     return {
         "P&L": profit_loss,
         "final_balance": final_amount,
-        "profit_loss_percentage": profit_loss_perc
+        "profit_loss_percentage": profit_loss_perc,
+        "orders": [order.get('id') if order else None for order in orders],
+        "legs": [{
+            "contract": contract,
+            "side": side,
+            "amount": amount,
+            "id": order.get('id') if order else None,
+            "status": order.get('status') if order else "rejected",
+            "filled": order.get('filled') if order else None,
+            "cost": order.get('cost') if order else None,
+            "error": error
+        } for (contract, side, amount, _), order, error in zip(legs, orders, errors)]
     }
 
 
+async def run_stream_mode(client, catalog, transport=None, book_transport=None,
+                          price_table=PRICE_TABLE, order_books=ORDER_BOOKS):
+    """
+    Потоковый режим: котировки приходят по WebSocket, треугольники пересчитываются по событию.
+
+    На каждое изменение bid/ask символа заново оцениваются только треугольники с этим
+    символом (по TriangleIndex), и только если их котировки изменились с последней оценки.
+    Прибыльные треугольники передаются в `process_surface_arb`; пока треугольник
+    обрабатывается, повторные срабатывания по нему пропускаются.
+    Параллельно отдельное соединение ведёт локальные стаканы (orderbook.50),
+    из которых get_depth_from_orderbook читает глубину без запросов к бирже.
+
+    Parameters
+    ----------
+    client : ccxt.Exchange
+        The exchange client to use.
+    catalog : TriangleCatalog
+        Каталог треугольников.
+    transport : WebSocketTransport, optional
+        Транспорт потока; по умолчанию Bybit (или MARKET_DATA_WS_URL, например replay-сервер).
+    book_transport : WebSocketTransport, optional
+        Транспорт потока стаканов, по умолчанию как у transport.
+    price_table : dict
+        Таблица котировок, которую наполняет поток.
+    order_books : dict
+        Таблица локальных стаканов symbol -> LocalOrderBook.
+    """
+    await client.load_markets()
+    transport = transport or WebSocketTransport(MARKET_DATA_WS_URL)
+    book_transport = book_transport or WebSocketTransport(MARKET_DATA_WS_URL)
+
+    state = {"pairs": catalog.pairs, "index": TriangleIndex(catalog.pairs)}
+    in_flight = set()
+
+    def market_ids(symbols):
+        return {client.market(symbol)['id']: symbol for symbol in symbols if symbol in client.markets}
+
+    def on_quote(symbol):
+        index = state["index"]
+        quote = price_table[symbol]
+        if not index.update_quote(symbol, quote['bid'], quote['ask']):
+            return  # изменился только объём лучшего уровня
+        if MARKET_RECORDER:
+            MARKET_RECORDER.record_quote(symbol, quote['bid'], quote['ask'])
+
+        for t in index.triangles_for(symbol):
+            t_pair = index.pairs[t]
+            if t_pair['combined'] in in_flight or not index.is_stale(t):
+                continue
+            index.mark_evaluated(t)
+            surface_dict = calc_triangular_arb_surface_rate(t_pair, get_price_for_t_pair(t_pair, price_table))
+            if surface_dict:
+                in_flight.add(t_pair['combined'])
+                task = asyncio.create_task(process_surface_arb(client, t_pair, surface_dict))
+                task.add_done_callback(lambda _, combined=t_pair['combined']: in_flight.discard(combined))
+            else:
+                record_surface_miss(t_pair, price_table)
+
+    symbol_ids = market_ids(state["index"].symbol_triangles)
+    stream = BybitQuoteStream(transport, symbol_ids, price_table, on_quote)
+    book_stream = BybitOrderBookStream(book_transport, symbol_ids, order_books)
+    stream_task = asyncio.create_task(stream.run())
+    book_task = asyncio.create_task(book_stream.run())
+    try:
+        while not stream_task.done():
+            await asyncio.sleep(1)
+            # Каталог обновился в фоне - перестраиваем индекс и подписываемся на новые символы
+            if state["pairs"] is not catalog.pairs:
+                state["pairs"] = catalog.pairs
+                state["index"] = TriangleIndex(catalog.pairs)
+                symbol_ids = market_ids(state["index"].symbol_triangles)
+                await stream.add_symbols(symbol_ids)
+                await book_stream.add_symbols(symbol_ids)
+        await stream_task
+    finally:
+        stream_task.cancel()
+        book_task.cancel()
+
 async def main():
     """
     Main function to run triangular arbitrage.
 
     This function will:
 
-    1. Load structured pairs from 'markets.json'
-    2. Process each pair in the list with `process_pair`
-    3. Wait for the results of all pairs to finish
-    4. Repeat the above steps every second
+    1. Load structured pairs from MARKETS_PATH ('markets.json', building it first if missing)
+    2. Start a background task that keeps the catalog in sync with listings
+    3. Start a pool of `TRIANGLE_WORKERS` workers that continuously service the due triangles
+       in batches: evaluate their surface rates in one vectorized pass, check the depth of
+       all hits in one batched pass and pass them to `process_surface_arb`
+    4. Keep taking `fetch_tickers` snapshots into the shared price table and move
+       the triangles whose quotes changed to the front of the workers' queue
+
+    Triangles close to break-even (relative to the volatility of their recent surface
+    rates) are revisited every `TRIANGLE_REVISIT_INTERVAL` seconds, cold ones are demoted
+    to a background lap of up to `TRIANGLE_COLD_INTERVAL` seconds, and a slow triangle
+    never holds up the others.
+
+    With MARKET_DATA_MODE=ws steps 3-4 are replaced by `run_stream_mode`,
+    which re-evaluates triangles on every WebSocket quote update.
 
     If any error occurs, it will be logged with the logger.
 
     Finally, it will close the ccxt client.
     """
-    client = ccxt.bybit({
-        'apiKey': API_KEY,
-        'secret': API_SECRET,
-        'enableRateLimit': True,  # Включение ограничения по частоте запросов
-        'options': {
-            'adjustForTimeDifference': True,  # Включение синхронизации времени
-    },
-    })
-
-    # await get_trianbular_pairs(client)
-
+    if EXCHANGE_SIMULATOR:
+        # Стартовый запас симулятора - сто сделок в каждой монете STARTING_AMOUNT;
+        # одновременному исполнению нужен ещё запас во всех монетах треугольников
+        client = SimulatedExchange.synthetic(
+            SIM_COINS, seed=SIM_SEED, latency=(SIM_LATENCY, 0.5), rate_limit=SIM_RATE_LIMIT,
+            throttle_probability=SIM_THROTTLE_PROBABILITY,
+            balances={coin: amount * 100 for coin, amount in STARTING_AMOUNT.items()},
+            inventory=SIM_INVENTORY if EXECUTION_MODE in ('concurrent', 'batch') else None)
+        logger.info(f"Симулятор биржи: {len(client.market_list)} рынков, каталог {MARKETS_PATH}")
+    else:
+        client = ccxt.bybit({
+            'apiKey': API_KEY,
+            'secret': API_SECRET,
+            # Частоту запросов ограничивает rate_limiter (те же веса, что у ccxt, плюс адаптация по заголовкам)
+            'enableRateLimit': False,
+            'options': {
+                'adjustForTimeDifference': True,  # Включение синхронизации времени
+        },
+        })
+    simulator = client if EXCHANGE_SIMULATOR else None
+
+    background_tasks = []
+    stats_task = scheduler = None
     try:
-        with open("markets.json") as json_file:
-            structured_pairs = json.load(json_file)
-
+        markets = await fetch_with_rate_limit(client, 'fetch_markets')
+        if markets:
+            MARKET_METADATA.update(markets)
+            if MARKET_RECORDER:
+                MARKET_RECORDER.record_metadata(MARKET_METADATA.markets)
+
+        if not os.path.exists(MARKETS_PATH):
+            await get_trianbular_pairs(client, markets)
+        catalog = TriangleCatalog.load(MARKETS_PATH)
+        if markets:
+            # Стартовый fetch_markets сразу сверяется с каталогом по сохранённым символам рынков,
+            # поэтому ни он, ни первый фоновый проход не ищут треугольники заново
+            sync_triangle_catalog(catalog, markets)
+
+        # Листинги/делистинги подхватываются в фоне, основной цикл не останавливается
+        background_tasks.append(asyncio.create_task(maintain_triangle_catalog(client, catalog)))
+        JOURNAL.start()
+        OPPORTUNITY_STORE.start()
+        if MARKET_RECORDER:
+            MARKET_RECORDER.start()
+
+        if EXCHANGE_SIMULATOR:
+            # Приватного потока у симулятора нет: ордера возвращаются исполненными, балансы сверяются по REST
+            await BALANCE_LEDGER.reconcile(client)
+            background_tasks.append(asyncio.create_task(BALANCE_LEDGER.run(client, BALANCE_RECONCILE_INTERVAL)))
+        elif API_KEY and API_SECRET:
+            # Книга балансов: один fetch_balance на старте, дальше поток wallet и фоновая сверка;
+            # из того же приватного потока приходят статусы ордеров для ORDER_TRACKER
+            await BALANCE_LEDGER.reconcile(client)
+            background_tasks.append(asyncio.create_task(BALANCE_LEDGER.run(client, BALANCE_RECONCILE_INTERVAL)))
+            private_stream = BybitPrivateStream(WebSocketTransport(BYBIT_PRIVATE_WS_URL), API_KEY, API_SECRET, {
+                "wallet": BALANCE_LEDGER.apply_wallet_event,
+                "order": ORDER_TRACKER.apply_order_event
+            })
+            background_tasks.append(asyncio.create_task(private_stream.run()))
+
+        if EXECUTION_MODE in ('concurrent', 'batch'):
+            # Инвентарь выравнивается вне торгового пути, пока сделки не идут
+            rebalancer = InventoryRebalancer(STARTING_AMOUNT, catalog, fetch_with_rate_limit, MARKET_METADATA,
+                                             hub=INVENTORY_HUB, is_busy=lambda: CAPITAL_ALLOCATOR.busy, ledger=BALANCE_LEDGER)
+            background_tasks.append(asyncio.create_task(rebalancer.run(client, PRICE_TABLE)))
+
+        if MARKET_DATA_MODE == 'ws' and not EXCHANGE_SIMULATOR:
+            stats_task = asyncio.create_task(log_stats_periodically())
+            await run_stream_mode(client, catalog)
+            return
+
+        state = {"pairs": None, "engine": None, "index": None, "hits": set()}
+        heat = VolatilityTracker(hot_interval=TRIANGLE_REVISIT_INTERVAL, cold_interval=TRIANGLE_COLD_INTERVAL,
+                                 hot_zscore=TRIANGLE_HOT_ZSCORE)
+
+        async def service_triangles(batch):
+            engine, index = state["engine"], state["index"]
+            # Котировки ног не менялись, а в прошлый раз прибыли не было - пропускаем
+            changed = {t for t in batch if index.is_stale(t)}
+            due = [t for t in batch if t in changed or t in state["hits"]]
+            if not due:
+                return
+            for t in due:
+                index.mark_evaluated(t)
+
+            # Весь пакет оценивается одним векторным проходом по одному снимку курсов
+            rates = engine.rates_vector()
+            best_rates = engine.best_rates(candidates=due, rates=rates).tolist()
+            profitable = []
+            for t, best_rate in zip(due, best_rates):
+                heat.observe(t, best_rate)
+                if best_rate > 0:
+                    # Прибыльный треугольник посещается и без смены котировок: меняется глубина
+                    state["hits"].add(t)
+                    profitable.append((best_rate, t))
+                else:
+                    state["hits"].discard(t)
+                    record_surface_miss(index.pairs[t])
+            if not profitable:
+                return
+
+            # Глубина лучших прибыльных - одним пакетным проходом
+            candidates = [t for _, t in sorted(profitable, reverse=True)[:DEPTH_BATCH_LIMIT]]
+            hits = engine.surface_dicts(candidates=candidates, rates=rates)
+            surface_dicts = [surface_dict for _, surface_dict in hits]
+            taker_fees = [MARKET_METADATA.taker_fees(surface_dict[f"contract_{i}"] for i in range(1, 4))
+                          for surface_dict in surface_dicts]
+            real_rate_arbs = await get_depth_from_orderbook_batch(client, surface_dicts, taker_fees)
+            # В хранилище попадают только оценки по новым котировкам - как и промахи
+            fresh = {index.pairs[t]['combined'] for t in candidates if t in changed}
+            await asyncio.gather(*[
+                process_surface_arb(client, t_pair, surface_dict, real_rate_arb, record=t_pair['combined'] in fresh)
+                for (t_pair, surface_dict), real_rate_arb in zip(hits, real_rate_arbs)
+            ])
+
+        # Воркеры обслуживают треугольники непрерывно, цикл ниже только обновляет котировки
+        # Интервал визита каждого треугольника зависит от его близости к прибыльности
+        scheduler = TriangleScheduler(service_triangles, TRIANGLE_WORKERS, TRIANGLE_REVISIT_INTERVAL,
+                                      interval_for=heat.interval, batch_size=TRIANGLE_BATCH_SIZE)
+        stats_task = asyncio.create_task(log_stats_periodically(scheduler=scheduler, heat=heat, simulator=simulator))
+        scheduler.start()
         while True:
-            tasks = []
-            for t_pair in structured_pairs:
-                tasks.append(asyncio.create_task(process_pair(client, t_pair)))
-                await asyncio.sleep(0.2)
-
-            await asyncio.gather(*tasks)
-            await asyncio.sleep(0.3)
+            # Каталог мог обновиться в фоне - пересобираем индексы движка и очередь воркеров
+            if state["pairs"] is not catalog.pairs:
+                state["pairs"] = catalog.pairs
+                state["engine"] = SurfaceRateEngine(catalog.pairs)
+                state["index"] = TriangleIndex(catalog.pairs)
+                state["hits"] = set()
+                heat.reset()
+                scheduler.reset(range(len(catalog.pairs)))
+
+            if await refresh_price_table(client, state["engine"].symbols):
+                state["engine"].update_tickers(PRICE_TABLE)
+                state["index"].update_tickers(PRICE_TABLE)
+
+                # Горячие треугольники с изменившимися котировками обслуживаются вне очереди,
+                # холодные ждут своего фонового круга
+                for t in state["index"].drain_dirty():
+                    if heat.is_hot(t):
+                        scheduler.kick(t)
+
+            await asyncio.sleep(PRICE_POLL_INTERVAL)
     except Exception as e:
         logger.error(f"Error main function: {str(e)}")
     finally:
+        for task in background_tasks + [stats_task]:
+            if task:
+                task.cancel()
+        if scheduler:
+            await scheduler.stop()
+        await JOURNAL.close()
+        await OPPORTUNITY_STORE.close()
+        if MARKET_RECORDER:
+            await MARKET_RECORDER.close()
         await client.close()  # Ensure the client is closed
 
-async def process_pair(client, t_pair):
+async def process_surface_arb(client, t_pair, surface_dict, real_rate_arb=None, record=True):
     """
-    Process a triangular arbitrage pair.
+    Process a surface rate opportunity of a triangular pair.
 
-    This function gets the prices for a triangular pair, calculates the surface rate,
-    gets the depth from the orderbook, and logs any arbitrage opportunities to a file.
+    This function gets the depth from the orderbook for the surface hit,
+    logs any arbitrage opportunities to a file and executes the orders.
 
     Parameters
     ----------
     client : ccxt.Exchange
         The exchange client to use.
     t_pair : dict
-        The triangular pair to process. This is a dictionary with the keys
-        'a_base', 'a_quote', 'b_base', 'b_quote', 'c_base', 'c_quote', 'pair_a', 'pair_b', and 'pair_c'.
+        The triangular pair of the opportunity.
+    surface_dict : dict
+        Result of `calc_triangular_arb_surface_rate` for the pair.
+    real_rate_arb : dict, optional
+        Depth result already computed by `get_depth_from_orderbook_batch`.
+    record : bool, optional
+        Whether to record the evaluation in the opportunity store; False for
+        revisits of a hit whose quotes have not changed since the last record.
 
     Raises
     ------
@@ -668,39 +997,39 @@ async def process_pair(client, t_pair):
         If there is an error processing the pair.
     """
     try:
-        # Объявляем глобальную переменную в начале функции, до любого её использования
-        global is_trading
-
-        prices_dict = await get_price_for_t_pair(client, t_pair)
-        surface_dict = calc_triangular_arb_surface_rate(t_pair, prices_dict)
-        
-        if surface_dict:
-            markets = await fetch_with_rate_limit(client, 'fetch_markets')
-            taker_fee = markets[0]['taker']
-            real_rate_arb = await get_depth_from_orderbook(client, surface_dict, taker_fee)
-
-            if real_rate_arb:
-                async with trading_lock:
-                    if is_trading:
-                        return  # Если уже идет торговля, не начинаем новую
-                    is_trading = True  # Устанавливаем флаг торговли
-
+        if real_rate_arb is None:
+            # Комиссия тейкера каждой ноги из кеша метаданных, без fetch_markets
+            taker_fees = MARKET_METADATA.taker_fees(surface_dict[f"contract_{i}"] for i in range(1, 4))
+            real_rate_arb = await get_depth_from_orderbook(client, surface_dict, taker_fees)
+        if record:
+            OPPORTUNITY_STORE.record(t_pair['combined'], surface_dict, real_rate_arb)
+
+        if real_rate_arb:
+            # Резервируем монеты сделки; связки на других монетах могут торговаться параллельно
+            if not BALANCE_LEDGER.seeded:
+                await BALANCE_LEDGER.reconcile(client)
+            amounts, exclusive = trade_requirements(real_rate_arb)
+            reservation = CAPITAL_ALLOCATOR.reserve(t_pair['combined'], amounts, exclusive)
+            if reservation is None:
+                return
+
+            try:
                 logger.info(f"Arbitrage opportunity found for {t_pair['combined']}")
-                with open('trading_logs.txt', 'a') as f:
-                    f.write(f"Arbitrage Opportunity: {real_rate_arb}\n")
+                JOURNAL.write("opportunity", t_pair['combined'], real_rate_arb)
 
                 # Исполняем ордера
-                result = await open_market_orders(client, real_rate_arb)
-
-                with open('trading_logs.txt', 'a') as f:
-                    f.write(f"Swapping result: {result}\n\n")
+                if EXECUTION_MODE in ('concurrent', 'batch'):
+                    result = await open_concurrent_orders(client, real_rate_arb, batch=EXECUTION_MODE == 'batch')
+                else:
+                    result = await open_market_orders(client, real_rate_arb)
 
-                # Сбрасываем флаг после завершения торговли
-                async with trading_lock:
-                    is_trading = False
+                JOURNAL.write("result", t_pair['combined'], result)
+            finally:
+                # Освобождаем капитал и при ошибке исполнения
+                CAPITAL_ALLOCATOR.release(reservation)
 
-            else:
-                logger.warning(f"Нет арбитражной возможности: {t_pair['combined']}")
+        else:
+            logger.warning(f"Нет арбитражной возможности: {t_pair['combined']}")
 
     except Exception as e:
         logger.error(f"Error processing pair {t_pair['combined']}: {str(e)}")
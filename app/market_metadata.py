@@ -0,0 +1,63 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TAKER_FEE = 0.001
+
+
+class MarketMetadata:
+    """
+    Метаданные рынков в памяти: комиссии, точность и лимиты по символу.
+
+    Загружается одним fetch_markets и обновляется по расписанию (вместе со сверкой
+    каталога), поэтому в горячем пути нет запросов к бирже - только чтение словаря.
+    """
+
+    def __init__(self):
+        self.markets = {}
+        self.loaded = False
+
+    def update(self, markets):
+        """
+        Обновляет метаданные из результата fetch_markets.
+        """
+        self.markets = {x['symbol']: {
+            "id": x.get('id'),
+            "base": x.get('base'),
+            "quote": x.get('quote'),
+            "active": x.get('active'),
+            "taker": x.get('taker'),
+            "maker": x.get('maker'),
+            "precision": x.get('precision') or {},
+            "limits": x.get('limits') or {}
+        } for x in markets}
+        self.loaded = True
+        logger.info(f"Метаданные рынков обновлены: {len(self.markets)} символов")
+
+    def market(self, symbol):
+        return self.markets.get(symbol, {})
+
+    def taker_fee(self, symbol, default=DEFAULT_TAKER_FEE):
+        fee = self.market(symbol).get('taker')
+        return default if fee is None else fee
+
+    def taker_fees(self, symbols, default=DEFAULT_TAKER_FEE):
+        return [self.taker_fee(symbol, default) for symbol in symbols]
+
+    def precision(self, symbol):
+        """
+        Точность цены и количества: {'amount': ..., 'price': ...}.
+        """
+        return self.market(symbol).get('precision', {})
+
+    def limits(self, symbol):
+        """
+        Лимиты рынка в формате ccxt: {'amount': {'min', 'max'}, 'cost': {'min', 'max'}, ...}.
+        """
+        return self.market(symbol).get('limits', {})
+
+    def min_amount(self, symbol):
+        return (self.limits(symbol).get('amount') or {}).get('min') or 0
+
+    def min_cost(self, symbol):
+        return (self.limits(symbol).get('cost') or {}).get('min') or 0
@@ -0,0 +1,193 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Период сброса записанных событий на диск (сек)
+FLUSH_INTERVAL = 1.0
+# Уровней стакана на сторону в записи (столько же читает проверка глубины)
+BOOK_DEPTH = 20
+METADATA_FILE = "metadata.json"
+
+
+class MarketRecorder:
+    """
+    Запись рыночных данных, которые видит бот, для последующего replay.
+
+    Пишутся две строки NDJSON:
+
+        ["q", ts, {symbol: [bid, ask], ...}]      - изменившиеся котировки
+        ["b", ts, symbol, bids, asks]              - стакан, прочитанный проверкой глубины
+
+    Котировки пишутся только изменившиеся с прошлой записи, стакан - только если
+    это новая версия (новый ответ кеша или новое update_id локальной книги).
+    Строки копятся в памяти и раз в flush_interval секунд дописываются в отдельном
+    потоке в gzip-файл текущего часа (market-YYYYmmdd-HH.ndjson.gz).
+
+    Parameters
+    ----------
+    root : str
+        Каталог записи.
+    flush_interval : float
+        Период сброса на диск (сек).
+    """
+
+    def __init__(self, root, flush_interval=FLUSH_INTERVAL):
+        self.root = root
+        self.flush_interval = flush_interval
+        self.lines = []
+        self.quotes = {}  # symbol -> (bid, ask), последние записанные
+        self.book_versions = {}  # symbol -> версия последнего записанного стакана
+        self.task = None
+        self.stats = {"quotes": 0, "books": 0, "bytes": 0, "errors": 0}
+
+    def add(self, event):
+        self.lines.append(json.dumps(event, separators=(',', ':')))
+
+    def record_quote(self, symbol, bid, ask, ts=None):
+        if self.quotes.get(symbol) == (bid, ask):
+            return
+        self.quotes[symbol] = (bid, ask)
+        self.add(["q", ts or time.time(), {symbol: [bid, ask]}])
+        self.stats["quotes"] += 1
+
+    def record_tickers(self, tickers, ts=None):
+        """
+        Записывает снимок fetch_tickers: только символы, у которых изменились bid/ask.
+        """
+        changed = {}
+        for symbol, ticker in tickers.items():
+            quote = (ticker.get('bid'), ticker.get('ask'))
+            if self.quotes.get(symbol) != quote:
+                self.quotes[symbol] = quote
+                changed[symbol] = list(quote)
+        if changed:
+            self.add(["q", ts or time.time(), changed])
+            self.stats["quotes"] += len(changed)
+
+    def record_book(self, symbol, order_book, version=None, ts=None):
+        """
+        Записывает стакан в формате fetch_order_book, если эта версия ещё не записана.
+
+        Parameters
+        ----------
+        version : hashable, optional
+            Версия стакана (например, update_id); по умолчанию - nonce, timestamp и сам объект ответа.
+        """
+        if version is None:
+            version = (order_book.get('nonce'), order_book.get('timestamp'), id(order_book))
+        if self.book_versions.get(symbol) == version:
+            return
+        self.book_versions[symbol] = version
+        self.add(["b", ts or time.time(), symbol,
+                  [level[:2] for level in order_book['bids'][:BOOK_DEPTH]],
+                  [level[:2] for level in order_book['asks'][:BOOK_DEPTH]]])
+        self.stats["books"] += 1
+
+    def record_local_book(self, book):
+        """
+        Записывает локальную книгу (LocalOrderBook), если она изменилась с прошлой записи.
+        """
+        version = (book.update_id, book.timestamp)
+        if self.book_versions.get(book.symbol) != version:
+            self.record_book(book.symbol, book.to_ccxt(BOOK_DEPTH), version)
+
+    def record_metadata(self, markets):
+        """
+        Сохраняет метаданные рынков (комиссии, лимиты) - replay берёт их оттуда.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, METADATA_FILE), 'w') as f:
+            json.dump(markets, f, default=str)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        lines, self.lines = self.lines, []
+        if lines:
+            await asyncio.to_thread(self.append, lines)
+
+    def append(self, lines):
+        """
+        Дописывает строки в файл текущего часа (выполняется в отдельном потоке).
+        """
+        path = os.path.join(self.root, f"market-{datetime.now(timezone.utc):%Y%m%d-%H}.ndjson.gz")
+        data = ("\n".join(lines) + "\n").encode()
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            # Каждый сброс - отдельный gzip-member; gzip.open читает их подряд
+            with gzip.open(path, 'ab') as f:
+                f.write(data)
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.error(f"Ошибка записи рыночных данных {path}: {str(e)}")
+            return
+        self.stats["bytes"] += len(data)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    def summary(self):
+        return (f"котировок {self.stats['quotes']}, стаканов {self.stats['books']}, "
+                f"{self.stats['bytes'] / 1e6:.1f} МБ до сжатия, ошибок {self.stats['errors']}")
+
+
+def read_events(root, since=None, until=None):
+    """
+    События записи в порядке времени.
+
+    Parameters
+    ----------
+    root : str
+        Каталог записи.
+    since, until : float, optional
+        Интервал времени, unix-секунды.
+
+    Yields
+    ------
+    list
+        ["q", ts, {symbol: [bid, ask]}] или ["b", ts, symbol, bids, asks].
+    """
+    for name in sorted(os.listdir(root)):
+        if not (name.startswith("market-") and name.endswith(".ndjson.gz")):
+            continue
+        try:
+            with gzip.open(os.path.join(root, name), 'rt') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка (бот остановлен во время записи)
+                        continue
+                    if since is not None and event[1] < since:
+                        continue
+                    if until is not None and event[1] > until:
+                        return
+                    yield event
+        except (EOFError, gzip.BadGzipFile) as e:
+            logger.warning(f"Файл {name} оборван: {str(e)}")
+
+
+def load_metadata(root):
+    path = os.path.join(root, METADATA_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
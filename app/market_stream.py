@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+import aiohttp
+
+from order_book import LocalOrderBook
+
+logger = logging.getLogger(__name__)
+
+# Публичный поток Bybit v5 для спота и приватный поток аккаунта
+BYBIT_SPOT_WS_URL = "wss://stream.bybit.com/v5/public/spot"
+BYBIT_PRIVATE_WS_URL = "wss://stream.bybit.com/v5/private"
+
+# Bybit принимает не более 10 топиков в одном запросе subscribe для спота
+SUBSCRIBE_CHUNK = 10
+PING_INTERVAL = 20
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 30
+
+
+class WebSocketTransport:
+    """
+    Транспорт WebSocket на aiohttp.
+
+    Поток котировок работает только через методы connect/send/receive/close,
+    поэтому вместо Bybit можно подставить локальный replay-сервер (другой url)
+    или любой объект с тем же интерфейсом.
+    """
+
+    def __init__(self, url=BYBIT_SPOT_WS_URL):
+        self.url = url
+        self.session = None
+        self.ws = None
+
+    async def connect(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        self.ws = await self.session.ws_connect(self.url, heartbeat=None)
+
+    async def send(self, message):
+        await self.ws.send_json(message)
+
+    async def receive(self):
+        """
+        Возвращает следующее JSON-сообщение; при закрытии соединения бросает ConnectionError.
+        """
+        while True:
+            msg = await self.ws.receive()
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                return json.loads(msg.data)
+            if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED,
+                            aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                raise ConnectionError(f"WebSocket закрыт: {msg.type}")
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+            self.ws = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class BybitQuoteStream:
+    """
+    Поток лучших bid/ask Bybit (канал orderbook.1) в таблицу котировок.
+
+    Parameters
+    ----------
+    transport : WebSocketTransport
+        Транспорт (реальный Bybit или replay-сервер).
+    symbol_ids : dict
+        Соответствие id рынка Bybit -> символ ccxt (например, 'BTCUSDT' -> 'BTC/USDT').
+    quote_table : dict
+        Таблица symbol -> {'bid', 'ask', 'timestamp'}; тот же формат, что у fetch_tickers.
+    on_quote : callable
+        Вызывается с символом после каждого изменения котировки.
+    """
+
+    topic = "orderbook.1"
+
+    def __init__(self, transport, symbol_ids, quote_table, on_quote=None):
+        self.transport = transport
+        self.symbol_ids = dict(symbol_ids)
+        self.quote_table = quote_table
+        self.on_quote = on_quote
+        self.subscribed = set()
+        self.connected = False
+
+    async def subscribe(self, market_ids):
+        """
+        Подписывается на новые id рынков (уже подписанные пропускаются).
+        """
+        new_ids = [x for x in market_ids if x not in self.subscribed]
+        self.subscribed.update(new_ids)
+        if not self.connected:
+            return
+        for i in range(0, len(new_ids), SUBSCRIBE_CHUNK):
+            args = [f"{self.topic}.{x}" for x in new_ids[i:i + SUBSCRIBE_CHUNK]]
+            await self.transport.send({"op": "subscribe", "args": args})
+
+    async def add_symbols(self, symbol_ids):
+        """
+        Добавляет символы (id -> symbol) в поток, например после обновления каталога.
+        """
+        self.symbol_ids.update(symbol_ids)
+        await self.subscribe(list(symbol_ids))
+
+    def handle_message(self, message):
+        """
+        Разбирает сообщение orderbook.1 и обновляет таблицу котировок.
+
+        Returns
+        -------
+        str or None
+            Символ, котировка которого изменилась.
+        """
+        topic = message.get("topic", "")
+        if not topic.startswith(f"{self.topic}."):
+            if message.get("success") is False:
+                logger.error(f"Ошибка подписки: {message}")
+            return None
+
+        data = message.get("data") or {}
+        symbol = self.symbol_ids.get(data.get("s"))
+        if symbol is None:
+            return None
+
+        quote = self.quote_table.setdefault(symbol, {"symbol": symbol, "bid": None, "ask": None})
+        bids, asks = data.get("b"), data.get("a")
+        # В orderbook.1 пустой список означает, что уровня нет
+        if bids is not None:
+            quote["bid"] = float(bids[0][0]) if bids else None
+        if asks is not None:
+            quote["ask"] = float(asks[0][0]) if asks else None
+        quote["timestamp"] = message.get("ts") or int(time.time() * 1000)
+        return symbol
+
+    async def on_connect(self):
+        """
+        Вызывается после подключения: восстанавливает подписки.
+        """
+        market_ids = list(self.subscribed or self.symbol_ids)
+        self.subscribed = set()
+        await self.subscribe(market_ids)
+
+    def on_disconnect(self):
+        """
+        Вызывается при обрыве соединения (данные, пришедшие до обрыва, могут устареть).
+        """
+
+    async def keepalive(self):
+        while True:
+            await asyncio.sleep(PING_INTERVAL)
+            await self.transport.send({"op": "ping"})
+
+    async def run(self):
+        """
+        Подключается, подписывается и обрабатывает сообщения; при обрыве переподключается.
+        """
+        delay = RECONNECT_DELAY
+        while True:
+            ping_task = None
+            try:
+                await self.transport.connect()
+                self.connected = True
+                await self.on_connect()
+                ping_task = asyncio.create_task(self.keepalive())
+                logger.info(f"WebSocket подключён, подписок: {len(self.subscribed)}")
+                delay = RECONNECT_DELAY
+
+                while True:
+                    message = await self.transport.receive()
+                    symbol = self.handle_message(message)
+                    if symbol is not None and self.on_quote is not None:
+                        self.on_quote(symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка WebSocket: {str(e)}. Переподключение через {delay} сек")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                self.connected = False
+                self.on_disconnect()
+                if ping_task:
+                    ping_task.cancel()
+                await self.transport.close()
+
+
+class BybitOrderBookStream(BybitQuoteStream):
+    """
+    Поток стакана Bybit (канал orderbook.50: snapshot + delta) в локальные книги LocalOrderBook.
+
+    Parameters
+    ----------
+    transport : WebSocketTransport
+        Транспорт (реальный Bybit или replay-сервер).
+    symbol_ids : dict
+        Соответствие id рынка Bybit -> символ ccxt.
+    books : dict
+        Таблица symbol -> LocalOrderBook; книги создаются по мере прихода снимков.
+    on_book : callable
+        Вызывается с символом после каждого обновления книги.
+    """
+
+    topic = "orderbook.50"
+
+    def __init__(self, transport, symbol_ids, books, on_book=None):
+        super().__init__(transport, symbol_ids, books, on_book)
+        self.books = books
+        # Символы, для которых запрошен новый снимок: их дельты до снимка отбрасываются
+        self.resyncing = set()
+        self.resync_tasks = set()
+
+    def handle_message(self, message):
+        topic = message.get("topic", "")
+        if not topic.startswith(f"{self.topic}."):
+            if message.get("success") is False:
+                logger.error(f"Ошибка подписки: {message}")
+            return None
+
+        data = message.get("data") or {}
+        symbol = self.symbol_ids.get(data.get("s"))
+        if symbol is None:
+            return None
+
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = LocalOrderBook(symbol)
+
+        timestamp = message.get("ts") or int(time.time() * 1000)
+        if message.get("type") == "snapshot":
+            book.apply_snapshot(data.get("b", []), data.get("a", []), data.get("u"), timestamp)
+            self.resyncing.discard(symbol)
+        elif symbol in self.resyncing:
+            # Снимок уже запрошен - дельты до него бесполезны
+            return None
+        elif not book.apply_delta(data.get("b", []), data.get("a", []), data.get("u"), timestamp):
+            # Пропущено обновление - книга невалидна до следующего снимка
+            logger.warning(f"Рассинхронизация стакана {symbol}, запрашиваем новый снимок")
+            self.resyncing.add(symbol)
+            task = asyncio.create_task(self.resync(data.get("s")))
+            self.resync_tasks.add(task)
+            task.add_done_callback(self.resync_tasks.discard)
+            return None
+        return symbol
+
+    async def resync(self, market_id):
+        """
+        Переподписка на топик рынка: Bybit отвечает свежим снимком.
+        """
+        if not self.connected:
+            return
+        await self.transport.send({"op": "unsubscribe", "args": [f"{self.topic}.{market_id}"]})
+        await self.transport.send({"op": "subscribe", "args": [f"{self.topic}.{market_id}"]})
+
+    def on_disconnect(self):
+        for book in self.books.values():
+            book.synced = False
+        # После переподключения подписки восстанавливаются, и снимки приходят заново
+        self.resyncing.clear()
+
+
+class BybitPrivateStream(BybitQuoteStream):
+    """
+    Приватный поток аккаунта Bybit (wallet и другие топики) с авторизацией по API ключу.
+
+    Parameters
+    ----------
+    transport : WebSocketTransport
+        Транспорт к BYBIT_PRIVATE_WS_URL.
+    api_key, api_secret : str
+        Ключи API.
+    handlers : dict
+        Топик -> функция handler(message), например {'wallet': ledger.apply_wallet_event}.
+    """
+
+    def __init__(self, transport, api_key, api_secret, handlers):
+        super().__init__(transport, {}, {})
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.handlers = dict(handlers)
+
+    def auth_message(self):
+        expires = int((time.time() + 10) * 1000)
+        signature = hmac.new(self.api_secret.encode(), f"GET/realtime{expires}".encode(), hashlib.sha256).hexdigest()
+        return {"op": "auth", "args": [self.api_key, expires, signature]}
+
+    async def on_connect(self):
+        await self.transport.send(self.auth_message())
+        await self.transport.send({"op": "subscribe", "args": list(self.handlers)})
+
+    def handle_message(self, message):
+        topic = message.get("topic")
+        handler = self.handlers.get(topic)
+        if handler is None:
+            if message.get("success") is False:
+                logger.error(f"Ошибка приватного потока: {message}")
+            return None
+        handler(message)
+        return None
@@ -0,0 +1,167 @@
+"""
+Отчёты по хранилищу возможностей (OpportunityStore).
+
+Примеры:
+
+    python opportunity_report.py lifetime --since 2026-10-01
+    python opportunity_report.py hourly --metric surface
+    python opportunity_report.py top --limit 30
+
+lifetime - распределение времени жизни возможностей по треугольникам: подряд
+идущие прибыльные оценки одного треугольника и направления с разрывом не больше
+--gap секунд считаются одной возможностью.
+hourly - доля прибыльных оценок по часам суток (UTC).
+top - треугольники с наибольшим числом прибыльных оценок.
+
+Неприбыльные оценки хранятся выборкой, поэтому число оценок считается по колонке weight.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+
+from opportunity_store import DIRECTIONS, load_columns, read_triangles
+
+# Максимальный разрыв между оценками одной возможности (сек)
+LIFETIME_GAP = 5.0
+
+
+def parse_time(value):
+    """
+    Дата/время ISO (UTC, если зона не указана) -> unix-секунды.
+    """
+    if value is None:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def profitable(data, metric):
+    """
+    Маска прибыльных оценок: по поверхностному курсу или по глубине.
+    """
+    if metric == "surface":
+        return data["surface_rate"] > 0
+    # nan (глубины не хватило) сравнивается как False
+    return data["real_rate_perc"] > 0
+
+
+def opportunity_lifetimes(ts, triangle, direction, gap=LIFETIME_GAP):
+    """
+    Разбивает прибыльные оценки на возможности.
+
+    Parameters
+    ----------
+    ts, triangle, direction : np.ndarray
+        Колонки прибыльных оценок.
+    gap : float
+        Разрыв (сек), после которого начинается новая возможность.
+
+    Returns
+    -------
+    tuple
+        (triangles, lifetimes) - треугольник и время жизни (сек) каждой возможности.
+    """
+    if not len(ts):
+        return np.empty(0, dtype=np.int32), np.empty(0)
+    key = triangle.astype(np.int64) * len(DIRECTIONS) + direction
+    order = np.lexsort((ts, key))
+    ts, key = ts[order], key[order]
+
+    starts = np.ones(len(ts), dtype=bool)
+    starts[1:] = (key[1:] != key[:-1]) | (np.diff(ts) > gap)
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:], len(ts)) - 1
+    return (key[first] // len(DIRECTIONS)).astype(np.int32), ts[last] - ts[first]
+
+
+def lifetime_report(data, names, metric, gap, limit):
+    hits = profitable(data, metric)
+    triangles, lifetimes = opportunity_lifetimes(data["ts"][hits], data["triangle"][hits], data["direction"][hits], gap)
+    if not len(lifetimes):
+        print("Возможностей нет")
+        return
+
+    print(f"Возможностей: {len(lifetimes)}, время жизни (сек): медиана {np.median(lifetimes):.2f}, "
+          f"p90 {np.percentile(lifetimes, 90):.2f}, максимум {lifetimes.max():.2f}")
+    print(f"{'треугольник':<40} {'возм.':>7} {'медиана':>9} {'p90':>9} {'макс':>9} {'сумма':>10}")
+
+    order = np.argsort(triangles, kind='stable')
+    triangles, lifetimes = triangles[order], lifetimes[order]
+    ids, first = np.unique(triangles, return_index=True)
+    rows = []
+    for triangle, group in zip(ids, np.split(lifetimes, first[1:])):
+        rows.append((group.sum(), triangle, group))
+    rows.sort(key=lambda x: -x[0])
+    for total, triangle, group in rows[:limit]:
+        print(f"{names[triangle]:<40} {len(group):>7} {np.median(group):>9.2f} "
+              f"{np.percentile(group, 90):>9.2f} {group.max():>9.2f} {total:>10.1f}")
+
+
+def hourly_report(data, metric):
+    hits = profitable(data, metric)
+    hours = (data["ts"] // 3600 % 24).astype(np.int64)
+    evaluations = np.bincount(hours, weights=data["weight"], minlength=24)
+    hit_counts = np.bincount(hours[hits], weights=data["weight"][hits], minlength=24)
+    print(f"{'час UTC':>7} {'оценок':>10} {'прибыльных':>11} {'доля, %':>8}")
+    for hour in range(24):
+        rate = hit_counts[hour] / evaluations[hour] * 100 if evaluations[hour] else 0
+        print(f"{hour:>7} {evaluations[hour]:>10.0f} {hit_counts[hour]:>11.0f} {rate:>8.2f}")
+
+
+def top_report(data, names, metric, limit):
+    hits = profitable(data, metric)
+    evaluations = np.bincount(data["triangle"], weights=data["weight"], minlength=len(names))
+    hit_counts = np.bincount(data["triangle"][hits], weights=data["weight"][hits], minlength=len(names))
+    rates = np.where(hits, data["real_rate_perc"] if metric == "depth" else data["surface_rate"], np.nan)
+    print(f"{'треугольник':<40} {'оценок':>8} {'прибыльных':>11} {'доля, %':>8} {'ср. %':>8}")
+    for triangle in np.argsort(-hit_counts, kind='stable')[:limit]:
+        if not hit_counts[triangle]:
+            break
+        mean_rate = np.nanmean(rates[data["triangle"] == triangle])
+        print(f"{names[triangle]:<40} {evaluations[triangle]:>8.0f} {hit_counts[triangle]:>11.0f} "
+              f"{hit_counts[triangle] / evaluations[triangle] * 100:>8.2f} {mean_rate:>8.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Отчёты по хранилищу возможностей")
+    parser.add_argument("report", choices=("lifetime", "hourly", "top"))
+    parser.add_argument("--store", default=os.getenv('OPPORTUNITY_STORE_PATH', 'opportunities'),
+                        help="каталог хранилища")
+    parser.add_argument("--since", help="начало интервала, ISO (UTC)")
+    parser.add_argument("--until", help="конец интервала, ISO (UTC)")
+    parser.add_argument("--metric", choices=("depth", "surface"), default="depth",
+                        help="прибыльность по глубине или по поверхностному курсу")
+    parser.add_argument("--gap", type=float, default=LIFETIME_GAP,
+                        help="разрыв (сек), после которого возможность считается закрытой")
+    parser.add_argument("--limit", type=int, default=20, help="строк в таблице треугольников")
+    args = parser.parse_args(argv)
+
+    columns = ["ts", "weight", "surface_rate" if args.metric == "surface" else "real_rate_perc"]
+    if args.report != "hourly":
+        columns.append("triangle")
+    if args.report == "lifetime":
+        columns.append("direction")
+    data = load_columns(args.store, columns, parse_time(args.since), parse_time(args.until))
+    if not len(data["ts"]):
+        print(f"Нет данных в {args.store}")
+        return 1
+
+    print(f"Оценок: {data['weight'].sum()}, с {datetime.fromtimestamp(data['ts'].min(), timezone.utc):%Y-%m-%d %H:%M} "
+          f"по {datetime.fromtimestamp(data['ts'].max(), timezone.utc):%Y-%m-%d %H:%M} UTC")
+    names = read_triangles(args.store)
+    if args.report == "lifetime":
+        lifetime_report(data, names, args.metric, args.gap, args.limit)
+    elif args.report == "hourly":
+        hourly_report(data, args.metric)
+    else:
+        top_report(data, names, args.metric, args.limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
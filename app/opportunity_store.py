@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Строк в сегменте и максимальный возраст несброшенных строк (сек)
+SEGMENT_ROWS = 50000
+FLUSH_INTERVAL = 60.0
+# Как часто фоновая задача проверяет, пора ли сбросить сегмент (сек)
+CHECK_INTERVAL = 1.0
+# Из неприбыльных оценок пишется каждая SAMPLE_EVERY-я (с весом SAMPLE_EVERY)
+SAMPLE_EVERY = 100
+
+# Колонки хранилища и их типы; triangle - номер строки в triangles.txt
+COLUMNS = {
+    "ts": np.float64,               # время оценки, unix-секунды
+    "triangle": np.int32,
+    "direction": np.int8,           # 0 - forward, 1 - reverse
+    "surface_rate": np.float64,     # profit_loss_perc поверхностного курса, %
+    "real_rate_perc": np.float64,   # доходность по глубине, %; nan - глубины не хватило
+    "starting_amount": np.float64,
+    "trade_amount": np.float64,     # размер входа по глубине; nan - не рассчитывался
+    "profit_loss": np.float64,      # прибыль по глубине; nan - глубины не хватило
+    "weight": np.int32,             # сколько оценок представляет строка (неприбыльные пишутся выборочно)
+}
+DIRECTIONS = ("forward", "reverse")
+TRIANGLES_FILE = "triangles.txt"
+
+
+class OpportunityStore:
+    """
+    Колоночное хранилище оценок треугольников, только дописываемое.
+
+    record добавляет строку в буферы колонок в памяти; фоновая задача сбрасывает их
+    в новый сегмент - каталог с одним .npy на колонку - когда набралось segment_rows
+    строк или прошло flush_interval секунд. Запись на диск выполняется в отдельном
+    потоке, сегмент появляется атомарно (переименованием готового каталога).
+    Имя треугольника кодируется номером строки в triangles.txt. Читается
+    хранилище функцией load_columns через np.load(mmap_mode='r').
+
+    Прибыльные по поверхностному курсу оценки пишутся все, неприбыльные - каждая
+    sample_every-я с весом sample_every, чтобы доля прибыльных оценок в отчётах
+    считалась от всех оценок, а не только от прибыльных.
+
+    Parameters
+    ----------
+    root : str
+        Каталог хранилища.
+    segment_rows : int
+        Сбросить сегмент, когда в буфере столько строк.
+    flush_interval : float
+        Сбросить непустой буфер не реже чем раз в столько секунд.
+    sample_every : int
+        Шаг выборки неприбыльных оценок.
+    """
+
+    def __init__(self, root, segment_rows=SEGMENT_ROWS, flush_interval=FLUSH_INTERVAL, sample_every=SAMPLE_EVERY):
+        self.root = root
+        self.segment_rows = segment_rows
+        self.flush_interval = flush_interval
+        self.sample_every = sample_every
+        self.misses = 0
+        self.triangles = {name: n for n, name in enumerate(read_triangles(root))}
+        self.saved_triangles = len(self.triangles)
+        self.buffer = {column: [] for column in COLUMNS}
+        self.first_ts = None
+        self.task = None
+        self.stats = {"rows": 0, "segments": 0, "errors": 0}
+
+    def triangle_id(self, name):
+        triangle = self.triangles.get(name)
+        if triangle is None:
+            triangle = self.triangles[name] = len(self.triangles)
+        return triangle
+
+    def record(self, name, surface_dict, real_rate_arb=None, weight=1):
+        """
+        Добавляет оценку треугольника: поверхностный курс и результат проверки глубины.
+
+        Parameters
+        ----------
+        name : str
+            Треугольник (t_pair['combined']).
+        surface_dict : dict
+            Результат calc_triangular_arb_surface_rate.
+        real_rate_arb : dict, optional
+            Результат проверки глубины; пустой, если глубины не хватило.
+        weight : int
+            Сколько оценок представляет строка.
+        """
+        real_rate_arb = real_rate_arb or {}
+        now = time.time()
+        if self.first_ts is None:
+            self.first_ts = now
+        row = {
+            "ts": now,
+            "triangle": self.triangle_id(name),
+            "direction": DIRECTIONS.index(surface_dict.get("direction", "forward")),
+            "surface_rate": surface_dict.get("profit_loss_perc", np.nan),
+            "real_rate_perc": real_rate_arb.get("real_rate_perc", np.nan),
+            "starting_amount": surface_dict.get("starting_amount", np.nan),
+            "trade_amount": real_rate_arb.get("trade_amount", np.nan),
+            "profit_loss": real_rate_arb.get("profit_loss", np.nan),
+            "weight": weight,
+        }
+        for column, value in row.items():
+            self.buffer[column].append(value)
+
+    def sample_miss(self):
+        """
+        Учитывает неприбыльную оценку; True - её нужно записать через record_miss.
+        """
+        self.misses += 1
+        return self.misses % self.sample_every == 0
+
+    def record_miss(self, name, direction, surface_rate):
+        """
+        Записывает выбранную sample_miss неприбыльную оценку с весом sample_every.
+
+        Parameters
+        ----------
+        name : str
+            Треугольник (t_pair['combined']).
+        direction : str
+            Лучшее направление ("forward" или "reverse").
+        surface_rate : float
+            Его поверхностная доходность, %.
+        """
+        self.record(name, {"direction": direction, "profit_loss_perc": surface_rate}, weight=self.sample_every)
+
+    def __len__(self):
+        return len(self.buffer["ts"])
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            if len(self) >= self.segment_rows or \
+                    (len(self) and time.time() - self.first_ts >= self.flush_interval):
+                await self.flush()
+
+    async def flush(self):
+        if not len(self):
+            return
+        # Буферы подменяются до перехода в поток: новые строки копятся уже в следующем сегменте
+        columns, self.buffer = self.buffer, {column: [] for column in COLUMNS}
+        self.first_ts = None
+        names = sorted(self.triangles, key=self.triangles.get)[self.saved_triangles:]
+        if await asyncio.to_thread(self.write_segment, columns, names):
+            self.saved_triangles += len(names)
+
+    def write_segment(self, columns, names):
+        """
+        Пишет сегмент и новые имена треугольников (выполняется в отдельном потоке).
+
+        Returns
+        -------
+        bool
+            True, если имена дописаны в triangles.txt; иначе они будут записаны
+            при следующем сбросе (строки сегмента при ошибке теряются).
+        """
+        rows = len(columns["ts"])
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            # Имена дописываются раньше сегмента: сегмент не ссылается на неизвестный номер
+            if names:
+                with open(os.path.join(self.root, TRIANGLES_FILE), 'a', encoding='utf-8') as f:
+                    f.write("".join(name + "\n" for name in names))
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.error(f"Ошибка записи имён треугольников {self.root}: {str(e)}")
+            return False
+
+        try:
+            ts = np.asarray(columns["ts"], dtype=COLUMNS["ts"])
+            name = f"{int(ts.min() * 1000)}-{int(ts.max() * 1000)}"
+            tmp = os.path.join(self.root, f".{name}.tmp")
+            os.makedirs(tmp, exist_ok=True)
+            for column, dtype in COLUMNS.items():
+                np.save(os.path.join(tmp, f"{column}.npy"), np.asarray(columns[column], dtype=dtype))
+            os.replace(tmp, unique_path(os.path.join(self.root, name)))
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.error(f"Ошибка записи сегмента {self.root}: {str(e)}")
+            return True
+        self.stats["rows"] += rows
+        self.stats["segments"] += 1
+        return True
+
+    async def close(self):
+        """
+        Останавливает фоновую задачу и сбрасывает оставшиеся строки.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    def summary(self):
+        return (f"записано строк {self.stats['rows']}, сегментов {self.stats['segments']}, "
+                f"в буфере {len(self)}, ошибок {self.stats['errors']}")
+
+
+def unique_path(path):
+    candidate, n = path, 1
+    while os.path.exists(candidate):
+        candidate = f"{path}.{n}"
+        n += 1
+    return candidate
+
+
+def read_triangles(root):
+    """
+    Имена треугольников хранилища; индекс в списке - значение колонки triangle.
+    """
+    path = os.path.join(root, TRIANGLES_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def list_segments(root, since=None, until=None):
+    """
+    Сегменты хранилища, пересекающиеся с интервалом [since, until] (unix-секунды).
+
+    Границы сегмента берутся из его имени, поэтому лишние сегменты не открываются.
+    """
+    if not os.path.isdir(root):
+        return []
+    segments = []
+    for name in sorted(os.listdir(root)):
+        if name.startswith('.') or not os.path.isdir(os.path.join(root, name)):
+            continue
+        try:
+            first, last = (int(x) / 1000 for x in name.split('.')[0].split('-'))
+        except ValueError:
+            continue
+        if (since is not None and last < since) or (until is not None and first > until):
+            continue
+        segments.append(os.path.join(root, name))
+    return segments
+
+
+def load_columns(root, columns=None, since=None, until=None):
+    """
+    Загружает колонки всех подходящих сегментов.
+
+    Parameters
+    ----------
+    root : str
+        Каталог хранилища.
+    columns : list, optional
+        Нужные колонки (по умолчанию все); остальные не читаются.
+    since, until : float, optional
+        Интервал времени, unix-секунды.
+
+    Returns
+    -------
+    dict
+        column -> np.ndarray, строки всех сегментов подряд.
+    """
+    columns = list(columns or COLUMNS)
+    needed = columns if "ts" in columns or (since is None and until is None) else columns + ["ts"]
+    parts = {column: [] for column in needed}
+    for segment in list_segments(root, since, until):
+        for column in needed:
+            path = os.path.join(segment, f"{column}.npy")
+            if column == "weight" and not os.path.exists(path):
+                # Сегмент записан до выборки неприбыльных оценок: каждая строка - одна оценка
+                rows = len(np.load(os.path.join(segment, "ts.npy"), mmap_mode='r'))
+                parts[column].append(np.ones(rows, dtype=COLUMNS[column]))
+                continue
+            parts[column].append(np.load(path, mmap_mode='r'))
+
+    data = {column: np.concatenate(arrays) if arrays else np.empty(0, dtype=COLUMNS[column])
+            for column, arrays in parts.items()}
+    if since is not None or until is not None:
+        mask = np.ones(len(data["ts"]), dtype=bool)
+        if since is not None:
+            mask &= data["ts"] >= since
+        if until is not None:
+            mask &= data["ts"] <= until
+        data = {column: values[mask] for column, values in data.items()}
+    return {column: data[column] for column in columns}
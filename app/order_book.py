@@ -0,0 +1,143 @@
+import numpy as np
+
+
+class BookSide:
+    """
+    Одна сторона стакана в отсортированных массивах цен и объёмов.
+
+    Цены хранятся как ключи key = sign * price в порядке возрастания
+    (sign = 1 для asks, -1 для bids), поэтому лучший уровень всегда первый,
+    а поиск уровня - np.searchsorted.
+    """
+
+    def __init__(self, sign):
+        self.sign = sign
+        self.keys = np.empty(0)
+        self.qty = np.empty(0)
+
+    @property
+    def prices(self):
+        return self.keys * self.sign
+
+    def replace(self, levels):
+        """
+        Полностью заменяет сторону уровнями [[price, qty], ...] (строки или числа).
+        """
+        if not len(levels):
+            self.keys, self.qty = np.empty(0), np.empty(0)
+            return
+        data = np.asarray(levels, dtype=float)[:, :2]
+        data = data[data[:, 1] > 0]
+        keys = data[:, 0] * self.sign
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.qty = keys[order], data[order, 1]
+
+    def update(self, levels):
+        """
+        Применяет изменения уровней: новый объём заменяет старый, объём 0 удаляет уровень.
+        """
+        keys, qty = self.keys, self.qty
+        for price, amount in levels:
+            key = float(price) * self.sign
+            amount = float(amount)
+            i = np.searchsorted(keys, key)
+            exists = i < len(keys) and keys[i] == key
+            if amount == 0:
+                if exists:
+                    keys, qty = np.delete(keys, i), np.delete(qty, i)
+            elif exists:
+                qty[i] = amount
+            else:
+                keys, qty = np.insert(keys, i, key), np.insert(qty, i, amount)
+        self.keys, self.qty = keys, qty
+
+
+class LocalOrderBook:
+    """
+    Локальная L2-копия стакана, поддерживаемая снимками и дельтами потока.
+
+    Parameters
+    ----------
+    symbol : str
+        Символ ccxt.
+    depth : int
+        Сколько уровней хранить на каждой стороне.
+    """
+
+    def __init__(self, symbol, depth=50):
+        self.symbol = symbol
+        self.depth = depth
+        self.bids = BookSide(-1)
+        self.asks = BookSide(1)
+        self.update_id = None
+        self.timestamp = None
+        self.synced = False
+
+    def apply_snapshot(self, bids, asks, update_id=None, timestamp=None):
+        self.bids.replace(bids)
+        self.asks.replace(asks)
+        self.update_id = update_id
+        self.timestamp = timestamp
+        self.synced = True
+
+    def apply_delta(self, bids, asks, update_id=None, timestamp=None):
+        """
+        Применяет дельту.
+
+        Returns
+        -------
+        bool
+            False, если книга не синхронизирована или пропущено обновление
+            (update_id идёт не подряд) - нужен новый снимок.
+        """
+        if not self.synced:
+            return False
+        if update_id is not None and self.update_id is not None:
+            if update_id <= self.update_id:
+                return True  # старое или повторное сообщение
+            if update_id != self.update_id + 1:
+                self.synced = False
+                return False
+
+        self.bids.update(bids)
+        self.asks.update(asks)
+        self.trim()
+        self.update_id = update_id
+        self.timestamp = timestamp
+        return True
+
+    def trim(self):
+        for side in (self.bids, self.asks):
+            if len(side.keys) > self.depth:
+                side.keys, side.qty = side.keys[:self.depth], side.qty[:self.depth]
+
+    def to_ccxt(self, limit=None):
+        """
+        Стакан в формате fetch_order_book: {'bids': [[price, qty], ...], 'asks': [...]}.
+        """
+        return {
+            "symbol": self.symbol,
+            "bids": np.column_stack((self.bids.prices, self.bids.qty))[:limit].tolist(),
+            "asks": np.column_stack((self.asks.prices, self.asks.qty))[:limit].tolist(),
+            "timestamp": self.timestamp,
+            "nonce": self.update_id
+        }
+
+    def reformatted(self, c_direction, limit=None):
+        """
+        Колонки (adj_price, adj_quantity) как у reformated_orderbook, без промежуточных списков.
+
+        base_to_quote идёт по asks: (1 / ask, qty * ask); quote_to_base - по bids: (bid, qty).
+
+        Returns
+        -------
+        tuple
+            (adj_prices, adj_quantities) - массивы numpy.
+        """
+        if c_direction == "base_to_quote":
+            prices, qty = self.asks.prices[:limit], self.asks.qty[:limit]
+            with np.errstate(divide='ignore'):
+                adj_prices = np.where(prices != 0, 1 / prices, 0)
+            return adj_prices, qty * prices
+        prices, qty = self.bids.prices[:limit], self.bids.qty[:limit]
+        return prices, qty
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать исполнения ордера (сек) и как часто проверять его по REST, если событий нет
+ORDER_FILL_TIMEOUT = 5.0
+ORDER_POLL_INTERVAL = 0.25
+# Сколько последних состояний ордеров хранить (события могут прийти раньше ответа create_order)
+MAX_TRACKED_ORDERS = 1000
+
+# orderStatus Bybit v5 -> status ccxt
+BYBIT_ORDER_STATUSES = {
+    "Created": "open",
+    "New": "open",
+    "PartiallyFilled": "open",
+    "Untriggered": "open",
+    "Filled": "closed",
+    "Cancelled": "canceled",
+    "PartiallyFilledCanceled": "canceled",
+    "Deactivated": "canceled",
+    "Rejected": "rejected",
+}
+
+FINAL_STATUSES = ("closed", "canceled", "rejected", "expired")
+
+
+def is_final(order):
+    return bool(order) and order.get('status') in FINAL_STATUSES
+
+
+class OrderTracker:
+    """
+    Ожидание фактического исполнения ордеров.
+
+    Состояния ордеров приходят событиями приватного потока Bybit (топик order,
+    apply_order_event); если события нет, ордер проверяется через fetch_order
+    каждые poll_interval секунд. wait_filled возвращает управление сразу после
+    финального статуса, а не через фиксированную паузу.
+
+    Parameters
+    ----------
+    fetcher : callable
+        Асинхронная функция вида fetch_with_rate_limit(client, method, *args, **kwargs).
+    timeout : float
+        Максимальное ожидание исполнения (сек).
+    poll_interval : float
+        Период проверки по REST (сек).
+    """
+
+    def __init__(self, fetcher, timeout=ORDER_FILL_TIMEOUT, poll_interval=ORDER_POLL_INTERVAL):
+        self.fetcher = fetcher
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.orders = OrderedDict()  # id -> последнее известное состояние
+        self.waiters = {}  # id -> asyncio.Future
+        self.stats = {"events": 0, "polls": 0, "timeouts": 0}
+
+    def update(self, order_id, state):
+        """
+        Сохраняет состояние ордера и будит ожидающего, если статус финальный.
+        """
+        known = self.orders.pop(order_id, {})
+        known.update({k: v for k, v in state.items() if v is not None})
+        self.orders[order_id] = known
+        while len(self.orders) > MAX_TRACKED_ORDERS:
+            self.orders.popitem(last=False)
+
+        waiter = self.waiters.get(order_id)
+        if waiter is not None and not waiter.done() and is_final(known):
+            waiter.set_result(known)
+
+    def apply_order_event(self, message):
+        """
+        Применяет сообщение топика order приватного потока Bybit v5.
+        """
+        for data in message.get("data") or []:
+            order_id = data.get("orderId")
+            if not order_id:
+                continue
+            fee = None
+            if data.get("cumExecFee") and data.get("feeCurrency"):
+                fee = {"cost": float(data["cumExecFee"]), "currency": data["feeCurrency"]}
+            average = float(data["avgPrice"]) if data.get("avgPrice") else None
+            self.update(order_id, {
+                "id": order_id,
+                "status": BYBIT_ORDER_STATUSES.get(data.get("orderStatus"), "open"),
+                "filled": float(data.get("cumExecQty") or 0),
+                "cost": float(data.get("cumExecValue") or 0),
+                "average": average,
+                "fee": fee,
+                "lastUpdateTimestamp": int(data["updatedTime"]) if data.get("updatedTime") else None,
+            })
+            self.stats["events"] += 1
+
+    async def wait_filled(self, client, order, timeout=None):
+        """
+        Ждёт финального статуса ордера.
+
+        Parameters
+        ----------
+        client : ccxt.Exchange
+            The exchange client to use.
+        order : dict
+            Ответ create_order (нужны id и symbol).
+
+        Returns
+        -------
+        dict
+            Ордер ccxt, дополненный последним известным состоянием (status, filled, cost, ...).
+            Если за timeout статус не стал финальным, возвращается последнее состояние.
+        """
+        if not order or not order.get('id'):
+            return order
+        order_id = order['id']
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        self.update(order_id, order)
+        if is_final(self.orders[order_id]):
+            return dict(self.orders[order_id])
+
+        waiter = self.waiters[order_id] = asyncio.get_running_loop().create_future()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    logger.warning(f"Ордер {order_id} не исполнен за {timeout} сек: {self.orders[order_id].get('status')}")
+                    return dict(self.orders[order_id])
+                try:
+                    return dict(await asyncio.wait_for(asyncio.shield(waiter), min(self.poll_interval, remaining)))
+                except asyncio.TimeoutError:
+                    pass
+
+                # События нет - проверяем ордер по REST
+                self.stats["polls"] += 1
+                fetched = await self.fetcher(client, 'fetch_order', order_id, order.get('symbol'), {'acknowledged': True})
+                if fetched:
+                    self.update(order_id, fetched)
+                if waiter.done():
+                    return dict(waiter.result())
+        finally:
+            self.waiters.pop(order_id, None)
+
+    def summary(self):
+        return f"событий {self.stats['events']}, проверок по REST {self.stats['polls']}, таймаутов {self.stats['timeouts']}"
@@ -0,0 +1,343 @@
+import asyncio
+import time
+
+# Полосы в порядке приоритета: меньшее число обслуживается первым
+LANES = {"orders": 0, "depth": 1, "balances": 2, "tickers": 3}
+
+# Метод ccxt -> полоса
+METHOD_LANES = {
+    "create_order": "orders",
+    "create_orders": "orders",
+    "cancel_order": "orders",
+    "fetch_order": "orders",
+    "fetch_open_orders": "orders",
+    "fetch_order_book": "depth",
+    "fetch_balance": "balances",
+    "fetch_tickers": "tickers",
+    "fetch_ticker": "tickers",
+    "fetch_markets": "tickers",
+}
+
+# Вес запроса в единицах бюджета (как cost в описании API Bybit в ccxt:
+# 1 единица = 20 мс при rateLimit=20, т.е. 50 единиц в секунду)
+METHOD_WEIGHTS = {
+    "create_order": 2.5,
+    "create_orders": 5,
+    "cancel_order": 2.5,
+    "fetch_order": 5,
+    "fetch_open_orders": 5,
+    "fetch_order_book": 5,
+    "fetch_balance": 1,
+    "fetch_tickers": 5,
+    "fetch_ticker": 5,
+    # fetch_markets загружает инструменты spot, linear, inverse и option
+    "fetch_markets": 20,
+}
+
+# Адаптация по заголовкам лимита: доля оставшейся квоты метода, ниже которой метод
+# ставится на паузу до сброса окна, ниже которой он притормаживается,
+# и выше которой общий бюджет можно наращивать
+LOW_QUOTA_SHARE = 0.1
+HIGH_QUOTA_SHARE = 0.5
+BACKOFF_FACTOR = 0.5
+SPEEDUP_FACTOR = 1.05
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 10.0
+# Окно лимита по умолчанию (сек): общий бюджет меняется не чаще раза за окно
+RATE_WINDOW = 1.0
+
+
+class PriorityRateLimiter:
+    """
+    Весовой token bucket с приоритетными полосами и резервом под исполнение.
+
+    Каждый запрос списывает из общего бюджета свой вес. Ожидающие запросы
+    обслуживаются строго по приоритету полосы (orders > depth > balances > tickers),
+    внутри полосы - по очереди поступления. Последние reserve единиц бюджета
+    доступны только полосе orders, поэтому опрос котировок и стаканов не может
+    выбрать бюджет до нуля и задержать create_order.
+
+    Скорость подстраивается по заголовкам лимитов биржи (observe_headers). Квота
+    у Bybit своя для каждого эндпоинта, поэтому она влияет только на сам метод,
+    а не на всю его полосу (fetch_order не задерживает create_order):
+    почти исчерпанная квота ставит метод на паузу до сброса окна, убывающая -
+    растягивает остаток квоты на время до сброса. Общий бюджет снижается только
+    по ошибке лимита (backoff) и растёт к max_rate при свободной квоте, причём
+    меняется не чаще раза за окно лимита.
+
+    Parameters
+    ----------
+    rate : float
+        Начальный бюджет, единиц в секунду (он же максимальный всплеск).
+    reserve : float
+        Часть бюджета, которую могут тратить только ордера.
+    weights : dict, optional
+        Веса методов (по умолчанию METHOD_WEIGHTS).
+    default_weight : float
+        Вес неизвестного метода.
+    min_rate, max_rate : float, optional
+        Границы адаптации бюджета (по умолчанию rate / 4 и rate).
+    """
+
+    def __init__(self, rate=50, reserve=10, weights=None, default_weight=1, min_rate=None, max_rate=None):
+        self.rate = rate
+        self.base_rate = rate
+        self.capacity = rate
+        self.reserve = min(reserve, rate)
+        self.min_rate = min_rate if min_rate is not None else rate / 4
+        self.max_rate = max_rate if max_rate is not None else rate
+        self.weights = dict(METHOD_WEIGHTS if weights is None else weights)
+        self.default_weight = default_weight
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.waiters = []  # [priority, seq, weight, method, future]
+        self.seq = 0
+        self.paused_until = {}  # method -> время конца паузы
+        self.quotas = {}  # method -> доля оставшейся квоты по последнему ответу
+        # До этого времени общий бюджет не растёт (после любого изменения) и не снижается (после снижения)
+        self.rate_frozen_until = 0.0
+        self.backoff_frozen_until = 0.0
+        self.wakeup = None
+        self.dispatcher = None
+        self.stats = {lane: {"requests": 0, "queued": 0, "wait": 0.0, "throttled": 0} for lane in LANES}
+
+    def lane_for(self, method):
+        return METHOD_LANES.get(method, "tickers")
+
+    def weight_for(self, method):
+        return self.weights.get(method, self.default_weight)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _cost(self, priority, weight):
+        """
+        Сколько бюджета нужно иметь, чтобы пропустить запрос, и сколько он спишет.
+        """
+        floor = 0 if priority == LANES["orders"] else min(self.reserve, self.capacity / 2)
+        # Вес больше доступного окна иначе никогда бы не прошёл
+        weight = min(weight, self.capacity - floor)
+        return floor + weight, weight
+
+    def _try_take(self, priority, weight):
+        self._refill()
+        needed, weight = self._cost(priority, weight)
+        if self.tokens >= needed:
+            self.tokens -= weight
+            return True
+        return False
+
+    def _is_paused(self, method):
+        return self.paused_until.get(method, 0.0) > time.monotonic()
+
+    def _next_waiter(self):
+        """
+        Самый приоритетный ожидающий из методов, которые не стоят на паузе.
+        """
+        self.waiters = [x for x in self.waiters if not x[4].done()]
+        ready = [x for x in self.waiters if not self._is_paused(x[3])]
+        return min(ready, key=lambda x: (x[0], x[1])) if ready else None
+
+    async def acquire(self, method):
+        """
+        Ждёт бюджет для вызова method согласно его полосе и весу.
+        """
+        lane = self.lane_for(method)
+        priority = LANES[lane]
+        weight = self.weight_for(method)
+        self.stats[lane]["requests"] += 1
+
+        # Без очереди, только если никто с более высоким (или тем же) приоритетом не ждёт
+        if not self._is_paused(method) and not any(x[0] <= priority and not x[4].done() for x in self.waiters) \
+                and self._try_take(priority, weight):
+            return
+
+        self.stats[lane]["queued"] += 1
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        self.waiters.append([priority, self.seq, weight, method, future])
+        self._wake()
+        try:
+            await future
+        finally:
+            self.stats[lane]["wait"] += time.monotonic() - started
+
+    def limit(self, method):
+        """
+        Асинхронный контекстный менеджер: async with limiter.limit('create_order'): ...
+        """
+        return _Acquire(self, method)
+
+    def _wake(self):
+        if self.dispatcher is None or self.dispatcher.done():
+            self.wakeup = asyncio.Event()
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            self.wakeup.set()
+
+    async def _dispatch(self):
+        """
+        Раздаёт бюджет ожидающим по приоритету; засыпает до пополнения бюджета,
+        конца паузы метода или прихода нового (возможно, более приоритетного) запроса.
+        """
+        while self.waiters:
+            waiter = self._next_waiter()
+            if waiter is None:
+                if not self.waiters:
+                    break
+                # Все ожидающие на паузе - ждём ближайшего сброса окна
+                delay = min(self.paused_until.get(x[3], 0.0) for x in self.waiters) - time.monotonic()
+            else:
+                priority, _, weight, _, future = waiter
+                if self._try_take(priority, weight):
+                    self.waiters.remove(waiter)
+                    future.set_result(None)
+                    continue
+                needed, _ = self._cost(priority, weight)
+                delay = (needed - self.tokens) / self.rate
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(delay, 0.001))
+            except asyncio.TimeoutError:
+                pass
+
+    def set_rate(self, rate):
+        """
+        Меняет бюджет в пределах [min_rate, max_rate]; накопленные токены не превышают новый бюджет.
+        """
+        self._refill()
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.capacity = self.rate
+        self.tokens = min(self.tokens, self.capacity)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def change_rate(self, factor, window=RATE_WINDOW, ceiling=None):
+        """
+        Умножает бюджет на factor, если в текущем окне лимита он ещё не менялся;
+        снижение после роста в том же окне допускается.
+
+        Returns
+        -------
+        bool
+            True, если бюджет изменён.
+        """
+        now = time.monotonic()
+        if now < (self.backoff_frozen_until if factor < 1 else self.rate_frozen_until):
+            return False
+        rate = self.rate * factor
+        self.set_rate(min(rate, ceiling) if ceiling is not None else rate)
+        self.rate_frozen_until = now + max(window, RATE_WINDOW)
+        if factor < 1:
+            self.backoff_frozen_until = self.rate_frozen_until
+        return True
+
+    def pause(self, method, seconds, throttled=True):
+        """
+        Останавливает метод на seconds секунд (например, до сброса окна лимита);
+        остальные методы его полосы продолжают обслуживаться.
+        throttled=False - короткая пауза, растягивающая квоту (не считается в статистике пауз).
+        """
+        self.paused_until[method] = max(self.paused_until.get(method, 0.0), time.monotonic() + seconds)
+        if throttled:
+            self.stats[self.lane_for(method)]["throttled"] += 1
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def observe_headers(self, method, headers):
+        """
+        Подстраивает бюджет по заголовкам лимита Bybit после ответа на запрос.
+
+        X-Bapi-Limit - размер окна, X-Bapi-Limit-Status - сколько запросов осталось,
+        X-Bapi-Limit-Reset-Timestamp - время сброса окна (мс). Квота относится только
+        к этому эндпоинту, поэтому тормозится только сам метод. Публичные эндпоинты
+        этих заголовков не отдают - тогда сниженный бюджет лишь возвращается к начальному.
+
+        Returns
+        -------
+        float or None
+            Доля оставшейся квоты, если заголовки есть.
+        """
+        headers = {str(k).lower(): v for k, v in (headers or {}).items()}
+        try:
+            limit = float(headers["x-bapi-limit"])
+            remaining = float(headers["x-bapi-limit-status"])
+        except (KeyError, TypeError, ValueError):
+            limit = 0
+        if limit <= 0:
+            # Квота неизвестна, но запрос прошёл: после снижения возвращаемся к начальному бюджету
+            if self.rate < self.base_rate:
+                self.change_rate(SPEEDUP_FACTOR, ceiling=self.base_rate)
+            return None
+
+        remaining_share = remaining / limit
+        self.quotas[method] = remaining_share
+        delay = reset_delay(headers)
+        if remaining_share <= LOW_QUOTA_SHARE:
+            # Квота почти исчерпана: ждём сброса окна, не дожидаясь 429 / 10006
+            self.pause(method, delay)
+        elif remaining_share < HIGH_QUOTA_SHARE:
+            # Остаток квоты делится поровну на время до сброса окна
+            self.pause(method, delay / max(remaining, 1), throttled=False)
+        else:
+            self.change_rate(SPEEDUP_FACTOR, window=delay)
+        return remaining_share
+
+    def backoff(self, method, seconds=None, headers=None):
+        """
+        Реакция на ошибку лимита (HTTP 429 / retCode 10006): пауза метода и снижение бюджета.
+
+        Returns
+        -------
+        float
+            Длительность паузы в секундах.
+        """
+        if seconds is None:
+            seconds = reset_delay({str(k).lower(): v for k, v in (headers or {}).items()})
+        self.pause(method, seconds)
+        # Несколько отказов одного всплеска снижают бюджет один раз
+        self.change_rate(BACKOFF_FACTOR, window=seconds)
+        return seconds
+
+    def summary(self):
+        """
+        Строка статистики для лога: бюджет и по полосам - запросы, ожидавшие в очереди,
+        среднее ожидание и число пауз по лимиту.
+        """
+        parts = [f"бюджет {self.rate:.1f}/с"]
+        low = [f"{method} {share:.0%}" for method, share in sorted(self.quotas.items()) if share < HIGH_QUOTA_SHARE]
+        if low:
+            parts.append(f"квота на исходе: {', '.join(low)}")
+        for lane, stats in self.stats.items():
+            average = stats["wait"] / stats["queued"] if stats["queued"] else 0
+            parts.append(f"{lane}: {stats['requests']} запр., в очереди {stats['queued']}, "
+                         f"ср. ожидание {average * 1000:.0f} мс, пауз {stats['throttled']}")
+        return "; ".join(parts)
+
+
+def reset_delay(headers, default=DEFAULT_BACKOFF):
+    """
+    Секунды до сброса окна по X-Bapi-Limit-Reset-Timestamp (ключи в нижнем регистре).
+    """
+    try:
+        reset_at = float(headers["x-bapi-limit-reset-timestamp"]) / 1000
+    except (KeyError, TypeError, ValueError):
+        return default
+    return min(max(reset_at - time.time(), 0), MAX_BACKOFF)
+
+
+class _Acquire:
+
+    def __init__(self, limiter, method):
+        self.limiter = limiter
+        self.method = method
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.method)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
@@ -0,0 +1,283 @@
+"""
+Replay записанных рыночных данных (MarketRecorder) через логику бота быстрее реального времени.
+
+Примеры:
+
+    python replay.py market_data
+    python replay.py market_data --speed 10 --latency 0.05 --execution concurrent
+
+Котировки и стаканы из записи подаются в calc_triangular_arb_surface_rate и
+get_depth_from_orderbook_batch из main.py - тот же код, что работает вживую.
+Найденные по глубине возможности исполняются моделью: каждая нога проходит по
+стакану, актуальному через --latency секунд после решения (для последовательного
+исполнения - через latency, 2 * latency и 3 * latency), поэтому в реализованном P&L
+учтено проскальзывание за время исполнения.
+
+Ограничение: стаканы записываются только тогда, когда их читала проверка глубины
+при живой работе, поэтому для треугольников, которые вживую до проверки глубины
+не доходили, глубина в replay может быть неизвестна или устаревшей.
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import logging
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import main as bot
+from depth_kernel import build_curves, walk_books
+from inventory import trade_legs
+from market_recorder import load_metadata, read_events
+from opportunity_report import parse_time
+from order_book import LocalOrderBook
+from triangle_index import TriangleIndex
+from triangles import TriangleCatalog
+
+
+class FillModel:
+    """
+    Модель исполнения найденных возможностей по стаканам replay.
+
+    Parameters
+    ----------
+    books : dict
+        symbol -> LocalOrderBook, текущее состояние стаканов replay.
+    latency : float
+        Время от решения до исполнения ноги (сек).
+    sequential : bool
+        Ноги исполняются по очереди (каждая через latency после предыдущей),
+        иначе все три - через latency после решения.
+    """
+
+    def __init__(self, books, latency, sequential=True):
+        self.books = books
+        self.latency = latency
+        self.sequential = sequential
+        self.queue = []  # (время, seq, сделка)
+        self.seq = itertools.count()
+        self.in_flight = set()
+        self.trades = []
+
+    def submit(self, ts, key, result):
+        """
+        Ставит возможность на исполнение; по треугольнику одновременно идёт одна сделка.
+        """
+        if key in self.in_flight:
+            return False
+        self.in_flight.add(key)
+        legs = trade_legs(result)
+        amount = result.get("trade_amount") or bot.STARTING_AMOUNT.get(legs[0]["coin_in"], 100)
+        trade = {"key": key, "legs": legs, "coin": legs[0]["coin_in"], "start": amount, "amount": amount,
+                 "leg": 1, "decided": ts, "expected": result["profit_loss"], "partial": False}
+        heapq.heappush(self.queue, (ts + self.latency, next(self.seq), trade))
+        return True
+
+    def run_until(self, ts):
+        """
+        Исполняет ноги, время которых наступило к моменту ts.
+        """
+        while self.queue and self.queue[0][0] <= ts:
+            due, _, trade = heapq.heappop(self.queue)
+            legs = [trade["leg"]] if self.sequential else range(trade["leg"], 4)
+            for leg in legs:
+                self.execute_leg(trade, leg)
+            if self.sequential and trade["leg"] < 3:
+                trade["leg"] += 1
+                heapq.heappush(self.queue, (due + self.latency, next(self.seq), trade))
+            else:
+                self.finish(trade, due)
+
+    def execute_leg(self, trade, leg):
+        """
+        Исполняет leg-ю по порядку ногу сделки (trade_legs) по текущему стакану.
+        """
+        contract, direction = trade["legs"][leg - 1]["contract"], trade["legs"][leg - 1]["direction"]
+        book = self.books.get(contract)
+        if book is None or trade["amount"] <= 0:
+            trade["amount"] = 0.0
+            trade["partial"] = True
+            return
+        acquired, filled = walk_books(build_curves([book.reformatted(direction, 20)]), 0, trade["amount"],
+                                      bot.MARKET_METADATA.taker_fee(contract))
+        if filled < trade["amount"]:
+            trade["partial"] = True
+        trade["amount"] = float(acquired)
+
+    def finish(self, trade, ts):
+        self.in_flight.discard(trade["key"])
+        trade["realized"] = trade["amount"] - trade["start"]
+        trade["filled_at"] = ts
+        self.trades.append(trade)
+
+
+async def replay(events, pairs, speed=0.0, latency=0.05, sequential=True):
+    """
+    Прогоняет события записи через оценку треугольников, проверку глубины и модель исполнения.
+
+    Parameters
+    ----------
+    events : iterable
+        События read_events.
+    pairs : list
+        Треугольники каталога.
+    speed : float
+        Во сколько раз быстрее реального времени; 0 - без пауз.
+    latency : float
+        Задержка исполнения ноги (сек).
+    sequential : bool
+        Последовательное исполнение ног (иначе одновременное).
+
+    Returns
+    -------
+    dict
+        Счётчики, задержки обработки событий и сделки модели.
+    """
+    index = TriangleIndex(pairs)
+    price_table = {}
+    books = {}
+    fills = FillModel(books, latency, sequential)
+    stats = defaultdict(int)
+    surface_hits = {}  # t -> surface_dict треугольников, прибыльных по поверхностному курсу
+    processing = []  # время обработки события (сек)
+    lagging = 0
+    first_ts = last_ts = None
+    wall_start = time.perf_counter()
+
+    async def check_depth(ts, triangles):
+        candidates = [t for t in triangles
+                      if all(surface_hits[t][f"contract_{i}"] in books for i in range(1, 4))]
+        stats["no_books"] += len(triangles) - len(candidates)
+        if not candidates:
+            return
+        surface_arbs = [surface_hits[t] for t in candidates]
+        taker_fees = [bot.MARKET_METADATA.taker_fees(s[f"contract_{i}"] for i in range(1, 4)) for s in surface_arbs]
+        results = await bot.get_depth_from_orderbook_batch(None, surface_arbs, taker_fees, books)
+        for t, result in zip(candidates, results):
+            stats["depth_checks"] += 1
+            if result:
+                stats["depth_hits"] += 1
+                fills.submit(ts, index.pairs[t]['combined'], result)
+
+    for event in events:
+        kind, ts = event[0], event[1]
+        if first_ts is None:
+            first_ts = ts
+        if speed > 0:
+            delay = (ts - first_ts) / speed - (time.perf_counter() - wall_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # Обработка прошлого события не уложилась в паузу до этого - вживую бот бы отстал
+        if last_ts is not None and ts > last_ts and processing[-1] > ts - last_ts:
+            lagging += 1
+        last_ts = ts
+        fills.run_until(ts)
+
+        started = time.perf_counter()
+        stats["events"] += 1
+        if kind == "b":
+            _, _, symbol, bids, asks = event
+            book = books.get(symbol)
+            if book is None:
+                book = books[symbol] = LocalOrderBook(symbol, depth=max(len(bids), len(asks), 1))
+            book.apply_snapshot(bids, asks)
+            stats["books"] += 1
+            # Как и вживую, прибыльные треугольники перепроверяются по глубине при смене стакана
+            await check_depth(ts, [t for t in index.triangles_for(symbol) if t in surface_hits])
+            processing.append(time.perf_counter() - started)
+            continue
+
+        touched = set()
+        for symbol, (bid, ask) in event[2].items():
+            price_table[symbol] = {"bid": bid, "ask": ask}
+            if index.update_quote(symbol, bid, ask):
+                touched.update(index.triangles_for(symbol))
+        stats["quotes"] += len(event[2])
+
+        hits = []
+        for t in touched:
+            if not index.is_stale(t):
+                continue
+            index.mark_evaluated(t)
+            t_pair = index.pairs[t]
+            stats["evaluations"] += 1
+            surface_dict = bot.calc_triangular_arb_surface_rate(t_pair, bot.get_price_for_t_pair(t_pair, price_table))
+            if surface_dict:
+                stats["surface_hits"] += 1
+                surface_hits[t] = surface_dict
+                hits.append(t)
+            else:
+                surface_hits.pop(t, None)
+        await check_depth(ts, hits)
+        processing.append(time.perf_counter() - started)
+
+    if last_ts is not None:
+        fills.run_until(float('inf'))
+    return {
+        "stats": dict(stats),
+        "processing": np.asarray(processing),
+        "lagging": lagging,
+        "duration": (last_ts - first_ts) if first_ts is not None else 0.0,
+        "wall": time.perf_counter() - wall_start,
+        "trades": fills.trades
+    }
+
+
+def print_report(report):
+    stats = report["stats"]
+    print(f"Событий: {stats.get('events', 0)} (котировок {stats.get('quotes', 0)}, стаканов {stats.get('books', 0)}), "
+          f"данных {report['duration']:.1f} сек, прогон {report['wall']:.1f} сек "
+          f"(x{report['duration'] / report['wall'] if report['wall'] else 0:.1f})")
+    processing = report["processing"] * 1e6
+    if len(processing):
+        print(f"Обработка события, мкс: медиана {np.median(processing):.0f}, p99 {np.percentile(processing, 99):.0f}, "
+              f"максимум {processing.max():.0f}; не уложились до следующего события: {report['lagging']}")
+    print(f"Оценок {stats.get('evaluations', 0)}, прибыльных по поверхностному курсу {stats.get('surface_hits', 0)}; "
+          f"проверок глубины {stats.get('depth_checks', 0)} (без стаканов {stats.get('no_books', 0)}), "
+          f"прибыльных по глубине {stats.get('depth_hits', 0)}")
+
+    trades = report["trades"]
+    print(f"Сделок модели: {len(trades)}, частичных {sum(t['partial'] for t in trades)}")
+    by_coin = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    for trade in trades:
+        row = by_coin[trade["coin"]]
+        row[0] += 1
+        row[1] += trade["expected"]
+        row[2] += trade["realized"]
+        row[3] += trade["realized"] > 0
+    for coin, (count, expected, realized, wins) in sorted(by_coin.items()):
+        print(f"  {coin}: сделок {count}, ожидалось {expected:.8f}, получено {realized:.8f}, прибыльных {wins}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay записанных рыночных данных")
+    parser.add_argument("record", help="каталог записи (MARKET_RECORD_PATH)")
+    parser.add_argument("--catalog", default="markets.json", help="каталог треугольников")
+    parser.add_argument("--since", help="начало интервала, ISO (UTC)")
+    parser.add_argument("--until", help="конец интервала, ISO (UTC)")
+    parser.add_argument("--speed", type=float, default=0.0, help="ускорение относительно реального времени; 0 - без пауз")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка исполнения ноги (сек)")
+    parser.add_argument("--execution", choices=("sequential", "concurrent", "batch"), default=bot.EXECUTION_MODE,
+                        help="модель исполнения ног")
+    args = parser.parse_args(argv)
+
+    # Логи поиска возможностей replay не нужны - только итоговый отчёт; replay ничего не записывает
+    logging.getLogger().setLevel(logging.WARNING)
+    bot.MARKET_RECORDER = None
+    metadata = load_metadata(args.record)
+    if metadata:
+        bot.MARKET_METADATA.markets = metadata
+        bot.MARKET_METADATA.loaded = True
+
+    pairs = TriangleCatalog.load(args.catalog).pairs
+    events = read_events(args.record, parse_time(args.since), parse_time(args.until))
+    report = asyncio.run(replay(events, pairs, args.speed, args.latency, args.execution == "sequential"))
+    print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
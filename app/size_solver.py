@@ -0,0 +1,112 @@
+import numpy as np
+
+
+def conversion_curve(book, taker_fee=0.0):
+    """
+    Кусочно-линейная кривая конвертации по стакану.
+
+    Parameters
+    ----------
+    book : tuple or list
+        (adj_prices, adj_quantities) или уровни [[adj_price, adj_quantity], ...],
+        как после reformated_orderbook.
+    taker_fee : float
+        Комиссия тейкера ноги.
+
+    Returns
+    -------
+    tuple
+        (cum_in, cum_out) - узлы кривой: вход в монете ноги -> выход с учётом комиссии.
+    """
+    if isinstance(book, tuple):
+        prices, qty = np.asarray(book[0], dtype=float), np.asarray(book[1], dtype=float)
+    else:
+        levels = np.asarray(book, dtype=float).reshape(-1, 2)
+        prices, qty = levels[:, 0], levels[:, 1]
+    mask = (qty > 0) & (prices > 0)
+    prices, qty = prices[mask], qty[mask]
+
+    cum_in = np.concatenate(([0.0], np.cumsum(qty)))
+    cum_out = np.concatenate(([0.0], np.cumsum(qty * prices))) * (1 - taker_fee)
+    return cum_in, cum_out
+
+
+def solve_trade_size(books, taker_fees=0.0, max_amount=np.inf, min_inputs=(0, 0, 0)):
+    """
+    Размер входа, максимизирующий прибыль треугольника по трём стаканам.
+
+    Выход треугольника f(x) - композиция трёх вогнутых кусочно-линейных кривых,
+    поэтому прибыль f(x) - x вогнута и достигает максимума в одной из точек излома
+    (границы уровней любой из ног, пересчитанные во вход первой ноги) или на
+    границе допустимого отрезка. Решатель оценивает прибыль во всех таких точках.
+
+    Parameters
+    ----------
+    books : list
+        Три стакана ног в формате conversion_curve.
+    taker_fees : float or list
+        Комиссия: общая или по ногам.
+    max_amount : float
+        Верхняя граница входа (доступный баланс стартовой монеты).
+    min_inputs : sequence
+        Минимальный вход каждой ноги в её входной монете (min notional / min amount).
+
+    Returns
+    -------
+    dict or None
+        amount, acquired, profit_loss, real_rate_perc - оптимум; capacity - сколько
+        вообще пропускают стаканы; amounts и profits - точки излома кривой прибыли.
+        None, если ни один размер не удовлетворяет ограничениям.
+    """
+    fees = taker_fees if isinstance(taker_fees, (list, tuple)) else [taker_fees] * 3
+    curves = [conversion_curve(book, fee) for book, fee in zip(books, fees)]
+    (in_1, out_1), (in_2, out_2), (in_3, out_3) = curves
+    if len(in_1) < 2 or len(in_2) < 2 or len(in_3) < 2:
+        return None
+
+    def to_start(amount, leg):
+        """Пересчитывает вход ноги leg (1 или 2) во вход первой ноги через обратные кривые."""
+        if leg == 2:
+            amount = np.interp(amount, out_2, in_2)
+        return np.interp(amount, out_1, in_1)
+
+    def forward(x):
+        y = np.interp(x, in_1, out_1)
+        z = np.interp(y, in_2, out_2)
+        return np.interp(z, in_3, out_3)
+
+    # Сколько стартовой монеты можно провести через все три стакана целиком
+    # (np.interp обрезает значения за концами кривых, поэтому лишний объём упирается в предыдущую ногу)
+    capacity = min(in_1[-1], to_start(in_2[-1], 1), to_start(in_3[-1], 2))
+
+    lower = max(min_inputs[0], to_start(min_inputs[1], 1), to_start(min_inputs[2], 2))
+    upper = min(max_amount, capacity)
+    if upper <= 0 or lower > upper:
+        return None
+
+    breakpoints = np.concatenate((
+        in_1,
+        to_start(in_2[in_2 <= out_1[-1]], 1),
+        to_start(in_3[in_3 <= out_2[-1]], 2),
+        [lower, upper]
+    ))
+    amounts = np.unique(np.clip(breakpoints, lower, upper))
+    amounts = amounts[amounts > 0]
+    if not len(amounts):
+        return None
+
+    acquired = forward(amounts)
+    profits = acquired - amounts
+    best = int(np.argmax(profits))
+    amount = float(amounts[best])
+    profit_loss = float(profits[best])
+
+    return {
+        "amount": amount,
+        "acquired": float(acquired[best]),
+        "profit_loss": profit_loss,
+        "real_rate_perc": profit_loss / amount * 100,
+        "capacity": float(capacity),
+        "amounts": amounts.tolist(),
+        "profits": profits.tolist()
+    }
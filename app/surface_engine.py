@@ -0,0 +1,160 @@
+import numpy as np
+
+from surface_rate import PAIR_KEYS, build_surface_dict, get_route_plan
+
+
+class SurfaceRateEngine:
+    """
+    Пакетный расчёт поверхностного курса для всего каталога треугольников.
+
+    Котировки хранятся в непрерывных массивах bid/ask, индексированных по символу,
+    а ноги треугольников - в целочисленных массивах индексов в векторе курсов
+    (1 / ask_0, bid_0, 1 / ask_1, bid_1, ...). Прямое и обратное направления всех
+    треугольников считаются одним векторным проходом.
+
+    Parameters
+    ----------
+    pairs : list
+        Треугольники из markets.json (с route_plan или без).
+    """
+
+    def __init__(self, pairs):
+        self.pairs = list(pairs)
+        self.symbols = []
+        self.symbol_index = {}
+        for t_pair in self.pairs:
+            for key in PAIR_KEYS:
+                symbol = t_pair[key]
+                if symbol not in self.symbol_index:
+                    self.symbol_index[symbol] = len(self.symbols)
+                    self.symbols.append(symbol)
+
+        self.bid = np.full(len(self.symbols), np.nan)
+        self.ask = np.full(len(self.symbols), np.nan)
+
+        # (T, 3) индексы в векторе курсов для forward и reverse
+        self.forward_idx = np.zeros((len(self.pairs), 3), dtype=np.intp)
+        self.reverse_idx = np.zeros((len(self.pairs), 3), dtype=np.intp)
+        # (T, 3) индексы символов pair_a, pair_b, pair_c - для сборки surface_dict
+        self.leg_symbols = np.zeros((len(self.pairs), 3), dtype=np.intp)
+
+        for t, t_pair in enumerate(self.pairs):
+            legs = [self.symbol_index[t_pair[key]] for key in PAIR_KEYS]
+            self.leg_symbols[t] = legs
+            forward, reverse = get_route_plan(t_pair)
+            # code = 2 * leg + side -> 2 * symbol + side
+            self.forward_idx[t] = [2 * legs[code // 2] + code % 2 for code in forward]
+            self.reverse_idx[t] = [2 * legs[code // 2] + code % 2 for code in reverse]
+
+    def set_quote(self, symbol, bid, ask):
+        """
+        Обновляет котировку одного символа. Неизвестные символы игнорируются.
+        """
+        i = self.symbol_index.get(symbol)
+        if i is None:
+            return
+        self.bid[i] = bid if bid else np.nan
+        self.ask[i] = ask if ask else np.nan
+
+    def update_tickers(self, tickers):
+        """
+        Загружает снимок fetch_tickers ({symbol: {'bid': ..., 'ask': ...}}).
+        """
+        for symbol, ticker in tickers.items():
+            self.set_quote(symbol, ticker.get('bid'), ticker.get('ask'))
+
+    def rates_vector(self):
+        """
+        Вектор курсов (1 / ask_0, bid_0, 1 / ask_1, bid_1, ...); пустые котировки - NaN.
+        """
+        rates = np.empty(2 * len(self.symbols))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates[0::2] = np.where(self.ask > 0, 1 / self.ask, np.nan)
+        rates[1::2] = np.where(self.bid > 0, self.bid, np.nan)
+        return rates
+
+    def surface_rates(self, candidates=None, rates=None):
+        """
+        Итоговые курсы цикла (acquired_coin_t3 при старте с 1) для треугольников.
+
+        Parameters
+        ----------
+        candidates : array-like, optional
+            Индексы треугольников для оценки (по умолчанию - весь каталог).
+        rates : np.ndarray, optional
+            Снимок rates_vector; передаётся, чтобы несколько вызовов считали по одним котировкам.
+
+        Returns
+        -------
+        tuple
+            (forward, reverse) - массивы по candidates; треугольники без котировок - NaN.
+        """
+        forward_idx, reverse_idx, leg_symbols = self.forward_idx, self.reverse_idx, self.leg_symbols
+        if candidates is not None:
+            forward_idx, reverse_idx, leg_symbols = forward_idx[candidates], reverse_idx[candidates], leg_symbols[candidates]
+
+        if rates is None:
+            rates = self.rates_vector()
+        forward = rates[forward_idx].prod(axis=1)
+        reverse = rates[reverse_idx].prod(axis=1)
+
+        # Как и в calc_surface_rate, треугольник без любой из шести котировок не оценивается
+        quoted = ~(np.isnan(rates[0::2]) | np.isnan(rates[1::2]))
+        missing = ~quoted[leg_symbols].all(axis=1)
+        forward[missing] = np.nan
+        reverse[missing] = np.nan
+        return forward, reverse
+
+    def best_rates(self, candidates=None, rates=None):
+        """
+        Прибыль лучшего из двух направлений в процентах (NaN - треугольник без котировок).
+        """
+        forward, reverse = self.surface_rates(candidates, rates)
+        return (np.fmax(forward, reverse) - 1) * 100
+
+    def evaluate(self, min_surface_rate=0, candidates=None, rates=None):
+        """
+        Находит треугольники, у которых прибыль в процентах выше min_surface_rate.
+
+        Как и calc_triangular_arb_surface_rate, forward имеет приоритет:
+        reverse возвращается только если forward не прошёл порог.
+        Если задан candidates, оцениваются только эти треугольники.
+
+        Returns
+        -------
+        tuple
+            (indices, directions) - индексы треугольников и направления (0 - forward, 1 - reverse).
+        """
+        forward, reverse = self.surface_rates(candidates, rates)
+        threshold = 1 + min_surface_rate / 100
+        # NaN при сравнении даёт False, поэтому треугольники без котировок отсеиваются
+        forward_hit = forward > threshold
+        reverse_hit = ~forward_hit & (reverse > threshold)
+        hits = np.flatnonzero(forward_hit | reverse_hit)
+        directions = reverse_hit[hits].astype(np.intp)
+        indices = hits if candidates is None else np.asarray(candidates, dtype=np.intp)[hits]
+        return indices, directions
+
+    def surface_dicts(self, min_surface_rate=0, candidates=None, rates=None):
+        """
+        Собирает surface_dict (формат calc_triangular_arb_surface_rate) только для найденных треугольников.
+
+        Returns
+        -------
+        list
+            Список пар (t_pair, surface_dict).
+        """
+        if rates is None:
+            rates = self.rates_vector()
+        indices, directions = self.evaluate(min_surface_rate, candidates, rates)
+        if not len(indices):
+            return []
+
+        results = []
+        for t, direction_index in zip(indices.tolist(), directions.tolist()):
+            legs = self.leg_symbols[t]
+            # Локальный вектор (1 / a_ask, a_bid, 1 / b_ask, b_bid, 1 / c_ask, c_bid)
+            local_rates = rates[np.repeat(2 * legs, 2) + np.tile([0, 1], 3)].tolist()
+            t_pair = self.pairs[t]
+            results.append((t_pair, build_surface_dict(t_pair, direction_index, local_rates)))
+        return results
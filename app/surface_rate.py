@@ -0,0 +1,193 @@
+"""
+Скомпилированные маршруты треугольников для расчёта поверхностного курса.
+
+Ориентация ног треугольника не меняется от тика к тику, поэтому сценарии
+calc_triangular_arb_surface_rate разбираются один раз при загрузке каталога.
+Маршрут (route_plan) хранит для каждого направления три кода ног:
+
+    code = 2 * leg + side
+
+где leg - индекс пары (0 - pair_a, 1 - pair_b, 2 - pair_c), а side:
+    0 - base_to_quote, курс 1 / ask
+    1 - quote_to_base, курс bid
+
+Код совпадает с индексом в векторе курсов
+(1 / a_ask, a_bid, 1 / b_ask, b_bid, 1 / c_ask, c_bid).
+"""
+
+DIRECTIONS = ("forward", "reverse")
+TRADE_DIRECTIONS = ("base_to_quote", "quote_to_base")
+PAIR_KEYS = ("pair_a", "pair_b", "pair_c")
+LEG_PREFIXES = ("a", "b", "c")
+
+
+def compile_route_plan(t_pair):
+    """
+    Компилирует маршрут треугольника для обоих направлений.
+
+    Правила выбора ног повторяют сценарии calc_triangular_arb_surface_rate:
+    вторая нога ищется в порядке b_quote, b_base, c_quote, c_base, третья -
+    оставшаяся пара.
+
+    Parameters
+    ----------
+    t_pair : dict
+        Треугольник из markets.json.
+
+    Returns
+    -------
+    list
+        [[f1, f2, f3], [r1, r2, r3]] - коды ног для forward и reverse.
+    """
+    coins = [(t_pair[f"{p}_base"], t_pair[f"{p}_quote"]) for p in LEG_PREFIXES]
+    plan = []
+    for direction in DIRECTIONS:
+        # forward: начинаем с a_base (1 / a_ask), reverse: с a_quote (a_bid)
+        if direction == "forward":
+            codes = [0]
+            held = coins[0][1]
+        else:
+            codes = [1]
+            held = coins[0][0]
+
+        # Вторая нога
+        for leg, side in ((1, 1), (1, 0), (2, 1), (2, 0)):
+            if coins[leg][side] == held:
+                codes.append(2 * leg + side)
+                held = coins[leg][1 - side]
+                break
+        else:
+            raise ValueError(f"Не удалось построить маршрут для {t_pair['combined']}")
+
+        # Третья нога - оставшаяся пара
+        leg = 3 - codes[1] // 2
+        if coins[leg][0] == held:
+            codes.append(2 * leg)
+        elif coins[leg][1] == held:
+            codes.append(2 * leg + 1)
+        else:
+            raise ValueError(f"Не удалось построить маршрут для {t_pair['combined']}")
+        plan.append(codes)
+    return plan
+
+
+def get_route_plan(t_pair):
+    """
+    Возвращает маршрут треугольника, компилируя и кешируя его в t_pair при первом обращении.
+    """
+    plan = t_pair.get("route_plan")
+    if plan is None:
+        plan = compile_route_plan(t_pair)
+        t_pair["route_plan"] = plan
+    return plan
+
+
+def build_surface_dict(t_pair, direction_index, rates, starting_amount=1):
+    """
+    Собирает surface_dict в прежнем формате для найденной возможности.
+
+    Вызывается только для прибыльных треугольников, поэтому описания сделок
+    и словарь из 22 ключей не строятся на каждом тике.
+
+    Parameters
+    ----------
+    t_pair : dict
+        Треугольник из markets.json.
+    direction_index : int
+        0 - forward, 1 - reverse.
+    rates : sequence
+        Вектор курсов (1 / a_ask, a_bid, 1 / b_ask, b_bid, 1 / c_ask, c_bid).
+    starting_amount : float
+        Стартовый объём (по умолчанию 1, как в поверхностном расчёте).
+
+    Returns
+    -------
+    dict
+        surface_dict, который ожидает get_depth_from_orderbook.
+    """
+    codes = get_route_plan(t_pair)[direction_index]
+    direction = DIRECTIONS[direction_index]
+
+    if direction == "forward":
+        swap_1, swap_2 = t_pair["a_base"], t_pair["a_quote"]
+    else:
+        swap_1, swap_2 = t_pair["a_quote"], t_pair["a_base"]
+    # Монета после второй ноги: за bid получаем base, за 1 / ask - quote
+    leg_2 = LEG_PREFIXES[codes[1] // 2]
+    swap_3 = t_pair[f"{leg_2}_base"] if codes[1] % 2 else t_pair[f"{leg_2}_quote"]
+
+    swap_1_rate, swap_2_rate, swap_3_rate = (rates[code] for code in codes)
+    acquired_coin_t1 = starting_amount * swap_1_rate
+    acquired_coin_t2 = acquired_coin_t1 * swap_2_rate
+    acquired_coin_t3 = acquired_coin_t2 * swap_3_rate
+
+    profit_loss = acquired_coin_t3 - starting_amount
+    profit_loss_perc = (profit_loss / starting_amount) * 100 if profit_loss != 0 else 0
+
+    return {
+        "swap_1": swap_1,
+        "swap_2": swap_2,
+        "swap_3": swap_3,
+        "contract_1": t_pair[PAIR_KEYS[codes[0] // 2]],
+        "contract_2": t_pair[PAIR_KEYS[codes[1] // 2]],
+        "contract_3": t_pair[PAIR_KEYS[codes[2] // 2]],
+        "direction_trade_1": TRADE_DIRECTIONS[codes[0] % 2],
+        "direction_trade_2": TRADE_DIRECTIONS[codes[1] % 2],
+        "direction_trade_3": TRADE_DIRECTIONS[codes[2] % 2],
+        "starting_amount": starting_amount,
+        "acquired_coin_t1": acquired_coin_t1,
+        "acquired_coin_t2": acquired_coin_t2,
+        "acquired_coin_t3": acquired_coin_t3,
+        "swap_1_rate": swap_1_rate,
+        "swap_2_rate": swap_2_rate,
+        "swap_3_rate": swap_3_rate,
+        "profit_loss": profit_loss,
+        "profit_loss_perc": profit_loss_perc,
+        "direction": direction,
+        "trade_description_1": f"Start with {swap_1} of {starting_amount}. Swap at {swap_1_rate} for {swap_2} acquiring {acquired_coin_t1}.",
+        "trade_description_2": f"Swap {acquired_coin_t1} of {swap_2} at {swap_2_rate} for {swap_3} acquiring {acquired_coin_t2}.",
+        "trade_description_3": f"Swap {acquired_coin_t2} of {swap_3} at {swap_3_rate} for {swap_1} acquiring {acquired_coin_t3}."
+    }
+
+
+def calc_surface_rate(t_pair, a_ask, a_bid, b_ask, b_bid, c_ask, c_bid):
+    """
+    Горячий путь: поверхностный курс по скомпилированному маршруту.
+
+    Returns
+    -------
+    dict
+        surface_dict для первого прибыльного направления (forward, затем reverse)
+        или пустой словарь.
+    """
+    if not (a_ask and a_bid and b_ask and b_bid and c_ask and c_bid):
+        return {}
+
+    forward, reverse = get_route_plan(t_pair)
+    rates = (1 / a_ask, a_bid, 1 / b_ask, b_bid, 1 / c_ask, c_bid)
+
+    if rates[forward[0]] * rates[forward[1]] * rates[forward[2]] > 1:
+        return build_surface_dict(t_pair, 0, rates)
+    if rates[reverse[0]] * rates[reverse[1]] * rates[reverse[2]] > 1:
+        return build_surface_dict(t_pair, 1, rates)
+    return {}
+
+
+def best_surface_rate(t_pair, a_ask, a_bid, b_ask, b_bid, c_ask, c_bid):
+    """
+    Лучшее направление треугольника и его поверхностная доходность в процентах.
+
+    Нужна для статистики неприбыльных оценок, которые calc_surface_rate не описывает.
+
+    Returns
+    -------
+    tuple or None
+        (direction, profit_loss_perc) или None, если нет котировок.
+    """
+    if not (a_ask and a_bid and b_ask and b_bid and c_ask and c_bid):
+        return None
+
+    rates = (1 / a_ask, a_bid, 1 / b_ask, b_bid, 1 / c_ask, c_bid)
+    cycles = [rates[codes[0]] * rates[codes[1]] * rates[codes[2]] for codes in get_route_plan(t_pair)]
+    direction_index = 0 if cycles[0] >= cycles[1] else 1
+    return DIRECTIONS[direction_index], (cycles[direction_index] - 1) * 100
@@ -0,0 +1,40 @@
+from balance_ledger import BalanceLedger
+
+
+def wallet_event(creation_time, **free):
+    return {"creationTime": creation_time,
+            "data": [{"coin": [{"coin": coin, "free": str(amount)} for coin, amount in free.items()]}]}
+
+
+def buy_order(executed):
+    # Покупка 0.01 BTC за 600 USDT, комиссия 0.00001 BTC
+    return {"symbol": "BTC/USDT", "side": "buy", "filled": 0.01, "cost": 600.0,
+            "fee": {"cost": 0.00001, "currency": "BTC"}, "lastUpdateTimestamp": executed}
+
+
+def test_order_result_after_snapshot_is_not_counted_twice():
+    ledger = BalanceLedger(None)
+    ledger.apply_wallet_event(wallet_event(1000, BTC=1.0, USDT=1000.0))
+    # Снимок после исполнения уже учёл ордер, а результат ордера пришёл позже снимка
+    ledger.apply_wallet_event(wallet_event(3000, BTC=1.00999, USDT=400.0))
+    ledger.apply_order(buy_order(2000))
+
+    assert ledger.get("BTC") == 1.00999
+    assert ledger.get("USDT") == 400.0
+    assert ledger.pending == []
+
+
+def test_order_result_applies_only_to_coins_without_newer_snapshot():
+    ledger = BalanceLedger(None)
+    ledger.apply_wallet_event(wallet_event(1000, BTC=1.0, USDT=1000.0))
+    ledger.apply_wallet_event(wallet_event(3000, USDT=400.0))
+    ledger.apply_order(buy_order(2000))
+
+    assert abs(ledger.get("BTC") - 1.00999) < 1e-12
+    assert ledger.get("USDT") == 400.0
+    # Ожидает снимка только изменение BTC
+    assert [coin for _, deltas in ledger.pending for coin, _ in deltas] == ["BTC", "BTC"]
+
+    ledger.apply_wallet_event(wallet_event(4000, BTC=1.00999))
+    assert ledger.get("BTC") == 1.00999
+    assert ledger.pending == []
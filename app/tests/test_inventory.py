@@ -0,0 +1,67 @@
+from inventory import InventoryRebalancer, trade_legs
+from market_metadata import MarketMetadata
+from surface_rate import build_surface_dict
+from triangles import TriangleCatalog, make_match_dict
+
+TRADE_AMOUNTS = {"USDT": 100, "BTC": 0.0001, "ETH": 0.01}
+PRICES = {"BTC/USDT": 60000, "ETH/USDT": 3000, "ETH/BTC": 0.05, "ALT/USDT": 0.5, "ALT/BTC": 0.5 / 60000}
+
+
+def market(symbol):
+    base, quote = symbol.split('/')
+    return {"symbol": symbol, "base": base, "quote": quote,
+            "limits": {"amount": {"min": 0}, "cost": {"min": 0}}}
+
+
+def setup_rebalancer():
+    metadata = MarketMetadata()
+    metadata.update([market(symbol) for symbol in PRICES])
+    catalog = TriangleCatalog([
+        make_match_dict(market("BTC/USDT"), market("ETH/USDT"), market("ETH/BTC")),
+        make_match_dict(market("BTC/USDT"), market("ALT/USDT"), market("ALT/BTC"))
+    ])
+    price_table = {symbol: {"bid": price * 0.999, "ask": price * 1.001} for symbol, price in PRICES.items()}
+    return InventoryRebalancer(TRADE_AMOUNTS, catalog, None, metadata), catalog, price_table
+
+
+def trade_inputs(catalog, price_table):
+    """
+    Наибольший вход ноги по каждой монете для сделок обоих направлений всех треугольников.
+    """
+    inputs = {}
+    for t_pair in catalog.pairs:
+        rates = []
+        for symbol in (t_pair["pair_a"], t_pair["pair_b"], t_pair["pair_c"]):
+            rates += [1 / price_table[symbol]["ask"], price_table[symbol]["bid"]]
+        for direction_index in (0, 1):
+            legs = trade_legs(build_surface_dict(t_pair, direction_index, rates))
+            amount = TRADE_AMOUNTS.get(legs[0]["coin_in"], 100)
+            for leg in legs:
+                inputs[leg["coin_in"]] = max(inputs.get(leg["coin_in"], 0), amount)
+                amount *= leg["rate"]
+    return inputs
+
+
+def test_plan_does_not_sell_below_one_trade():
+    rebalancer, catalog, price_table = setup_rebalancer()
+    balances = {"USDT": {"free": 10000}, "BTC": {"free": 1}, "ETH": {"free": 10}, "ALT": {"free": 100000}}
+
+    orders = rebalancer.plan(balances, price_table)
+
+    sold = {symbol.split('/')[0]: amount for symbol, side, amount, _ in orders if side == 'sell'}
+    assert sold.keys() == {"BTC", "ETH", "ALT"}
+    for coin, needed in trade_inputs(catalog, price_table).items():
+        assert balances[coin]["free"] - sold.get(coin, 0) >= needed
+
+
+def test_plan_buys_coins_without_trade_amount():
+    rebalancer, catalog, price_table = setup_rebalancer()
+    balances = {"USDT": {"free": 10000}, "BTC": {"free": 0}, "ETH": {"free": 0}, "ALT": {"free": 0}}
+
+    orders = rebalancer.plan(balances, price_table)
+
+    bought = {symbol.split('/')[0]: amount for symbol, side, amount, _ in orders if side == 'buy'}
+    assert "ALT" in bought
+    for coin, needed in trade_inputs(catalog, price_table).items():
+        if coin != "USDT":
+            assert bought[coin] >= needed
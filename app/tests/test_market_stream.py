@@ -0,0 +1,40 @@
+import asyncio
+
+from market_stream import BybitOrderBookStream
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+def book_message(kind, update_id):
+    return {"topic": "orderbook.50.BTCUSDT", "type": kind, "ts": update_id,
+            "data": {"s": "BTCUSDT", "b": [["100", "1"]], "a": [["101", "1"]], "u": update_id}}
+
+
+def test_unsynced_deltas_request_one_resync():
+    async def scenario():
+        transport = RecordingTransport()
+        stream = BybitOrderBookStream(transport, {"BTCUSDT": "BTC/USDT"}, {})
+        stream.connected = True
+
+        assert stream.handle_message(book_message("snapshot", 1)) == "BTC/USDT"
+        # Пропущено обновление 2: все дельты после разрыва невалидны
+        for update_id in range(3, 13):
+            assert stream.handle_message(book_message("delta", update_id)) is None
+        assert len(stream.resync_tasks) == 1
+        await asyncio.gather(*stream.resync_tasks)
+        await asyncio.sleep(0)
+        assert [message["op"] for message in transport.sent] == ["unsubscribe", "subscribe"]
+        assert not stream.resync_tasks
+
+        # Снимок снимает флаг: следующая дельта применяется
+        assert stream.handle_message(book_message("snapshot", 20)) == "BTC/USDT"
+        assert stream.handle_message(book_message("delta", 21)) == "BTC/USDT"
+        assert not stream.resyncing
+
+    asyncio.run(scenario())
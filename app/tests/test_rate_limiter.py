@@ -0,0 +1,26 @@
+import asyncio
+import time
+
+from rate_limiter import PriorityRateLimiter
+
+
+def limit_headers(remaining, limit=10, reset_in=5.0):
+    return {"X-Bapi-Limit": str(limit), "X-Bapi-Limit-Status": str(remaining),
+            "X-Bapi-Limit-Reset-Timestamp": str((time.time() + reset_in) * 1000)}
+
+
+def test_low_fetch_order_quota_does_not_delay_create_order():
+    async def scenario():
+        limiter = PriorityRateLimiter(50, reserve=10)
+        # Квота fetch_order почти исчерпана - он на паузе до сброса окна
+        assert limiter.observe_headers("fetch_order", limit_headers(0)) == 0
+        status = asyncio.create_task(limiter.acquire("fetch_order"))
+        await asyncio.sleep(0)
+
+        started = time.monotonic()
+        await asyncio.wait_for(limiter.acquire("create_order"), timeout=1)
+        assert time.monotonic() - started < 0.1
+        assert not status.done()
+        status.cancel()
+
+    asyncio.run(scenario())
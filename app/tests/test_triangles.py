@@ -0,0 +1,40 @@
+import triangles
+from triangles import TriangleCatalog, find_triangular_pairs
+
+
+def market(symbol):
+    base, quote = symbol.split('/')
+    return {"symbol": symbol, "base": base, "quote": quote, "active": True}
+
+
+MARKETS = [market(symbol) for symbol in ("BTC/USDT", "ETH/USDT", "ETH/BTC", "SOL/USDT", "DOGE/USDT")]
+
+
+def test_saved_market_symbols_keep_first_sync_incremental(tmp_path, monkeypatch):
+    path = str(tmp_path / "markets.json")
+    catalog = TriangleCatalog(find_triangular_pairs(MARKETS))
+    catalog.market_symbols = {x['symbol'] for x in MARKETS}
+    catalog.save(path)
+
+    loaded = TriangleCatalog.load(path)
+    assert loaded.market_symbols == catalog.market_symbols
+
+    searched = []
+    find = triangles.find_triangles_with_markets
+    monkeypatch.setattr(triangles, "find_triangles_with_markets",
+                        lambda markets, new_indices, known=None: searched.extend(new_indices) or
+                        find(markets, new_indices, known))
+    # Рынки без треугольников (SOL, DOGE) не считаются новыми, новый листинг - считается
+    added, removed = loaded.apply_markets(MARKETS + [market("SOL/BTC")])
+    assert searched == [len(MARKETS)]
+    assert [t['combined'] for t in added] == ["BTC/USDT,SOL/USDT,SOL/BTC"]
+    assert removed == []
+
+
+def test_catalog_without_saved_symbols_still_loads(tmp_path):
+    path = str(tmp_path / "markets.json")
+    TriangleCatalog(find_triangular_pairs(MARKETS)).save(path)
+
+    loaded = TriangleCatalog.load(path)
+    assert loaded.market_symbols is None
+    assert len(loaded.pairs) == 1
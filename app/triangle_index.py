@@ -0,0 +1,92 @@
+from surface_rate import PAIR_KEYS
+
+
+class TriangleIndex:
+    """
+    Обратный индекс symbol -> id треугольников с версиями котировок.
+
+    id треугольника - его позиция в списке pairs (совпадает с индексом
+    в SurfaceRateEngine). Каждое реальное изменение bid/ask символа увеличивает
+    его версию и помечает треугольники с этим символом как «грязные»;
+    drain_dirty отдаёт их к пересчёту, а is_stale показывает, изменился ли
+    кортеж версий трёх ног с момента последней оценки.
+
+    Parameters
+    ----------
+    pairs : list
+        Треугольники из markets.json.
+    """
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+        self.symbol_triangles = {}
+        self.legs = []
+        for t, t_pair in enumerate(pairs):
+            legs = tuple(t_pair[key] for key in PAIR_KEYS)
+            self.legs.append(legs)
+            for symbol in legs:
+                self.symbol_triangles.setdefault(symbol, []).append(t)
+
+        self.versions = dict.fromkeys(self.symbol_triangles, 0)
+        self.quotes = {}
+        self.evaluated = [None] * len(pairs)
+        self.dirty = set()
+
+    def triangles_for(self, symbol):
+        return self.symbol_triangles.get(symbol, ())
+
+    def update_quote(self, symbol, bid, ask):
+        """
+        Регистрирует котировку символа.
+
+        Returns
+        -------
+        bool
+            True, если bid/ask изменились и треугольники помечены к пересчёту.
+        """
+        if symbol not in self.versions:
+            return False
+        quote = (bid, ask)
+        if self.quotes.get(symbol) == quote:
+            return False
+        self.quotes[symbol] = quote
+        self.versions[symbol] += 1
+        self.dirty.update(self.symbol_triangles[symbol])
+        return True
+
+    def update_tickers(self, tickers):
+        """
+        Регистрирует снимок fetch_tickers.
+
+        Returns
+        -------
+        int
+            Количество символов, котировки которых изменились.
+        """
+        changed = 0
+        for symbol, ticker in tickers.items():
+            changed += self.update_quote(symbol, ticker.get('bid'), ticker.get('ask'))
+        return changed
+
+    def version_key(self, t):
+        versions = self.versions
+        a, b, c = self.legs[t]
+        return versions[a], versions[b], versions[c]
+
+    def is_stale(self, t):
+        """
+        True, если котировки ног треугольника менялись с момента его последней оценки.
+        """
+        return self.evaluated[t] != self.version_key(t)
+
+    def mark_evaluated(self, t):
+        self.evaluated[t] = self.version_key(t)
+        self.dirty.discard(t)
+
+    def drain_dirty(self):
+        """
+        Забирает треугольники, помеченные к пересчёту, не отмечая их оценёнными
+        (оценку выполняет тот, кто их обслуживает, через is_stale / mark_evaluated).
+        """
+        dirty, self.dirty = self.dirty, set()
+        return dirty
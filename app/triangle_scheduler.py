@@ -0,0 +1,243 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TriangleScheduler:
+    """
+    Пул долгоживущих воркеров, непрерывно обслуживающих треугольники без общего барьера.
+
+    У каждого треугольника свой срок следующего визита. Свободный воркер забирает
+    все треугольники с наступившим сроком (не больше batch_size) одним пакетом,
+    вызывает handler(batch) - пакет оценивается одним векторным проходом - и ставит
+    каждый на повтор через его интервал от начала обработки. Медленный пакет
+    занимает только свой воркер - остальные продолжают работу. kick(t) переносит
+    визит на «сейчас» (например, когда изменилась котировка ноги); один треугольник
+    никогда не обрабатывается двумя воркерами одновременно.
+
+    Parameters
+    ----------
+    handler : callable
+        Асинхронная функция handler(batch), batch - список id треугольников.
+    concurrency : int
+        Количество воркеров.
+    revisit_interval : float
+        Целевой интервал между визитами одного треугольника (сек).
+    interval_for : callable, optional
+        interval_for(t) - индивидуальный интервал треугольника (например, VolatilityTracker.interval);
+        по умолчанию для всех revisit_interval.
+    batch_size : int
+        Наибольший пакет треугольников одного вызова handler.
+    """
+
+    def __init__(self, handler, concurrency=16, revisit_interval=1.0, interval_for=None, batch_size=1024):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.revisit_interval = revisit_interval
+        self.interval_for = interval_for
+        self.batch_size = batch_size
+        self.heap = []  # (due, seq, t)
+        self.due = {}  # t -> актуальный срок в heap
+        self.busy = set()
+        self.kicked = set()  # t, которые пнули во время обработки
+        self.generation = 0
+        self.seq = 0
+        self.wakeup = asyncio.Event()
+        self.workers = []
+        self.stats = {"visits": 0, "batches": 0, "errors": 0, "lag": 0.0, "busy_time": 0.0}
+
+    def schedule(self, t, at):
+        """
+        Ставит визит t на момент at (time.monotonic); более ранний уже назначенный срок сохраняется.
+        """
+        if t in self.busy:
+            if at <= time.monotonic():
+                self.kicked.add(t)
+            return
+        if self.due.get(t, float('inf')) <= at:
+            return
+        self.due[t] = at
+        self.seq += 1
+        heapq.heappush(self.heap, (at, self.seq, t))
+        self.wakeup.set()
+
+    def kick(self, t):
+        """
+        Обслужить треугольник как можно скорее.
+        """
+        self.schedule(t, time.monotonic())
+
+    def reset(self, triangles):
+        """
+        Заменяет набор треугольников (например, после обновления каталога, когда id
+        перенумерованы); все они ставятся в очередь немедленно. Результаты обработки,
+        начатой до сброса, не перепланируются.
+        """
+        self.generation += 1
+        self.heap = []
+        self.due = {}
+        self.kicked = set()
+        now = time.monotonic()
+        for t in triangles:
+            self.schedule(t, now)
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def _next(self):
+        """
+        Ждёт наступивших визитов и забирает их из очереди (не больше batch_size).
+        """
+        while True:
+            now = time.monotonic()
+            batch = []
+            while self.heap and len(batch) < self.batch_size:
+                at, _, t = self.heap[0]
+                # Ленивое удаление: запись устарела, если срок t с тех пор изменился
+                if self.due.get(t) != at:
+                    heapq.heappop(self.heap)
+                    continue
+                if at > now:
+                    break
+                heapq.heappop(self.heap)
+                del self.due[t]
+                self.stats["lag"] += now - at
+                batch.append(t)
+            if batch:
+                return batch
+
+            timeout = self.heap[0][0] - now if self.heap else None
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            batch = await self._next()
+            generation = self.generation
+            started = time.monotonic()
+            self.busy.update(batch)
+            try:
+                await self.handler(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Ошибка обработки пакета из {len(batch)} треугольников: {str(e)}")
+            finally:
+                self.busy.difference_update(batch)
+                self.stats["visits"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["busy_time"] += time.monotonic() - started
+                if generation == self.generation:
+                    now = time.monotonic()
+                    for t in batch:
+                        kicked = t in self.kicked
+                        self.kicked.discard(t)
+                        interval = self.interval_for(t) if self.interval_for else self.revisit_interval
+                        self.schedule(t, now if kicked else started + interval)
+
+    def summary(self):
+        """
+        Строка статистики для лога: визиты, ошибки, средняя задержка визита относительно срока,
+        средний размер пакета и среднее время его обработки.
+        """
+        visits = self.stats["visits"] or 1
+        batches = self.stats["batches"] or 1
+        return (f"визитов {self.stats['visits']}, ошибок {self.stats['errors']}, "
+                f"ср. опоздание {self.stats['lag'] / visits * 1000:.0f} мс, "
+                f"ср. пакет {self.stats['visits'] / batches:.0f}, "
+                f"ср. обработка пакета {self.stats['busy_time'] / batches * 1000:.0f} мс, в очереди {len(self.due)}")
+
+
+class VolatilityTracker:
+    """
+    Близость треугольников к прибыльности по недавним поверхностным курсам.
+
+    Для каждого треугольника ведутся экспоненциально сглаженные среднее и дисперсия
+    лучшего (из двух направлений) поверхностного курса в процентах. Разрыв до порога
+    прибыльности, измеренный в стандартных отклонениях, определяет интервал визитов:
+    «горячие» треугольники (разрыв не больше hot_zscore) посещаются каждые hot_interval,
+    остальные - реже пропорционально разрыву, но не реже cold_interval (фоновый круг).
+
+    Parameters
+    ----------
+    threshold : float
+        Порог прибыльности поверхностного курса, %.
+    hot_interval, cold_interval : float
+        Интервалы визитов горячего и самого холодного треугольника (сек).
+    hot_zscore : float
+        Разрыв до порога в стандартных отклонениях, при котором треугольник считается горячим.
+    alpha : float
+        Вес нового наблюдения в сглаживании.
+    min_std : float
+        Нижняя граница стандартного отклонения, % (у «застывших» треугольников дисперсия около нуля).
+    """
+
+    def __init__(self, threshold=0.0, hot_interval=1.0, cold_interval=15.0, hot_zscore=3.0, alpha=0.1, min_std=0.01):
+        self.threshold = threshold
+        self.hot_interval = hot_interval
+        self.cold_interval = cold_interval
+        self.hot_zscore = hot_zscore
+        self.alpha = alpha
+        self.min_std = min_std
+        self.mean = {}
+        self.var = {}
+
+    def reset(self):
+        self.mean = {}
+        self.var = {}
+
+    def observe(self, t, surface_rate):
+        """
+        Учитывает лучший поверхностный курс треугольника (%); NaN (нет котировок) пропускается.
+        """
+        if surface_rate is None or math.isnan(surface_rate):
+            return
+        mean = self.mean.get(t)
+        if mean is None:
+            self.mean[t] = surface_rate
+            self.var[t] = 0.0
+            return
+        diff = surface_rate - mean
+        self.mean[t] = mean + self.alpha * diff
+        self.var[t] = (1 - self.alpha) * (self.var[t] + self.alpha * diff * diff)
+
+    def zscore(self, t):
+        """
+        Разрыв до порога в стандартных отклонениях; 0 - для ещё не наблюдавшихся и уже прибыльных.
+        """
+        mean = self.mean.get(t)
+        if mean is None:
+            return 0.0
+        std = max(math.sqrt(self.var[t]), self.min_std)
+        return max(self.threshold - mean, 0.0) / std
+
+    def is_hot(self, t):
+        return self.zscore(t) <= self.hot_zscore
+
+    def interval(self, t):
+        """
+        Интервал до следующего визита треугольника (сек).
+        """
+        zscore = self.zscore(t)
+        if zscore <= self.hot_zscore:
+            return self.hot_interval
+        return min(self.hot_interval * zscore / self.hot_zscore, self.cold_interval)
+
+    def summary(self):
+        hot = sum(self.is_hot(t) for t in self.mean)
+        return f"горячих {hot} из {len(self.mean)}"
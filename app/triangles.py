@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+
+from surface_rate import get_route_plan
+
+logger = logging.getLogger(__name__)
+
+
+def build_currency_index(markets):
+    """
+    Строит индекс смежности валют по списку рынков.
+
+    Parameters
+    ----------
+    markets : list
+        Список рынков в формате ccxt (ключи 'symbol', 'base', 'quote').
+
+    Returns
+    -------
+    tuple
+        (currency_index, edge_index):
+            - currency_index : dict, валюта -> список индексов рынков с этой валютой
+            - edge_index : dict, frozenset({base, quote}) -> список индексов рынков
+    """
+    currency_index = {}
+    edge_index = {}
+    for i, market in enumerate(markets):
+        base, quote = market['base'], market['quote']
+        if base == quote:
+            continue
+        currency_index.setdefault(base, []).append(i)
+        currency_index.setdefault(quote, []).append(i)
+        edge_index.setdefault(frozenset((base, quote)), []).append(i)
+    return currency_index, edge_index
+
+
+def make_match_dict(pair_a, pair_b, pair_c):
+    """
+    Формирует запись треугольника в формате markets.json вместе с route_plan.
+    """
+    match_dict = {
+        "a_base": pair_a['base'],
+        "b_base": pair_b['base'],
+        "c_base": pair_c['base'],
+        "a_quote": pair_a['quote'],
+        "b_quote": pair_b['quote'],
+        "c_quote": pair_c['quote'],
+        "pair_a": pair_a['symbol'],
+        "pair_b": pair_b['symbol'],
+        "pair_c": pair_c['symbol'],
+        "combined": ",".join([pair_a['symbol'], pair_b['symbol'], pair_c['symbol']])
+    }
+    # Маршрут ног для обоих направлений компилируется один раз при поиске
+    get_route_plan(match_dict)
+    return match_dict
+
+
+def find_triangular_pairs(markets):
+    """
+    Находит все треугольники (3-циклы валют) среди рынков.
+
+    Вместо полного перебора pair_a × pair_b × pair_c обходит только соседей
+    по индексу смежности валют, поэтому работа пропорциональна числу реальных
+    треугольников, а не кубу числа рынков. Порядок и ориентация треугольников
+    совпадают с прежним перебором: каждый треугольник выдаётся один раз,
+    рынки в нём идут в порядке их следования в markets.
+
+    Parameters
+    ----------
+    markets : list
+        Список рынков в формате ccxt.
+
+    Returns
+    -------
+    list
+        Список словарей треугольников (ключи как в markets.json).
+    """
+    currency_index, edge_index = build_currency_index(markets)
+    triangular_pairs_list = []
+    seen = set()
+
+    for i, pair_a in enumerate(markets):
+        a_base, a_quote = pair_a['base'], pair_a['quote']
+        if a_base == a_quote:
+            continue
+
+        # Соседи pair_a с бóльшим индексом: треугольник {i, j, k} при i < j < k
+        # впервые встречался в старом переборе именно как (i, j, k)
+        neighbours = sorted({j for j in currency_index[a_base] + currency_index[a_quote] if j > i})
+
+        for j in neighbours:
+            pair_b = markets[j]
+            b_base, b_quote = pair_b['base'], pair_b['quote']
+
+            # Валюта, которую pair_b добавляет к pair_a, и валюта pair_a, которую нужно замкнуть
+            if b_base in (a_base, a_quote) and b_quote not in (a_base, a_quote):
+                new_coin, shared_coin = b_quote, b_base
+            elif b_quote in (a_base, a_quote) and b_base not in (a_base, a_quote):
+                new_coin, shared_coin = b_base, b_quote
+            else:
+                continue
+            closing_coin = a_quote if shared_coin == a_base else a_base
+
+            for k in edge_index.get(frozenset((new_coin, closing_coin)), ()):
+                if k <= j:
+                    continue
+                pair_c = markets[k]
+                unique_item = frozenset((pair_a['symbol'], pair_b['symbol'], pair_c['symbol']))
+                if unique_item in seen:
+                    continue
+                seen.add(unique_item)
+
+                match_dict = make_match_dict(pair_a, pair_b, pair_c)
+                triangular_pairs_list.append(match_dict)
+                logger.debug(f"triangular pairs is : \n{match_dict}")
+
+    return triangular_pairs_list
+
+
+def filter_spot_markets(markets):
+    """
+    Оставляет только спотовые активные рынки (без деривативов и делистингов).
+    """
+    return [x for x in markets if ':' not in x['symbol'] and x.get('active', True) is not False]
+
+
+def is_tradable_triangle(t_pair):
+    """
+    Фильтр треугольников, которые попадают в markets.json.
+    """
+    return 'EUR' not in t_pair['combined']
+
+
+def find_triangles_with_markets(markets, new_indices, known=None):
+    """
+    Находит только те треугольники, в которые входит хотя бы один из рынков new_indices.
+
+    Parameters
+    ----------
+    markets : list
+        Полный текущий список рынков в формате ccxt.
+    new_indices : iterable
+        Индексы новых рынков в markets.
+    known : set, optional
+        Множество frozenset символов уже известных треугольников (пропускаются).
+
+    Returns
+    -------
+    list
+        Список словарей новых треугольников. Рынки в треугольнике упорядочены
+        по индексу в markets, как и в find_triangular_pairs.
+    """
+    currency_index, edge_index = build_currency_index(markets)
+    seen = set(known) if known else set()
+    found = []
+
+    for n in sorted(set(new_indices)):
+        x, y = markets[n]['base'], markets[n]['quote']
+        if x == y:
+            continue
+        for m in currency_index.get(x, ()):
+            if m == n:
+                continue
+            other = markets[m]
+            z = other['quote'] if other['base'] == x else other['base']
+            if z in (x, y):
+                continue
+            for k in edge_index.get(frozenset((y, z)), ()):
+                unique_item = frozenset((markets[n]['symbol'], other['symbol'], markets[k]['symbol']))
+                if unique_item in seen:
+                    continue
+                seen.add(unique_item)
+                i, j, k = sorted((n, m, k))
+                found.append(make_match_dict(markets[i], markets[j], markets[k]))
+
+    return found
+
+
+class TriangleCatalog:
+    """
+    Каталог треугольников (содержимое markets.json) с инкрементальным обновлением.
+
+    Список pairs заменяется целиком при каждом изменении, поэтому основной цикл
+    может безопасно итерироваться по ранее полученной ссылке.
+
+    Символы рынков последней синхронизации сохраняются рядом с каталогом
+    (symbols_path), поэтому после перезапуска новыми считаются только листинги,
+    появившиеся с момента сохранения; формат самого markets.json не меняется.
+    """
+
+    def __init__(self, pairs=None):
+        self.pairs = list(pairs or [])
+        self.symbols = set()
+        for t_pair in self.pairs:
+            self.symbols.update((t_pair['pair_a'], t_pair['pair_b'], t_pair['pair_c']))
+            # Старые markets.json без route_plan компилируются при загрузке
+            get_route_plan(t_pair)
+        # Символы рынков на момент последней синхронизации (None - ещё не синхронизировались)
+        self.market_symbols = None
+
+    @staticmethod
+    def symbols_path(path):
+        return f"{os.path.splitext(path)[0]}_symbols.json"
+
+    @classmethod
+    def load(cls, path='markets.json'):
+        with open(path) as json_file:
+            catalog = cls(json.load(json_file))
+        try:
+            with open(cls.symbols_path(path)) as json_file:
+                catalog.market_symbols = set(json.load(json_file))
+        except (OSError, ValueError):
+            # Каталог без сохранённых символов: первая синхронизация сравнит рынки с symbols
+            pass
+        return catalog
+
+    def save(self, path='markets.json'):
+        with open(path, 'w') as f:
+            json.dump(self.pairs, f)
+        if self.market_symbols is not None:
+            with open(self.symbols_path(path), 'w') as f:
+                json.dump(sorted(self.market_symbols), f)
+
+    def apply_markets(self, markets):
+        """
+        Сравнивает актуальный fetch_markets с каталогом и добавляет/удаляет только затронутые треугольники.
+
+        Parameters
+        ----------
+        markets : list
+            Результат fetch_markets.
+
+        Returns
+        -------
+        tuple
+            (added, removed) - списки добавленных и удалённых треугольников.
+        """
+        markets = filter_spot_markets(markets)
+        current_symbols = {x['symbol'] for x in markets}
+
+        # Делистинг: убираем треугольники, где хотя бы одной ноги больше нет
+        removed = [t for t in self.pairs
+                   if not {t['pair_a'], t['pair_b'], t['pair_c']} <= current_symbols]
+        pairs = [t for t in self.pairs
+                 if {t['pair_a'], t['pair_b'], t['pair_c']} <= current_symbols]
+
+        # Листинг: ищем треугольники только вокруг новых рынков
+        known = {frozenset((t['pair_a'], t['pair_b'], t['pair_c'])) for t in pairs}
+        previous_symbols = self.market_symbols if self.market_symbols is not None else self.symbols
+        new_indices = [i for i, x in enumerate(markets) if x['symbol'] not in previous_symbols]
+        added = []
+        if new_indices:
+            added = [t for t in find_triangles_with_markets(markets, new_indices, known)
+                     if is_tradable_triangle(t)]
+        self.market_symbols = current_symbols
+
+        if added or removed:
+            self.pairs = pairs + added
+            self.symbols = set()
+            for t_pair in self.pairs:
+                self.symbols.update((t_pair['pair_a'], t_pair['pair_b'], t_pair['pair_c']))
+        return added, removed